@@ -1,35 +1,45 @@
-from flask import Flask, jsonify, render_template, request, send_file
+from flask import Flask, g, jsonify, render_template, request, send_file
 from flask_cors import CORS
-from database import Database
-from photo_tree import PhotoTree
-from config import TABLE_NAME
+from database import Database, PHOTO_COLUMNS
+from exports import iter_csv, iter_ndjson
+from photo_query import decode_keyset_cursor, encode_keyset_cursor, parse_query_filters
+from tree_cache import get_tree_cache
+from photo_tree import status_counts
+from thumbnails import ThumbnailError, build_thumbnail_url, get_thumbnail_service
+from previews import get_preview_service
+from prefetch import get_prefetcher
+from image_workers import WorkerPoolBusy
+from config import TABLE_NAME, TREE_PAGE_SIZE, TREE_MAX_PAGE_SIZE, THUMBNAIL_MAX_AGE, PREVIEW_MAX_AGE
+from config import PREFETCH_ENABLED, PREFETCH_SIBLINGS, STATS_SUMMARY_ENABLED
+from config import CHANGE_FEED_ENABLED, CHANGE_FEED_KEEPALIVE
+from config import DUPLICATE_MAX_DISTANCE, DUPLICATE_DISTANCE_LIMIT
+from config import DEBUG, LOG_LEVEL, METRICS_ENABLED, TRACE_SAMPLE_RATE, TRACE_HEADER
+from config import RESPONSE_COMPRESSION, COMPRESS_MIN_BYTES
+from metrics import REGISTRY, HTTP_REQUEST_SECONDS, current_trace, finish_trace, should_trace, start_trace
+from change_feed import get_change_feed
+from scanner import get_scanner
+from duplicates import find_duplicate_clusters
+from serialization import EncodedPayloadCache, columnar_tree, dumps, negotiate_encoding, compress
 import json
-import requests
-import os
-import io
 import logging
-from PIL import Image
-from datetime import datetime
+import queue
+import time
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 
 # Настройка логирования
+# force: модули, импортированные выше, уже могли настроить логирование
 logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+    level=getattr(logging, LOG_LEVEL, logging.INFO),
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    force=True
 )
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
 
-# Включаем режим отладки Flask
-app.debug = True
-
-# Настраиваем логирование Flask
-if not app.debug:
-    file_handler = logging.FileHandler('flask.log')
-    file_handler.setLevel(logging.DEBUG)
-    app.logger.addHandler(file_handler)
-    app.logger.setLevel(logging.DEBUG)
+# Режим отладки Flask включается через FLASK_DEBUG
+app.debug = DEBUG
 
 # Загружаем версию из package.json
 with open('package.json', 'r') as f:
@@ -38,96 +48,446 @@ with open('package.json', 'r') as f:
 
 # Создаем таблицу photos, если она не существует
 def create_photos_table():
-    db = Database()
-    if db.connect():
-        try:
+    try:
+        with Database() as db:
             db.ensure_table_schema()  # Используем метод из класса Database
             print("✅ Таблица успешно создана или уже существует")
-        except Exception as e:
-            print(f"❌ Ошибка при создании таблицы: {str(e)}")
-        finally:
-            db.close()
-    else:
+            if STATS_SUMMARY_ENABLED:
+                db.ensure_directory_summary()
+    except ConnectionError:
         print("❌ Ошибка подключения к базе данных при создании таблицы")
+    except Exception as e:
+        print(f"❌ Ошибка при создании таблицы: {str(e)}")
 
-# Создаем таблицу при запуске приложения
-create_photos_table()
+def init_app():
+    """
+    Запускает то, что нужно только процессу сервера: лог-файл, схему таблицы и ленту изменений
+
+    Вызывается из __main__, а не при импорте: процессы пула изображений
+    (spawn) импортируют этот модуль заново как __mp_main__, и каждый из
+    них иначе выполнял бы DDL и открывал свое LISTEN-соединение.
+    WSGI-сервер должен вызвать init_app() сам после импорта app.
+    """
+    # Настраиваем логирование Flask
+    if not app.debug:
+        file_handler = logging.FileHandler('flask.log')
+        file_handler.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        app.logger.addHandler(file_handler)
+        app.logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+
+    # Создаем таблицу при запуске приложения
+    create_photos_table()
+
+    # Изменения из других процессов патчат закэшированное дерево
+    if CHANGE_FEED_ENABLED:
+        get_change_feed().add_listener(get_tree_cache().apply_change_event)
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    # Подробная трассировка: по заголовку клиента или для доли запросов
+    if should_trace(request.headers.get(TRACE_HEADER) == '1', TRACE_SAMPLE_RATE):
+        start_trace(f"{request.method} {request.path}")
+
+@app.after_request
+def finish_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint,
+                                     method=request.method, status=response.status_code)
+    trace = finish_trace()
+    if trace is not None:
+        response.headers['Server-Timing'] = trace.server_timing()
+        spans = '; '.join(f"{category} {seconds * 1000:.1f} мс {detail}".rstrip()
+                          for category, seconds, detail in trace.spans)
+        logger.info(f"🔍 {trace.name} -> {response.status_code}: {response.headers['Server-Timing']}"
+                    + (f" | {spans}" if spans else ""))
+    return response
+
+@app.route('/metrics')
+def get_metrics():
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Метрики отключены'}), 404
+    return app.response_class(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/')
 def index():
     return render_template('index.html', version=version)
 
+# Закодированное дерево по формату, одна версия на формат
+_tree_payloads = EncodedPayloadCache()
+TREE_FORMATS = ('nested', 'columnar')
+
+def response_encoding(size: int):
+    """
+    Кодировка сжатия ответа размера size по Accept-Encoding клиента
+    """
+    if not RESPONSE_COMPRESSION or size < COMPRESS_MIN_BYTES:
+        return None
+    return negotiate_encoding(request.accept_encodings)
+
+def json_bytes_response(body: bytes, encoding=None, status: int = 200):
+    """
+    Ответ с готовым (возможно, сжатым) JSON
+    """
+    response = app.response_class(body, status=status, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def json_response(payload, status: int = 200):
+    """
+    Быстрая сериализация и сжатие большого ответа (вместо jsonify)
+    """
+    body = dumps(payload)
+    encoding = response_encoding(len(body))
+    return json_bytes_response(compress(body, encoding) if encoding else body, encoding, status)
+
 @app.route('/api/tree')
 def get_tree():
     logger.debug("Получен запрос на получение дерева")
-    db = Database()
-    if not db.connect():
+    tree_format = request.args.get('format', 'nested')
+    if tree_format not in TREE_FORMATS:
+        return jsonify({'error': f"Параметр format должен быть одним из: {', '.join(TREE_FORMATS)}"}), 400
+    cache = get_tree_cache()
+    try:
+        tree, etag = cache.get()
+    except ConnectionError:
         logger.error("Ошибка подключения к базе данных")
         return jsonify({'error': 'Ошибка подключения к базе данных'}), 500
-        
-    try:
-        tree = PhotoTree(db)
-        tree.build_tree()
-        logger.debug("Дерево успешно построено")
-        return jsonify(tree.tree)
     except Exception as e:
         logger.error(f"Ошибка при построении дерева: {str(e)}")
         return jsonify({'error': str(e)}), 500
-    finally:
-        db.close()
 
-@app.route('/api/thumbnail/<path:photo_path>')
-def get_thumbnail(photo_path):
-    # Обрабатываем путь, чтобы получить миниатюру
-    # Ищем позицию "Pictures/!Фотосессии" в пути
-    target_prefix = "Pictures/!Фотосессии"
-    processed_path = photo_path
-    
-    # Удаляем префикс /mnt/smb/OneDrive из пути
-    if photo_path.startswith('/mnt/smb/OneDrive/'):
-        processed_path = photo_path[len('/mnt/smb/OneDrive/'):]
-    elif photo_path.startswith('mnt/smb/OneDrive/'):
-        processed_path = photo_path[len('mnt/smb/OneDrive/'):]
-    
-    # Находим позицию "Pictures/!Фотосессии" в обработанном пути
-    target_index = processed_path.find(target_prefix)
-    
-    # Если нашли, откусываем путь до "Pictures/!Фотосессии"
-    if target_index != -1:
-        processed_path = processed_path[target_index:]
-    
-    # Формируем URL для запроса к pigallery2
-    thumbnail_url = f"https://gallery.homoludens.photos/pgapi/gallery/content/{processed_path}/thumbnail/480"
+    def representation(version):
+        return version if tree_format == 'nested' else f"{version}-{tree_format}"
+
+    def build():
+        with cache.lock:
+            data = tree.tree if tree_format == 'nested' else columnar_tree(tree.tree, cache.base_path)
+        return dumps(data)
+
+    # Клиент уже имеет эту версию дерева
+    if request.if_none_match.contains(representation(etag)):
+        response = app.response_class(status=304)
+        response.vary.add('Accept-Encoding')
+    else:
+        # JSON и его сжатые варианты строятся один раз на версию дерева
+        with cache.lock:
+            etag = cache.etag
+            body = _tree_payloads.get(tree_format, etag, build)
+        encoding = response_encoding(len(body))
+        if encoding:
+            body = _tree_payloads.get(tree_format, etag, build, encoding)
+        response = json_bytes_response(body, encoding)
+    response.set_etag(representation(etag))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def collect_prefetch_paths(tree, path):
+    """
+    Собирает пути файлов директории и следующих за ней соседних директорий
     
-    # Добавляем заголовки авторизации, если они нужны
-    headers = {
-        'Authorization': 'Bearer your-auth-token',  # Замените на реальный токен
-        'User-Agent': 'PhotoAdmin/1.0'
-    }
+    Returns:
+        list: Списки путей: сначала файлы самой директории, затем соседей
+    """
+    contents = tree.get_directory_contents(path)
+    batches = [[f['path'] for f in contents['files']]]
     
+    parent, _, name = path.rstrip('/').rpartition('/')
+    siblings = tree.get_directory_contents(parent) if name else None
+    if siblings and name in siblings['directories']:
+        index = siblings['directories'].index(name)
+        for sibling in siblings['directories'][index + 1:index + 1 + PREFETCH_SIBLINGS]:
+            sibling_contents = tree.get_directory_contents(f"{parent}/{sibling}")
+            batches.append([f['path'] for f in sibling_contents['files']])
+    return batches
+
+@app.route('/api/tree/list')
+def list_tree_directory():
+    path = request.args.get('path', '')
+    cursor = request.args.get('cursor')
+    logger.debug(f"Получен запрос на содержимое директории: {path}")
     try:
-        # Делаем запрос к pigallery2
-        response = requests.get(thumbnail_url, headers=headers, stream=True)
+        limit = int(request.args.get('limit', TREE_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'Параметр limit должен быть числом'}), 400
+    limit = max(1, min(limit, TREE_MAX_PAGE_SIZE))
+
+    cache = get_tree_cache()
+    try:
+        tree, etag = cache.get()
+    except ConnectionError:
+        logger.error("Ошибка подключения к базе данных")
+        return jsonify({'error': 'Ошибка подключения к базе данных'}), 500
+    except Exception as e:
+        logger.error(f"Ошибка при построении дерева: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    # Содержимое страницы меняется только вместе с версией дерева
+    prefetch_batches = None
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.vary.add('Accept-Encoding')
+    else:
+        with cache.lock:
+            try:
+                contents = tree.list_directory(path, cursor=cursor, limit=limit)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if contents is None:
+                return jsonify({'error': f'Директория не найдена: {path}', 'path': path}), 404
+            body = dumps(contents)
+            etag = cache.etag
+            
+            # Первая страница директории с файлами - клиент ее открыл
+            if PREFETCH_ENABLED and cursor is None and contents['file_count'] \
+                    and request.args.get('prefetch', '1') != '0':
+                prefetch_batches = collect_prefetch_paths(tree, path)
         
-        # Проверяем статус ответа
-        if response.status_code == 200:
-            # Возвращаем изображение
-            return send_file(
-                response.raw,
-                mimetype=response.headers.get('Content-Type', 'image/jpeg')
-            )
+        # Сжимаем вне блокировки дерева
+        encoding = response_encoding(len(body))
+        response = json_bytes_response(compress(body, encoding) if encoding else body, encoding)
+
+        if prefetch_batches:
+            client = request.headers.get('X-Client-Id') or request.remote_addr
+            get_prefetcher().schedule_directory(client, prefetch_batches[0], prefetch_batches[1:])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/tree/stats')
+def get_tree_stats():
+    path = request.args.get('path', '')
+    logger.debug(f"Получен запрос на статистику директории: {path}")
+    cache = get_tree_cache()
+    try:
+        tree, etag = cache.get()
+    except ConnectionError:
+        logger.error("Ошибка подключения к базе данных")
+        return jsonify({'error': 'Ошибка подключения к базе данных'}), 500
+    except Exception as e:
+        logger.error(f"Ошибка при построении дерева: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        with cache.lock:
+            # Агрегаты хранятся в дереве, обход файлов не нужен
+            stats = tree.get_directory_statistics(path)
+            if stats is None:
+                return jsonify({'error': f'Директория не найдена: {path}', 'path': path}), 404
+            prefix = path.rstrip('/')
+            stats['by_status'] = status_counts(stats['by_status'])
+            directories = []
+            for name in tree.get_directory_contents(path)['directories']:
+                child_stats = tree.get_directory_statistics(f"{prefix}/{name}")
+                child_stats.update(name=name, path=f"{prefix}/{name}",
+                                   by_status=status_counts(child_stats['by_status']))
+                directories.append(child_stats)
+            response = jsonify({'path': path, 'statistics': stats, 'directories': directories})
+            etag = cache.etag
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/stats/directories')
+def get_directory_stats():
+    path = request.args.get('path', '')
+    logger.debug(f"Получен запрос на статистику директорий из базы: {path}")
+    try:
+        with Database() as db:
+            # Группировка выполняется в PostgreSQL, приходят только агрегаты
+            directories = db.get_directory_statistics(path, use_summary=STATS_SUMMARY_ENABLED)
+    except ConnectionError:
+        logger.error("Ошибка подключения к базе данных")
+        return jsonify({'error': 'Ошибка подключения к базе данных'}), 500
+    if directories is None:
+        return jsonify({'error': 'Ошибка при получении статистики'}), 500
+
+    prefix = path.rstrip('/')
+    for entry in directories:
+        entry['path'] = f"{prefix}/{entry['name']}" if entry['name'] else prefix
+        entry['by_status'] = status_counts(entry['by_status'])
+    return jsonify({
+        'path': path,
+        'source': 'summary' if STATS_SUMMARY_ENABLED else 'table',
+        'directories': directories
+    })
+
+@app.route('/api/export')
+def export_photos():
+    export_format = request.args.get('format', 'ndjson')
+    path = request.args.get('path') or None
+    columns = tuple(c for c in request.args.get('columns', '').split(',') if c) or PHOTO_COLUMNS
+    logger.debug(f"Получен запрос на экспорт: format={export_format}, path={path}")
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': 'Параметр format должен быть ndjson или csv'}), 400
+    unknown = [column for column in columns if column not in PHOTO_COLUMNS]
+    if unknown:
+        return jsonify({'error': f"Неизвестные колонки: {', '.join(unknown)}"}), 400
+
+    # Подключаемся до начала ответа, чтобы вернуть ошибку с нормальным статусом
+    db = Database()
+    if not db.connect():
+        return jsonify({'error': 'Ошибка подключения к базе данных'}), 500
+
+    def generate():
+        # Соединение держим, пока клиент читает ответ; строки идут через
+        # серверный курсор, поэтому память не зависит от размера таблицы
+        photos = db.iter_photos(columns, prefix=path)
+        if export_format == 'csv':
+            yield from iter_csv(photos, columns)
         else:
-            # Если запрос не удался, возвращаем ошибку
+            yield from iter_ndjson(photos)
+
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = app.response_class(generate(), mimetype=mimetype)
+    # Сервер закрывает ответ и тогда, когда генератор так и не запускался
+    # (клиент отключился до первого байта), поэтому соединение возвращаем здесь
+    response.call_on_close(db.close)
+    response.headers['Content-Disposition'] = f'attachment; filename=photos.{export_format}'
+    return response
+
+@app.route('/api/photos/query')
+def query_photos():
+    logger.debug(f"Получен запрос на выборку фото: {dict(request.args)}")
+    try:
+        filters = parse_query_filters(request.args)
+        after = decode_keyset_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        limit = max(1, min(int(request.args.get('limit', TREE_PAGE_SIZE)), TREE_MAX_PAGE_SIZE))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    columns = tuple(c for c in request.args.get('fields', '').split(',') if c) or PHOTO_COLUMNS
+    unknown = [column for column in columns if column not in PHOTO_COLUMNS]
+    if unknown:
+        return jsonify({'error': f"Неизвестные колонки: {', '.join(unknown)}"}), 400
+
+    try:
+        with Database() as db:
+            result = db.query_photos(filters, columns, after=after, limit=limit,
+                                     descending=request.args.get('order') == 'desc')
+    except ConnectionError:
+        logger.error("Ошибка подключения к базе данных")
+        return jsonify({'error': 'Ошибка подключения к базе данных'}), 500
+    if result is None:
+        return jsonify({'error': 'Ошибка при выборке фото'}), 500
+
+    # dumps передает даты в ISO, а не в формате HTTP-даты Flask
+    photos, last_key = result
+    return json_response({
+        'photos': photos,
+        'next_cursor': encode_keyset_cursor(last_key) if last_key else None
+    })
+
+@app.route('/api/duplicates')
+def get_duplicates():
+    path = request.args.get('path') or None
+    logger.debug(f"Получен запрос на поиск дубликатов: {path}")
+    try:
+        distance = int(request.args.get('distance', DUPLICATE_MAX_DISTANCE))
+        limit = max(1, min(int(request.args.get('limit', TREE_PAGE_SIZE)), TREE_MAX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'Параметры distance и limit должны быть целыми числами'}), 400
+    if not 0 <= distance <= DUPLICATE_DISTANCE_LIMIT:
+        return jsonify({'error': f"Параметр distance должен быть от 0 до {DUPLICATE_DISTANCE_LIMIT}"}), 400
+
+    try:
+        with Database() as db:
+            clusters = find_duplicate_clusters(
+                db.iter_photos(('path', 'phash', 'hash_sha256'), prefix=path), max_distance=distance)
+    except ConnectionError:
+        logger.error("Ошибка подключения к базе данных")
+        return jsonify({'error': 'Ошибка подключения к базе данных'}), 500
+
+    for cluster in clusters[:limit]:
+        # Серии снимков обычно лежат в одной директории
+        directories = {member.rsplit('/', 1)[0] for member in cluster['paths']}
+        cluster['directory'] = directories.pop() if len(directories) == 1 else None
+    return jsonify({
+        'path': path,
+        'distance': distance,
+        'total': len(clusters),
+        'clusters': clusters[:limit]
+    })
+
+@app.route('/api/changes')
+def stream_changes():
+    if not CHANGE_FEED_ENABLED:
+        return jsonify({'error': 'Лента изменений отключена'}), 404
+    feed = get_change_feed()
+    subscriber = feed.subscribe()
+
+    def generate():
+        try:
+            # Клиент переподключится через 3 с, если соединение оборвется
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = subscriber.get(timeout=CHANGE_FEED_KEEPALIVE)
+                except queue.Empty:
+                    # Комментарий не дает прокси закрыть простаивающее соединение
+                    yield ": keepalive\n\n"
+                    continue
+                data = json.dumps(event['changes'], ensure_ascii=False, separators=(',', ':'))
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+        finally:
+            feed.unsubscribe(subscriber)
+
+    response = app.response_class(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/scan', methods=['GET', 'POST'])
+def scan_photos():
+    scanner = get_scanner()
+    if request.method == 'POST':
+        # По умолчанию продолжаем прерванный проход
+        resume = request.args.get('resume', '1') != '0'
+        if not scanner.start(resume=resume):
+            return jsonify({'error': 'Сканирование уже выполняется', 'progress': scanner.progress}), 409
+        logger.info("Запущено сканирование файлов")
+        return jsonify({'success': True, 'progress': scanner.progress}), 202
+    return jsonify({'progress': scanner.progress})
+
+@app.route('/api/tree/refresh', methods=['POST'])
+def refresh_tree():
+    logger.debug("Получен запрос на сброс кэша дерева")
+    get_tree_cache().invalidate()
+    return jsonify({'success': True})
+
+@app.route('/api/thumbnail/<path:photo_path>')
+def get_thumbnail(photo_path):
+    service = get_thumbnail_service()
+    key = service.cache_key(photo_path)
+    
+    # Миниатюра этой версии файла уже есть у клиента
+    if request.if_none_match.contains(key):
+        response = app.response_class(status=304)
+    else:
+        try:
+            thumbnail = service.get(photo_path, key=key)
+        except ThumbnailError as e:
             return jsonify({
-                'error': f'Ошибка получения миниатюры: {response.status_code}',
-                'url': thumbnail_url
-            }), response.status_code
-    except Exception as e:
-        # Если произошла ошибка, возвращаем сообщение об ошибке
-        return jsonify({
-            'error': f'Ошибка при запросе к pigallery2: {str(e)}',
-            'url': thumbnail_url
-        }), 500
+                'error': str(e),
+                'url': e.url
+            }), e.status_code
+        except Exception as e:
+            # Если произошла ошибка, возвращаем сообщение об ошибке
+            return jsonify({
+                'error': f'Ошибка при получении миниатюры: {str(e)}',
+                'url': build_thumbnail_url(photo_path)
+            }), 500
+        response = app.response_class(thumbnail.data, mimetype=thumbnail.mimetype)
+        response.headers['X-Thumbnail-Source'] = thumbnail.source
+    
+    response.set_etag(key)
+    response.headers['Cache-Control'] = f'public, max-age={THUMBNAIL_MAX_AGE}'
+    return response
 
 @app.route('/api/photo/<path:photo_path>')
 def get_photo(photo_path):
@@ -139,43 +499,57 @@ def get_photo(photo_path):
         photo_path = '/' + photo_path
     logger.debug(f"Декодированный путь: {photo_path}")
     
-    # Проверяем, существует ли файл
-    if not os.path.exists(photo_path):
+    service = get_preview_service()
+    try:
+        size = service.pick_size(request.args.get('size', type=int))
+        # stat заодно проверяет, что файл существует
+        key = service.cache_key(photo_path, size)
+    except FileNotFoundError:
         logger.warning(f"Файл не найден на диске: {photo_path}")
         return jsonify({
             'error': f'Файл не найден: {photo_path}',
             'path': photo_path
         }), 404
+    except OSError as e:
+        # EIO, устаревший дескриптор или права на SMB-шаре: файл может быть на месте
+        logger.error(f"Не удалось прочитать файл {photo_path}: {e}")
+        return jsonify({
+            'error': f'Не удалось прочитать файл: {photo_path}',
+            'path': photo_path
+        }), 503
     
     # Отдаем файл
     try:
-        logger.debug(f"Отправляем файл: {photo_path}")
+        if request.if_none_match.contains(key):
+            response = app.response_class(status=304)
+            response.set_etag(key)
+            response.headers['Cache-Control'] = f'public, max-age={PREVIEW_MAX_AGE}'
+            return response
         
-        # Открываем изображение с помощью Pillow
-        with Image.open(photo_path) as img:
-            # Получаем размеры изображения
-            width, height = img.size
-            
-            # Вычисляем новые размеры (уменьшаем на треть)
-            new_width = width // 3
-            new_height = height // 3
-            
-            # Изменяем размер изображения
-            img = img.resize((new_width, new_height), Image.LANCZOS)
-            
-            # Сохраняем в буфер с качеством 85%
-            output_buffer = io.BytesIO()
-            img.save(output_buffer, format='JPEG', quality=85, optimize=True)
-            output_buffer.seek(0)
-            
-            logger.debug(f"Изображение уменьшено с {width}x{height} до {new_width}x{new_height}")
-            
-            # Отправляем файл клиенту
-            return send_file(
-                output_buffer,
-                mimetype='image/jpeg',
-                as_attachment=False
-            )
+        preview_path, key = service.get_path(photo_path, size, key=key)
+        logger.debug(f"Отправляем превью {size}px: {photo_path}")
+        
+        # Файл с диска отдается через sendfile, без чтения в память
+        return send_file(
+            preview_path,
+            mimetype='image/jpeg',
+            as_attachment=False,
+            etag=key,
+            max_age=PREVIEW_MAX_AGE,
+            conditional=True
+        )
+    except WorkerPoolBusy as e:
+        logger.warning(f"Пул обработки изображений перегружен: {photo_path}")
+        response = jsonify({'error': str(e), 'path': photo_path})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    except FuturesTimeoutError:
+        logger.error(f"Превышено время генерации превью: {photo_path}")
+        return jsonify({
+            'error': f'Превышено время генерации превью: {photo_path}',
+            'path': photo_path
+        }), 504
     except Exception as e:
         logger.error(f"Ошибка при отправке файла: {e}")
         return jsonify({
@@ -185,101 +559,61 @@ def get_photo(photo_path):
 
 @app.route('/api/update_statuses', methods=['POST'])
 def update_statuses():
-    print("\n=== НАЧАЛО ОБНОВЛЕНИЯ СТАТУСОВ ===")
-    print(f"Время: {datetime.now()}")
-    
     try:
         data = request.json
-        print(f"\nПолученные данные:")
-        print(json.dumps(data, indent=2, ensure_ascii=False))
-        
+        if current_trace() is not None:
+            # Тело запроса пишем только в трассируемых запросах: на больших пачках это дорого
+            logger.info(f"Обновление статусов, тело запроса: {json.dumps(data, ensure_ascii=False)}")
+
         if not data or 'updates' not in data:
-            print("ОШИБКА: Неверный формат данных - отсутствует ключ 'updates'")
+            logger.warning("Неверный формат данных - отсутствует ключ 'updates'")
             return jsonify({'error': 'Неверный формат данных'}), 400
-        
+
         updates = data['updates']
-        print(f"\nКоличество обновлений: {len(updates)}")
-        
         if not isinstance(updates, list):
-            print(f"ОШИБКА: updates должен быть списком, получено: {type(updates)}")
+            logger.warning(f"updates должен быть списком, получено: {type(updates)}")
             return jsonify({'error': 'Неверный формат данных: updates должен быть списком'}), 400
-        
+        logger.debug(f"Получено обновлений статусов: {len(updates)}")
+
         db = Database()
         if not db.connect():
-            print("ОШИБКА: Не удалось подключиться к базе данных")
+            logger.error("Ошибка подключения к базе данных")
             return jsonify({'error': 'Ошибка подключения к базе данных'}), 500
-        
+
         try:
-            cursor = db.conn.cursor()
-            print("\nНачало обработки обновлений...")
-            print(f"Используется таблица: {TABLE_NAME}")
-            
-            # Обновляем статусы фотографий
-            for i, update in enumerate(updates):
-                if 'path' not in update or 'status' not in update:
-                    print(f"Пропущено обновление {i+1}: отсутствуют обязательные поля")
+            valid_updates = []
+            for update in updates:
+                if not isinstance(update, dict) or 'path' not in update or 'status' not in update:
                     continue
-                
-                path = update['path']
-                status = update['status']
-                print(f"\nОбработка обновления {i+1}:")
-                print(f"Путь: {path}")
-                print(f"Новый статус: {status}")
-                
-                # Проверяем, существует ли запись для этого пути
-                cursor.execute(f"SELECT path, status FROM {TABLE_NAME} WHERE path = %s", (path,))
-                result = cursor.fetchone()
-                
-                if result:
-                    old_status = result[1]
-                    print(f"Найдена существующая запись:")
-                    print(f"Путь: {result[0]}")
-                    print(f"Старый статус: {old_status}")
-                    print(f"Новый статус: {status}")
-                    
-                    cursor.execute(
-                        f"UPDATE {TABLE_NAME} SET status = %s WHERE path = %s",
-                        (status, path)
-                    )
-                    print("Запись обновлена")
-                else:
-                    print("Создание новой записи...")
-                    cursor.execute(
-                        f"INSERT INTO {TABLE_NAME} (path, status) VALUES (%s, %s)",
-                        (path, status)
-                    )
-                    print("Новая запись создана")
-            
-            db.conn.commit()
-            print("\nВсе изменения сохранены в базе данных")
-            
-            # Проверяем, что изменения действительно сохранились
-            print("\nПроверка сохраненных изменений:")
-            cursor.execute(f"SELECT path, status FROM {TABLE_NAME} WHERE path IN %s", 
-                          (tuple(update['path'] for update in updates if 'path' in update),))
-            saved_updates = cursor.fetchall()
-            for path, status in saved_updates:
-                print(f"Путь: {path}")
-                print(f"Статус: {status}")
-                print("---")
-            
-            print("\n=== ОБНОВЛЕНИЕ СТАТУСОВ ЗАВЕРШЕНО ===\n")
-            
+                valid_updates.append((update['path'], update['status']))
+
+            # Одним запросом обновляем/добавляем все записи
+            changed = db.bulk_update_statuses(valid_updates)
+            if changed is None:
+                return jsonify({'error': 'Ошибка при обновлении статусов'}), 500
+            logger.debug(f"Статусы сохранены в {TABLE_NAME}: изменено {len(changed)}, "
+                         f"пропущено {len(updates) - len(valid_updates)}")
+
+            # Патчим закэшированное дерево вместо его перестроения
+            get_tree_cache().apply_status_updates(changed)
+
+            saved_updates = [{'path': path, 'status': status} for path, status in dict(valid_updates).items()]
+
             return jsonify({
                 'success': True,
-                'message': f'Успешно обновлено {len(updates)} статусов фотографий',
-                'updated_count': len(updates),
-                'saved_updates': [{'path': path, 'status': status} for path, status in saved_updates]
+                'message': f'Успешно обновлено {len(saved_updates)} статусов фотографий',
+                'updated_count': len(saved_updates),
+                'changed_count': len(changed),
+                'skipped_count': len(updates) - len(valid_updates),
+                'changed': changed,
+                'saved_updates': saved_updates
             })
-        except Exception as e:
-            db.conn.rollback()
-            print(f"\nОШИБКА при обновлении статусов: {str(e)}")
-            return jsonify({'error': f'Ошибка при обновлении статусов: {str(e)}'}), 500
         finally:
             db.close()
     except Exception as e:
-        print(f"\nОШИБКА при обработке запроса: {str(e)}")
+        logger.error(f"Ошибка при обработке запроса обновления статусов: {str(e)}")
         return jsonify({'error': f'Ошибка при обработке запроса: {str(e)}'}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True) 
\ No newline at end of file
+    init_app()
+    app.run(debug=DEBUG)
@@ -1,33 +1,43 @@
-from flask import jsonify
+from flask import current_app, jsonify, request
 from app.api import bp
-from app.photo_tree import PhotoTree
-from app.database import Database
+from tree_cache import get_tree_cache
+from serialization import EncodedPayloadCache, dumps
+
+BASE_PATH = "/mnt/smb/OneDrive/Pictures/!Фотосессии"
+
+# JSON дерева строится один раз на версию: CompactPhotoTree.tree
+# собирает вложенные словари заново при каждом обращении
+_tree_payloads = EncodedPayloadCache()
 
 @bp.route('/tree')
 def get_tree():
-    db = Database()
-    if not db.connect():
-        return jsonify({'error': 'Database connection failed'}), 500
-        
+    cache = get_tree_cache(BASE_PATH)
     try:
-        tree = PhotoTree(db, base_path="/mnt/smb/OneDrive/Pictures/!Фотосессии")
-        tree.build_tree()
-        return jsonify(tree.tree)
-    finally:
-        db.close()
+        tree, etag = cache.get()
+    except ConnectionError:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        with cache.lock:
+            etag = cache.etag
+            body = _tree_payloads.get('nested', etag, lambda: dumps(tree.tree))
+        response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @bp.route('/photos/<path:directory>')
 def get_photos(directory):
-    db = Database()
-    if not db.connect():
-        return jsonify({'error': 'Database connection failed'}), 500
-        
+    cache = get_tree_cache(BASE_PATH)
     try:
-        tree = PhotoTree(db, base_path="/mnt/smb/OneDrive/Pictures/!Фотосессии")
-        tree.build_tree()
+        tree, _ = cache.get()
+    except ConnectionError:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    with cache.lock:
         contents = tree.get_directory_contents(directory)
         if contents is None:
             return jsonify({'error': 'Directory not found'}), 404
         return jsonify(contents)
-    finally:
-        db.close() 
\ No newline at end of file
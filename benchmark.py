@@ -0,0 +1,315 @@
+import os
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, List, Optional
+from database import PHOTO_COLUMNS
+from photo_tree import PhotoTree
+from compact_tree import CompactPhotoTree
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_SIZES = (10_000, 100_000)
+TREE_CLASSES = {'photo': PhotoTree, 'compact': CompactPhotoTree}
+
+SYNTHETIC_ROOT = "/mnt/photos/!Фотосессии"
+STATUSES = (None, None, None, 'normal', 'pending', 'approved', 'rejected', 'published')
+CLIENTS = ('Иванова', 'Петров', 'Смирновы', 'Kuznetsova', 'Wedding', 'Studio', 'Портрет', 'Семья')
+SUBFOLDERS = ('JPG', 'RAW', 'Отбор', 'Ретушь')
+
+
+def generate_photos(count: int, seed: int = 42, root: str = SYNTHETIC_ROOT) -> Iterator[Dict]:
+    """
+    Генерирует строки таблицы, похожие на архив фотосессий
+
+    Пути вида root/2019/2019-05-12 Иванова/JPG/IMG_0001.jpg: около 300
+    файлов на съемку, часть съемок с вложенными папками. Генерация
+    детерминирована для заданного seed.
+
+    Args:
+        count (int): Количество строк
+        seed (int): Зерно генератора
+        root (str): Корневая директория архива
+
+    Yields:
+        Dict: Строка со всеми колонками PHOTO_COLUMNS
+    """
+    rng = random.Random(seed)
+    start = datetime(2015, 1, 1)
+    produced, shoot = 0, 0
+    while produced < count:
+        shot_at = start + timedelta(days=rng.randrange(3650), seconds=rng.randrange(86400))
+        folder = f"{root}/{shot_at.year}/{shot_at:%Y-%m-%d} {rng.choice(CLIENTS)} {shoot}"
+        shoot += 1
+        subfolders = rng.sample(SUBFOLDERS, rng.randint(0, 3)) or [None]
+        for subfolder in subfolders:
+            directory = f"{folder}/{subfolder}" if subfolder else folder
+            for number in range(rng.randint(50, 250)):
+                if produced >= count:
+                    return
+                produced += 1
+                size = rng.randint(2_000_000, 25_000_000)
+                yield {
+                    'path': f"{directory}/IMG_{number:04d}.jpg",
+                    'is_nude': rng.random() < 0.1,
+                    'has_face': rng.random() < 0.7,
+                    'is_small': size < 3_000_000,
+                    'status': rng.choice(STATUSES),
+                    'nsfw_score': round(rng.random(), 4),
+                    'clip_nude_score': round(rng.random(), 4),
+                    'phash': f"{rng.getrandbits(64):016x}",
+                    'hash_sha256': f"{rng.getrandbits(256):064x}",
+                    'shooting_date': shot_at + timedelta(seconds=number),
+                    'modification_date': shot_at + timedelta(days=1),
+                    'file_size': size,
+                    'dir_path': directory,
+                }
+
+
+class MemoryDatabase:
+    def __init__(self, rows: Iterator[Dict] = ()):
+        """
+        Подмена Database, хранящая таблицу в памяти
+
+        Реализует методы, которые используют дерево, кэш дерева и
+        обновление статусов, с теми же сигнатурами и форматом результатов.
+        Каждая выдаваемая строка - новый словарь, как у курсора psycopg2.
+
+        Args:
+            rows (Iterator[Dict]): Начальные строки таблицы
+        """
+        self.rows: Dict[str, Dict] = {row['path']: row for row in rows}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def connect(self):
+        return True
+
+    def close(self):
+        pass
+
+    def get_tree_watermark(self, previous=None):
+        stamps = [row['updated_at'] for row in self.rows.values() if row.get('updated_at') is not None]
+        return {'updated_at': max(stamps, default=None), 'count': len(self.rows), 'deletes': 0}
+
+    def iter_photos(self, columns=None, prefix=None, itersize=None, dir_path=None, changed_since=None):
+        columns = tuple(columns or PHOTO_COLUMNS)
+        prefix = prefix.rstrip('/') + '/' if prefix is not None else None
+        for row in self.rows.values():
+            if prefix is not None and not row['path'].startswith(prefix):
+                continue
+            if dir_path is not None and row['dir_path'] != dir_path:
+                continue
+            if changed_since is not None and (row.get('updated_at') is None or (
+                    changed_since is not True and row['updated_at'] < changed_since)):
+                continue
+            yield {column: row.get(column) for column in columns}
+
+    def get_all_photos(self):
+        return list(self.iter_photos())
+
+    def bulk_update_statuses(self, updates):
+        changed = []
+        now = datetime.now(timezone.utc)
+        for path, status in dict(updates).items():
+            row = self.rows.get(path)
+            if row is None:
+                self.rows[path] = row = {'path': path, 'dir_path': path.rsplit('/', 1)[0]}
+                changed.append({'path': path, 'status': status, 'old_status': None, 'inserted': True})
+            elif row.get('status') != status:
+                changed.append({'path': path, 'status': status, 'old_status': row.get('status'),
+                                'inserted': False})
+            if row.get('status') != status:
+                row['updated_at'] = now
+            row['status'] = status
+        return changed
+
+
+def _best_time(operation: Callable, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        operation()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _peak_memory(operation: Callable) -> float:
+    """
+    Пик выделенной Python-памяти (МБ) во время операции
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, trees=tuple(TREE_CLASSES), repeat: int = 3,
+                   lookups: int = 1000, updates: int = 1000, memory: bool = True,
+                   seed: int = 42, log: Callable[[str], None] = print) -> Dict[str, Dict]:
+    """
+    Замеряет операции дерева на синтетических архивах
+
+    Время - лучшее из repeat запусков; пик памяти замеряется отдельным
+    запуском под tracemalloc, который заметно замедляет выполнение.
+
+    Args:
+        sizes (Iterable[int]): Размеры таблиц
+        trees (Iterable[str]): Реализации дерева из TREE_CLASSES
+        repeat (int): Количество повторов каждого замера
+        lookups (int): Количество запросов директорий и файлов в одном замере
+        updates (int): Размер пачки обновлений статусов
+        memory (bool): Замерять пик памяти
+        seed (int): Зерно генератора данных и выборок
+        log (Callable): Куда писать строки отчета
+
+    Returns:
+        Dict[str, Dict]: {'<дерево>/<размер>/<операция>': {'seconds', 'peak_mb'}}
+    """
+    results = {}
+    for size in sizes:
+        db = MemoryDatabase(generate_photos(size, seed=seed))
+        rng = random.Random(seed)
+        paths = rng.sample(list(db.rows), min(lookups, len(db.rows)))
+        # Директорий меньше, чем файлов: выбираем с повторами, добавляя уровни годов и съемок
+        leaves = sorted({row['dir_path'] for row in db.rows.values()})
+        parents = sorted({leaf.rsplit('/', 1)[0] for leaf in leaves} | {leaf.rsplit('/', 2)[0] for leaf in leaves})
+        directories = rng.choices(leaves, k=lookups - lookups // 5) + rng.choices(parents, k=lookups // 5)
+        batch = [(path, rng.choice(STATUSES[3:])) for path in rng.sample(paths, min(updates, len(paths)))]
+
+        for name in trees:
+            tree_class = TREE_CLASSES[name]
+            tree = tree_class(db, base_path="")
+
+            def update_statuses():
+                # Как /api/update_statuses: запись в базу и патч дерева изменениями
+                for change in db.bulk_update_statuses(batch):
+                    tree.update_file_status(change['path'], change['status'])
+                # Следующий повтор снова меняет статусы
+                batch.reverse()
+                for i, (path, status) in enumerate(batch):
+                    batch[i] = (path, STATUSES[3 + (STATUSES.index(status) - 2) % 5])
+
+            cases = [
+                ('build_tree', tree.build_tree),
+                ('get_directory_contents', lambda: [tree.get_directory_contents(d) for d in directories]),
+                ('get_file_info', lambda: [tree.get_file_info(p) for p in paths]),
+                ('get_statistics', tree.get_statistics),
+                ('serialize_tree', lambda: json.dumps(tree.tree, sort_keys=True, default=str)),
+                ('serialize_directories', lambda: json.dumps(
+                    [tree.get_directory_contents(d) for d in directories], sort_keys=True, default=str)),
+                ('update_statuses', update_statuses),
+            ]
+            for case, operation in cases:
+                key = f"{name}/{size}/{case}"
+                result = {'seconds': round(_best_time(operation, repeat), 6)}
+                if memory:
+                    result['peak_mb'] = round(_peak_memory(operation), 3)
+                results[key] = result
+                log(f"{key:<45} {result['seconds'] * 1000:>10.2f} мс"
+                    + (f" {result['peak_mb']:>10.2f} МБ" if memory else ""))
+            del tree
+        del db
+    return results
+
+
+def compare_to_baseline(results: Dict[str, Dict], baseline: Dict[str, Dict],
+                        tolerance: float = 0.25, min_seconds: float = 0.01) -> List[str]:
+    """
+    Сравнивает замеры с сохраненной базой
+
+    Замеры быстрее min_seconds (и пики памяти меньше 1 МБ) сравниваются
+    по нижней границе: у них шум измерения больше самого значения.
+
+    Args:
+        results (Dict[str, Dict]): Результат run_benchmarks
+        baseline (Dict[str, Dict]): Сохраненные результаты
+        tolerance (float): Допустимое относительное ухудшение
+        min_seconds (float): Нижняя граница сравниваемого времени
+
+    Returns:
+        List[str]: Описания регрессий; пустой список, если их нет
+    """
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric, unit, floor in (('seconds', 'с', min_seconds), ('peak_mb', 'МБ', 1.0)):
+            if metric not in result or metric not in base:
+                continue
+            current, expected = max(result[metric], floor), max(base[metric], floor)
+            if expected and current > expected * (1 + tolerance):
+                regressions.append(f"{key}: {metric} {result[metric]:.4f} {unit} против "
+                                   f"{base[metric]:.4f} {unit} (+{(current / expected - 1) * 100:.0f}%)")
+    return regressions
+
+
+def load_baseline(path: str = BASELINE_FILE) -> Optional[Dict[str, Dict]]:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['results']
+
+
+def save_baseline(results: Dict[str, Dict], path: str = BASELINE_FILE):
+    document = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.platform(),
+        },
+        'results': results,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Замеры дерева фотографий на синтетических данных')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='Размеры таблиц через запятую, например 10000,100000,1000000')
+    parser.add_argument('--trees', default=','.join(TREE_CLASSES), help='Реализации дерева: photo,compact')
+    parser.add_argument('--repeat', type=int, default=3, help='Повторов каждого замера')
+    parser.add_argument('--no-memory', action='store_true', help='Не замерять пик памяти')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='Файл базовых замеров')
+    parser.add_argument('--save-baseline', action='store_true', help='Сохранить замеры как базовые')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Допустимое ухудшение, доля')
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        sizes=[int(size) for size in args.sizes.split(',')],
+        trees=[name for name in args.trees.split(',') if name],
+        repeat=args.repeat,
+        memory=not args.no_memory,
+    )
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print(f"Базовые замеры сохранены в {args.baseline}")
+        sys.exit(0)
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print(f"Нет базовых замеров ({args.baseline}), сравнение пропущено")
+        sys.exit(0)
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"РЕГРЕССИЯ {regression}")
+    print(f"Регрессий: {len(regressions)}")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,238 @@
+import os
+import json
+import uuid
+import queue
+import select
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+import psycopg2
+from psycopg2 import extensions
+from config import PG_CONNECTION_PARAMS, CHANGE_FEED_CHANNEL, CHANGE_FEED_QUEUE
+
+logger = logging.getLogger(__name__)
+
+# Полезная нагрузка NOTIFY ограничена 8000 байтами, оставляем запас
+MAX_PAYLOAD_BYTES = 7900
+
+_origin = None
+_origin_pid = None
+
+
+def process_origin() -> str:
+    """
+    Идентификатор процесса-источника изменений
+
+    Меняется после fork, чтобы процессы-воркеры различали свои и чужие
+    события, даже если модуль был загружен до fork.
+    """
+    global _origin, _origin_pid
+    if _origin_pid != os.getpid():
+        _origin, _origin_pid = uuid.uuid4().hex[:12], os.getpid()
+    return _origin
+
+
+def encode_notifications(kind: str, deltas: Iterable[list], origin: Optional[str] = None,
+                         max_bytes: int = MAX_PAYLOAD_BYTES) -> List[str]:
+    """
+    Кодирует изменения в одну или несколько полезных нагрузок NOTIFY
+
+    Args:
+        kind (str): Тип изменения: status ([path, status]) или
+            upsert ([path, status, is_nude, has_face, nsfw_score])
+        deltas (Iterable[list]): Изменения по путям
+        origin (Optional[str]): Источник; по умолчанию текущий процесс
+        max_bytes (int): Максимальный размер одной нагрузки
+
+    Returns:
+        List[str]: JSON-нагрузки, каждая не больше max_bytes; если какое-то
+            изменение в нагрузку не помещается, последней идет событие reset,
+            чтобы подписчики перечитали данные
+    """
+    origin = origin or process_origin()
+    header = json.dumps({'o': origin, 't': kind, 'd': []}, separators=(',', ':'))
+    # Размер пустой нагрузки без закрывающих "]}"
+    base = len(header.encode('utf-8')) - 2
+
+    payloads, chunk, size = [], [], base
+    oversized = False
+    for delta in deltas:
+        encoded = json.dumps(delta, ensure_ascii=False, separators=(',', ':'))
+        length = len(encoded.encode('utf-8')) + 1
+        if base + length + 2 > max_bytes:
+            logger.warning(f"⚠️ Изменение слишком велико для NOTIFY, подписчики получат reset: {delta[0]}")
+            oversized = True
+            continue
+        if chunk and size + length + 2 > max_bytes:
+            payloads.append(header[:-2] + ','.join(chunk) + ']}')
+            chunk, size = [], base
+        chunk.append(encoded)
+        size += length
+    if chunk:
+        payloads.append(header[:-2] + ','.join(chunk) + ']}')
+    if oversized:
+        payloads.append(json.dumps({'o': origin, 't': 'reset', 'd': []}, separators=(',', ':')))
+    return payloads
+
+
+def notify_changes(cursor, kind: str, deltas: Iterable[list], channel: str = CHANGE_FEED_CHANNEL):
+    """
+    Отправляет NOTIFY об изменениях в текущей транзакции
+
+    Уведомления доставляются слушателям только после COMMIT, а при
+    ROLLBACK пропадают вместе с изменениями.
+    """
+    for payload in encode_notifications(kind, deltas):
+        cursor.execute("SELECT pg_notify(%s, %s)", (channel, payload))
+
+
+class ChangeFeed:
+    def __init__(self, channel: str = CHANGE_FEED_CHANNEL, queue_size: int = CHANGE_FEED_QUEUE,
+                 connect: Callable = None, poll_interval: float = 5.0):
+        """
+        Слушатель LISTEN/NOTIFY, раздающий изменения подписчикам
+
+        Один фоновый поток держит отдельное соединение (не из пула) и
+        раскладывает события по очередям подписчиков (SSE-клиентов) и
+        вызывает обработчики (кэш дерева). Подписчик, не успевающий
+        разбирать очередь, получает событие reset и должен перечитать данные.
+
+        Args:
+            channel (str): Канал NOTIFY
+            queue_size (int): Максимальная длина очереди подписчика
+            connect (Callable): Фабрика соединений; по умолчанию psycopg2.connect
+            poll_interval (float): Как часто (сек) просыпаться без событий
+        """
+        self.channel = channel
+        self.queue_size = queue_size
+        self.connect = connect or (lambda: psycopg2.connect(**PG_CONNECTION_PARAMS))
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._subscribers: List[queue.Queue] = []
+        self._listeners: List[Callable[[Dict], None]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._sequence = 0
+
+    def subscribe(self) -> queue.Queue:
+        """
+        Создает очередь событий для нового подписчика
+
+        Returns:
+            queue.Queue: Очередь событий {'id', 'type', 'changes'}
+        """
+        subscriber = queue.Queue(self.queue_size)
+        with self._lock:
+            self._subscribers.append(subscriber)
+        self.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def add_listener(self, listener: Callable[[Dict], None]):
+        """
+        Регистрирует обработчик, вызываемый из потока слушателя на каждое событие
+        """
+        with self._lock:
+            self._listeners.append(listener)
+        self.start()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def publish(self, payload: str):
+        """
+        Разбирает нагрузку NOTIFY и раздает событие подписчикам и обработчикам
+        """
+        try:
+            message = json.loads(payload)
+            event = {'origin': message['o'], 'type': message['t'], 'changes': message['d']}
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"⚠️ Некорректное событие в ленте изменений: {payload[:200]}")
+            return
+
+        self._dispatch(event)
+
+    def _dispatch(self, event: Dict):
+        with self._lock:
+            self._sequence += 1
+            event['id'] = self._sequence
+            subscribers = list(self._subscribers)
+            listeners = list(self._listeners)
+
+        for subscriber in subscribers:
+            self._offer(subscriber, event)
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработчика ленты изменений: {str(e)}")
+
+    def _offer(self, subscriber: queue.Queue, event: Dict):
+        try:
+            subscriber.put_nowait(event)
+        except queue.Full:
+            # Подписчик отстал: очищаем очередь и просим его перечитать данные
+            while True:
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    break
+            subscriber.put_nowait({'id': event['id'], 'type': 'reset', 'changes': []})
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self.connect()
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                logger.info(f"✅ Лента изменений слушает канал {self.channel}")
+                if backoff > 1.0:
+                    # Пока соединения не было, события могли потеряться
+                    self._dispatch({'origin': None, 'type': 'reset', 'changes': []})
+                backoff = 1.0
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.publish(conn.notifies.pop(0).payload)
+            except Exception as e:
+                logger.error(f"❌ Ошибка ленты изменений: {str(e)}, переподключение через {backoff:.0f} с")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except psycopg2.Error:
+                        pass
+
+
+_feed = None
+_feed_lock = threading.Lock()
+
+
+def get_change_feed() -> ChangeFeed:
+    """
+    Возвращает общую для процесса ленту изменений
+    """
+    global _feed
+    with _feed_lock:
+        if _feed is None:
+            _feed = ChangeFeed()
+        return _feed
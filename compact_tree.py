@@ -0,0 +1,421 @@
+import sys
+import math
+from array import array
+from typing import Dict, List, Optional
+from database import Database
+from photo_tree import (
+    PhotoTree, TREE_COLUMNS, _split_parts, _empty_stats, _add_file_to_stats,
+    _remove_file_from_stats, _move_status, _copy_stats, status_counts
+)
+
+
+class DirNode:
+    # __slots__ убирает __dict__ у каждого из десятков тысяч узлов
+    __slots__ = ('name', 'parent', 'prefix', 'dirs', 'files', 'stats', 'index')
+
+    def __init__(self, name: str, parent: Optional['DirNode'] = None):
+        """
+        Узел директории компактного дерева
+
+        Args:
+            name (str): Имя директории
+            parent (Optional[DirNode]): Родительский узел
+        """
+        self.name = name
+        self.parent = parent
+        # Общий префикс путей файлов директории (включая разделитель)
+        self.prefix: Optional[str] = None
+        self.dirs: Dict[str, 'DirNode'] = {}
+        # Индексы файлов в параллельных массивах дерева
+        self.files = array('I')
+        # Агрегаты поддерева в формате PhotoTree.get_statistics
+        self.stats = _empty_stats()
+        # Имя файла -> индекс; строится при первом поиске файла в директории
+        self.index: Optional[Dict[str, int]] = None
+
+
+def _get_bit(bits: bytearray, index: int) -> bool:
+    return bool(bits[index >> 3] & (1 << (index & 7)))
+
+
+def _set_bit(bits: bytearray, index: int, value: bool):
+    if value:
+        bits[index >> 3] |= 1 << (index & 7)
+    else:
+        bits[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+
+def _float32_to_python(value: float) -> float:
+    """
+    Возвращает кратчайшее десятичное представление float32
+
+    REAL в PostgreSQL - тоже float32, поэтому так восстанавливается
+    то же значение, которое psycopg2 вернул из базы.
+    """
+    for precision in range(6, 10):
+        candidate = float(f"{value:.{precision}g}")
+        if array('f', [candidate])[0] == value:
+            return candidate
+    return value
+
+
+class CompactPhotoTree:
+    def __init__(self, db: Database, base_path: str = ""):
+        """
+        Компактное дерево фотографий с атрибутами файлов в параллельных массивах
+
+        Вместо словаря на каждый файл хранятся: имя файла (один раз),
+        индекс директории, статус как небольшое целое, nsfw_score как
+        float32 и булевы атрибуты как битовые множества. Интерфейс
+        совпадает с PhotoTree, JSON-представление строится по запросу.
+
+        Args:
+            db (Database): Экземпляр класса Database для работы с БД
+            base_path (str): Базовый путь, который будет пропущен при построении дерева
+        """
+        self.db = db
+        # Разбиение путей полностью совпадает с PhotoTree
+        self._splitter = PhotoTree(db, base_path)
+        self.base_path = self._splitter.base_path
+        self._reset()
+
+    def _reset(self):
+        self.root = DirNode('')
+        self._dir_count = 1
+        self._names: List[str] = []
+        self._file_dir: List[DirNode] = []
+        self._status = array('H')
+        self._nsfw = array('f')
+        # Для bool-атрибутов: значение и признак NULL
+        self._nude = bytearray()
+        self._nude_null = bytearray()
+        self._face = bytearray()
+        self._face_null = bytearray()
+        # Пути, которые не восстанавливаются как prefix + name
+        self._path_overrides: Dict[int, str] = {}
+        self._status_names: List[Optional[str]] = []
+        self._status_codes: Dict[Optional[str], int] = {}
+
+    def __len__(self):
+        return len(self._names)
+
+    def _status_code(self, status: Optional[str]) -> int:
+        code = self._status_codes.get(status)
+        if code is None:
+            code = len(self._status_names)
+            self._status_names.append(status)
+            self._status_codes[status] = code
+        return code
+
+    def build_tree(self) -> DirNode:
+        """
+        Строит дерево путей из базы данных
+
+        В отличие от PhotoTree.build_tree, возвращает корневой узел, а не
+        словарь: JSON-представление строится только по запросу через tree.
+
+        Returns:
+            DirNode: Корневой узел дерева
+        """
+        self._reset()
+        for photo in self.db.iter_photos(TREE_COLUMNS):
+            self._insert_photo(photo, track_stats=False)
+        self._compute_stats(self.root)
+        return self.root
+
+    def _compute_stats(self, node: DirNode) -> Dict:
+        """
+        Рекурсивно считает агрегаты поддерева по массивам атрибутов
+        """
+        stats = node.stats = _empty_stats()
+        for index in node.files:
+            _add_file_to_stats(stats, self._stat_record(index))
+        for child in node.dirs.values():
+            child_stats = self._compute_stats(child)
+            stats['total_files'] += child_stats['total_files']
+            stats['nude_files'] += child_stats['nude_files']
+            stats['face_files'] += child_stats['face_files']
+            stats['directories'] += 1 + child_stats['directories']
+            for status, count in child_stats['by_status'].items():
+                stats['by_status'][status] = stats['by_status'].get(status, 0) + count
+        return stats
+
+    def _stat_record(self, index: int) -> Dict:
+        return {
+            'is_nude': self._bool(self._nude, self._nude_null, index),
+            'has_face': self._bool(self._face, self._face_null, index),
+            'status': self._status_names[self._status[index]]
+        }
+
+    @staticmethod
+    def _ancestors(node: DirNode):
+        while node is not None:
+            yield node
+            node = node.parent
+
+    def _insert_photo(self, photo: Dict, track_stats: bool = True) -> Optional[int]:
+        """
+        Добавляет запись о фото в дерево
+
+        Args:
+            photo (Dict): Строка таблицы фотографий
+            track_stats (bool): Обновить агрегаты родительских директорий (O(глубина))
+
+        Returns:
+            Optional[int]: Индекс файла или None если путь пустой
+        """
+        path = photo['path']
+        parts = _split_parts(path, self.base_path)
+        if not parts:
+            return None
+
+        current = self.root
+        for part in parts[:-1]:
+            child = current.dirs.get(part)
+            if child is None:
+                part = sys.intern(part)
+                child = current.dirs[part] = DirNode(part, current)
+                self._dir_count += 1
+                if track_stats:
+                    for node in self._ancestors(current):
+                        node.stats['directories'] += 1
+            current = child
+
+        name = parts[-1]
+        index = len(self._names)
+        self._names.append(name)
+        self._file_dir.append(current)
+        current.files.append(index)
+        if current.index is not None:
+            current.index.setdefault(name, index)
+
+        if current.prefix is None and path.endswith(name):
+            current.prefix = sys.intern(path[:len(path) - len(name)])
+        if current.prefix is None or current.prefix + name != path:
+            self._path_overrides[index] = path
+
+        self._status.append(self._status_code(photo.get('status')))
+        score = photo.get('nsfw_score')
+        self._nsfw.append(math.nan if score is None else score)
+
+        if index % 8 == 0:
+            for bits in (self._nude, self._nude_null, self._face, self._face_null):
+                bits.append(0)
+        for attr, bits, null_bits in (('is_nude', self._nude, self._nude_null),
+                                      ('has_face', self._face, self._face_null)):
+            value = photo.get(attr)
+            if value is None:
+                _set_bit(null_bits, index, True)
+            else:
+                _set_bit(bits, index, value)
+
+        if track_stats:
+            record = self._stat_record(index)
+            for node in self._ancestors(current):
+                _add_file_to_stats(node.stats, record)
+        return index
+
+    def _bool(self, bits: bytearray, null_bits: bytearray, index: int) -> Optional[bool]:
+        if _get_bit(null_bits, index):
+            return None
+        return _get_bit(bits, index)
+
+    def _file_path(self, index: int) -> str:
+        override = self._path_overrides.get(index)
+        if override is not None:
+            return override
+        return self._file_dir[index].prefix + self._names[index]
+
+    def _file_record(self, index: int) -> Dict:
+        """
+        Собирает словарь файла в формате PhotoTree
+        """
+        score = self._nsfw[index]
+        return {
+            'path': self._file_path(index),
+            'is_nude': self._bool(self._nude, self._nude_null, index),
+            'has_face': self._bool(self._face, self._face_null, index),
+            'status': self._status_names[self._status[index]],
+            'nsfw_score': None if math.isnan(score) else _float32_to_python(score)
+        }
+
+    def _node_to_dict(self, node: DirNode) -> Dict:
+        return {
+            'files': [self._file_record(i) for i in node.files],
+            'dirs': {name: self._node_to_dict(child) for name, child in node.dirs.items()}
+        }
+
+    @property
+    def tree(self) -> Dict:
+        """
+        Дерево в формате PhotoTree.tree, строится при каждом обращении
+
+        Обработчики не должны вызывать его на каждый запрос: JSON дерева
+        кэшируется по версии (ETag), см. serialization.EncodedPayloadCache.
+        """
+        return self._node_to_dict(self.root)
+
+    def _find_node(self, path: str) -> Optional[DirNode]:
+        current = self.root
+        for part in self._splitter._split_path(path):
+            current = current.dirs.get(part)
+            if current is None:
+                return None
+        return current
+
+    def _find_file(self, path: str) -> Optional[int]:
+        parts = self._splitter._split_path(path)
+        if not parts:
+            return None
+        node = self.root
+        for part in parts[:-1]:
+            node = node.dirs.get(part)
+            if node is None:
+                return None
+        if node.index is None:
+            # Индекс имен нужен только директориям, в которых ищут файлы
+            # (при совпадающих именах остается первый файл, как при переборе)
+            node.index = {self._names[index]: index for index in reversed(node.files)}
+        return node.index.get(parts[-1])
+
+    def get_directory_contents(self, path: str) -> Optional[Dict]:
+        """
+        Получает содержимое указанной директории
+
+        Returns:
+            Optional[Dict]: Содержимое директории или None если директория не найдена
+        """
+        node = self._find_node(path)
+        if node is None:
+            return None
+        return {
+            'files': [self._file_record(i) for i in node.files],
+            'directories': list(node.dirs.keys())
+        }
+
+    def get_file_info(self, path: str) -> Optional[Dict]:
+        """
+        Получает информацию о файле (копию, изменения не попадают в дерево)
+
+        Returns:
+            Optional[Dict]: Информация о файле или None если файл не найден
+        """
+        index = self._find_file(path)
+        return None if index is None else self._file_record(index)
+
+    def update_file_status(self, path: str, status: str) -> bool:
+        """
+        Обновляет статус файла, добавляя файл при его отсутствии
+
+        Returns:
+            bool: True если файл уже был в дереве, False если он был добавлен
+        """
+        index = self._find_file(path)
+        if index is not None:
+            old_status = self._status_names[self._status[index]]
+            if old_status != status:
+                self._status[index] = self._status_code(status)
+                for node in self._ancestors(self._file_dir[index]):
+                    _move_status(node.stats, old_status, status)
+            return True
+        self._insert_photo({'path': path, 'status': status})
+        return False
+
+    def upsert_photo(self, photo: Dict) -> bool:
+        """
+        Добавляет фото или обновляет атрибуты уже имеющегося в дереве
+
+        Returns:
+            bool: True если файл уже был в дереве, False если он был добавлен
+        """
+        index = self._find_file(photo['path'])
+        if index is None:
+            self._insert_photo(photo)
+            return False
+
+        ancestors = list(self._ancestors(self._file_dir[index]))
+        record = self._stat_record(index)
+        for node in ancestors:
+            _remove_file_from_stats(node.stats, record)
+        self._status[index] = self._status_code(photo.get('status'))
+        score = photo.get('nsfw_score')
+        self._nsfw[index] = math.nan if score is None else score
+        for attr, bits, null_bits in (('is_nude', self._nude, self._nude_null),
+                                      ('has_face', self._face, self._face_null)):
+            value = photo.get(attr)
+            _set_bit(null_bits, index, value is None)
+            _set_bit(bits, index, bool(value))
+        record = self._stat_record(index)
+        for node in ancestors:
+            _add_file_to_stats(node.stats, record)
+        return True
+
+    def list_directory(self, path: str, cursor: Optional[str] = None,
+                       limit: int = 200) -> Optional[Dict]:
+        """
+        Получает один уровень директории с постраничной выдачей файлов
+
+        Формат ответа и курсоров совпадает с PhotoTree.list_directory.
+
+        Raises:
+            ValueError: Если курсор некорректен
+        """
+        node = self._find_node(path)
+        if node is None:
+            return None
+
+        files = node.files
+        offset = 0
+        if cursor:
+            offset, last_path = PhotoTree._decode_cursor(cursor)
+            if not (0 < offset <= len(files) and self._file_path(files[offset - 1]) == last_path):
+                offset = next(
+                    (i + 1 for i, f in enumerate(files) if self._file_path(f) == last_path),
+                    None
+                )
+                if offset is None:
+                    raise ValueError(f"Некорректный курсор: {cursor}")
+
+        page = [self._file_record(i) for i in files[offset:offset + limit]]
+        next_offset = offset + len(page)
+        next_cursor = None
+        if page and next_offset < len(files):
+            next_cursor = PhotoTree._encode_cursor(next_offset, page[-1]['path'])
+
+        prefix = path.rstrip('/')
+        directories = [{
+            'name': name,
+            'path': f"{prefix}/{name}",
+            'file_count': len(child.files),
+            'total_files': child.stats['total_files'],
+            'by_status': status_counts(child.stats['by_status']),
+            'has_dirs': bool(child.dirs)
+        } for name, child in node.dirs.items()]
+
+        return {
+            'path': path,
+            'directories': directories,
+            'file_count': len(files),
+            'total_files': node.stats['total_files'],
+            'files': page,
+            'next_cursor': next_cursor
+        }
+
+    def get_statistics(self) -> Dict:
+        """
+        Получает статистику по дереву из агрегатов корня
+
+        Returns:
+            Dict: Статистика в формате PhotoTree.get_statistics
+        """
+        return _copy_stats(self.root.stats)
+
+    def get_directory_statistics(self, path: str) -> Optional[Dict]:
+        """
+        Получает статистику поддерева директории
+
+        Returns:
+            Optional[Dict]: Статистика в формате PhotoTree.get_statistics или None
+        """
+        node = self._find_node(path)
+        return _copy_stats(node.stats) if node is not None else None
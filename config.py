@@ -41,4 +41,98 @@ PG_CONNECTION_PARAMS = {
     'database': POSTGRES_DB,
     'user': POSTGRES_USER,
     'password': POSTGRES_PASSWORD
-} 
\ No newline at end of file
+}
+
+# Параметры кэша дерева фотографий
+TREE_CACHE_CHECK_INTERVAL = float(os.getenv('TREE_CACHE_CHECK_INTERVAL', "5"))  # как часто (сек) проверять изменения таблицы
+TREE_COMPACT = os.getenv('TREE_COMPACT', "false").lower() in ("1", "true", "yes")  # хранить дерево в CompactPhotoTree
+TREE_PAGE_SIZE = int(os.getenv('TREE_PAGE_SIZE', "200"))  # файлов на странице /api/tree/list по умолчанию
+TREE_MAX_PAGE_SIZE = int(os.getenv('TREE_MAX_PAGE_SIZE', "1000"))  # максимальный размер страницы
+
+# Параметры пула соединений с PostgreSQL
+DB_POOL_ENABLED = os.getenv('DB_POOL_ENABLED', "true").lower() in ("1", "true", "yes")
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', "1"))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', "10"))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', "10"))  # сколько ждать (сек) свободное соединение
+DB_POOL_CHECK_IDLE = float(os.getenv('DB_POOL_CHECK_IDLE', "30"))  # после скольких секунд простоя проверять соединение
+DB_ITERSIZE = int(os.getenv('DB_ITERSIZE', "5000"))  # строк за один запрос серверного курсора
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', "1000"))  # строк в одной пачке bulk_upsert_photos
+
+# Параметры миниатюр (pigallery2 и локальный кэш)
+PIGALLERY_URL = os.getenv('PIGALLERY_URL', "https://gallery.homoludens.photos")
+PIGALLERY_AUTH_TOKEN = os.getenv('PIGALLERY_AUTH_TOKEN', "your-auth-token")
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.abspath(os.path.join(os.path.dirname(__file__), "cache")))
+THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', "480"))
+THUMBNAIL_MEMORY_BYTES = int(os.getenv('THUMBNAIL_MEMORY_BYTES', str(64 * 1024 * 1024)))  # бюджет кэша в памяти
+THUMBNAIL_DISK_BYTES = int(os.getenv('THUMBNAIL_DISK_BYTES', str(2 * 1024 * 1024 * 1024)))  # бюджет кэша на диске
+THUMBNAIL_MAX_AGE = int(os.getenv('THUMBNAIL_MAX_AGE', "86400"))  # Cache-Control max-age для браузера
+THUMBNAIL_KEY_TTL = float(os.getenv('THUMBNAIL_KEY_TTL', "30"))  # сколько (сек) помнить версию файла без запроса в БД
+THUMBNAIL_KEY_CACHE_SIZE = int(os.getenv('THUMBNAIL_KEY_CACHE_SIZE', "20000"))  # сколько версий файлов помнить
+
+# Параметры превью для /api/photo
+PREVIEW_SIZES = [int(size) for size in os.getenv('PREVIEW_SIZES', "1024,2048").split(',')]  # длинная сторона
+PREVIEW_DEFAULT_SIZE = int(os.getenv('PREVIEW_DEFAULT_SIZE', "2048"))
+PREVIEW_DISK_BYTES = int(os.getenv('PREVIEW_DISK_BYTES', str(10 * 1024 * 1024 * 1024)))  # бюджет кэша на диске
+PREVIEW_MAX_AGE = int(os.getenv('PREVIEW_MAX_AGE', "86400"))  # Cache-Control max-age для браузера
+PREVIEW_RESAMPLE = os.getenv('PREVIEW_RESAMPLE', "bicubic")  # nearest, bilinear, bicubic, lanczos...
+PREVIEW_DRAFT_GAP = float(os.getenv('PREVIEW_DRAFT_GAP', "1.0"))  # во сколько раз JPEG декодируется больше целевого размера
+PREVIEW_USE_EMBEDDED = os.getenv('PREVIEW_USE_EMBEDDED', "true").lower() in ("1", "true", "yes")  # использовать встроенные превью
+
+# Параметры фонового прогрева превью и миниатюр
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', "true").lower() in ("1", "true", "yes")
+PREFETCH_MAX_QUEUE = int(os.getenv('PREFETCH_MAX_QUEUE', "5000"))  # максимальная длина очереди заданий
+PREFETCH_SIBLINGS = int(os.getenv('PREFETCH_SIBLINGS', "2"))  # сколько следующих директорий прогревать
+
+# Параметры пула обработки изображений
+IMAGE_POOL_KIND = os.getenv('IMAGE_POOL_KIND', "process")  # process или thread
+IMAGE_POOL_MAX_PENDING = int(os.getenv('IMAGE_POOL_MAX_PENDING', str(MAX_WORKERS * 4)))  # заданий в работе и в очереди
+IMAGE_JOB_TIMEOUT = float(os.getenv('IMAGE_JOB_TIMEOUT', "30"))  # сколько ждать (сек) результат задания
+IMAGE_POOL_RETRY_AFTER = int(os.getenv('IMAGE_POOL_RETRY_AFTER', "2"))  # Retry-After при перегрузке
+
+# Статистика директорий на стороне PostgreSQL
+STATS_SUMMARY_ENABLED = os.getenv('STATS_SUMMARY_ENABLED', "false").lower() in ("1", "true", "yes")  # сводная таблица на триггерах
+STATS_SUMMARY_TABLE = os.getenv('STATS_SUMMARY_TABLE', f"{TABLE_NAME}_dir_stats")
+
+# Лента изменений через LISTEN/NOTIFY и server-sent events
+CHANGE_FEED_ENABLED = os.getenv('CHANGE_FEED_ENABLED', "true").lower() in ("1", "true", "yes")
+CHANGE_FEED_CHANNEL = os.getenv('CHANGE_FEED_CHANNEL', f"{TABLE_NAME}_changes")
+CHANGE_FEED_QUEUE = int(os.getenv('CHANGE_FEED_QUEUE', "1000"))  # событий в очереди одного подписчика
+CHANGE_FEED_KEEPALIVE = float(os.getenv('CHANGE_FEED_KEEPALIVE', "15"))  # как часто (сек) слать keepalive в SSE
+
+# Параметры сканера файлов (сверка таблицы с диском)
+SCAN_WORKERS = int(os.getenv('SCAN_WORKERS', str(MAX_WORKERS)))  # параллельных чтений директорий
+SCAN_RATE_LIMIT = float(os.getenv('SCAN_RATE_LIMIT', "500"))  # операций с SMB (listdir/stat) в секунду, 0 - без ограничения
+SCAN_EXTENSIONS = tuple(ext.strip().lower() for ext in os.getenv(
+    'SCAN_EXTENSIONS', ".jpg,.jpeg,.png,.heic,.tif,.tiff,.webp,.cr2,.nef,.arw,.dng").split(','))
+SCAN_DELETE_MISSING = os.getenv('SCAN_DELETE_MISSING', "true").lower() in ("1", "true", "yes")  # удалять записи пропавших файлов
+SCAN_STATE_FILE = os.getenv('SCAN_STATE_FILE', os.path.join(CACHE_DIR, "scan_state.json"))  # прогресс для продолжения сканирования
+
+# Поиск дубликатов по perceptual hash
+DUPLICATE_MAX_DISTANCE = int(os.getenv('DUPLICATE_MAX_DISTANCE', "6"))  # расстояние Хэмминга между phash по умолчанию
+DUPLICATE_DISTANCE_LIMIT = int(os.getenv('DUPLICATE_DISTANCE_LIMIT', "16"))  # максимальное расстояние, которое можно запросить
+
+# Отладка, метрики и трассировка запросов
+DEBUG = os.getenv('FLASK_DEBUG', "false").lower() in ("1", "true", "yes")  # режим отладки Flask
+LOG_LEVEL = os.getenv('LOG_LEVEL', "DEBUG" if DEBUG else "INFO").upper()
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', "true").lower() in ("1", "true", "yes")  # эндпоинт /metrics
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', "0"))  # доля запросов с подробной трассировкой (0..1)
+TRACE_HEADER = os.getenv('TRACE_HEADER', "X-Trace")  # заголовок, которым клиент запрашивает трассировку
+
+# Сериализация и сжатие ответов
+RESPONSE_COMPRESSION = os.getenv('RESPONSE_COMPRESSION', "true").lower() in ("1", "true", "yes")  # gzip/brotli по Accept-Encoding
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', "1024"))  # ответы меньше этого размера не сжимаются
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', "6"))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', "5"))  # 0..11, выше - плотнее, но медленнее
+
+# Снимок построенного дерева на диске (быстрый старт и общий снимок для воркеров)
+TREE_SNAPSHOT_ENABLED = os.getenv('TREE_SNAPSHOT_ENABLED', "true").lower() in ("1", "true", "yes")
+TREE_SNAPSHOT_DIR = os.getenv('TREE_SNAPSHOT_DIR', os.path.join(CACHE_DIR, "tree_snapshots"))
+TREE_SNAPSHOT_OVERLAP = float(os.getenv('TREE_SNAPSHOT_OVERLAP', "300"))  # запас (сек) при дочитывании изменений после снимка
+
+# Клиент внешних сервисов (pigallery2)
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', "3"))  # установка соединения (сек)
+UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', "10"))  # ожидание ответа (сек)
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv('UPSTREAM_MAX_CONCURRENCY', "8"))  # одновременных запросов на процесс
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv('UPSTREAM_QUEUE_TIMEOUT', "2"))  # ожидание свободного слота (сек)
+UPSTREAM_FAILURE_THRESHOLD = int(os.getenv('UPSTREAM_FAILURE_THRESHOLD', "5"))  # ошибок подряд до размыкания цепи
+UPSTREAM_RESET_TIMEOUT = float(os.getenv('UPSTREAM_RESET_TIMEOUT', "30"))  # сколько (сек) цепь разомкнута
@@ -1,8 +1,21 @@
 import os
 import logging
+import threading
+import time
+import uuid
+from itertools import islice
 import psycopg2
-from psycopg2.extras import DictCursor
-from config import PG_CONNECTION_PARAMS, TABLE_NAME
+from psycopg2 import extensions
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import DictCursor, execute_values
+from config import (
+    PG_CONNECTION_PARAMS, TABLE_NAME,
+    DB_POOL_ENABLED, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE,
+    DB_POOL_TIMEOUT, DB_POOL_CHECK_IDLE, DB_ITERSIZE, DB_BATCH_SIZE, STATS_SUMMARY_TABLE,
+    CHANGE_FEED_ENABLED
+)
+from change_feed import notify_changes
+from metrics import DB_QUERY_SECONDS, DB_QUERY_ERRORS, record_span
 
 # Настройка логирования
 logging.basicConfig(
@@ -11,24 +24,313 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Колонки таблицы фотографий, которые можно запрашивать по имени
+PHOTO_COLUMNS = (
+    'path', 'is_nude', 'has_face', 'hash_sha256', 'clip_nude_score', 'nsfw_score',
+    'is_small', 'status', 'phash', 'shooting_date', 'modification_date', 'file_size',
+    'dir_path'
+)
+
+
+# Колонки, которые записываются при вставке (dir_path вычисляет база)
+WRITABLE_COLUMNS = tuple(column for column in PHOTO_COLUMNS if column != 'dir_path')
+
+# Колонки, которые попадают в ленту изменений при upsert
+_FEED_UPSERT_COLUMNS = ('path', 'status', 'is_nude', 'has_face', 'nsfw_score')
+
+# Директория файла: путь без последнего компонента
+DIR_PATH_EXPRESSION = "regexp_replace(path, '/[^/]*$', '')"
+
+
+# Ключ сортировки по дате съемки: фото без даты идут последними
+SHOOTING_DATE_KEY = "COALESCE(shooting_date, 'infinity'::timestamp)"
+
+# Фильтр query_photos -> условие SQL
+_QUERY_CONDITIONS = {
+    'is_nude': 'is_nude = %s',
+    'has_face': 'has_face = %s',
+    'is_small': 'is_small = %s',
+    'nsfw_min': 'nsfw_score >= %s',
+    'nsfw_max': 'nsfw_score <= %s',
+    'clip_min': 'clip_nude_score >= %s',
+    'clip_max': 'clip_nude_score <= %s',
+    'date_from': 'shooting_date >= %s',
+    'date_to': 'shooting_date < %s',
+    'dir': 'dir_path = %s',
+}
+
+
+def _like_prefix(prefix):
+    """
+    Экранирует префикс пути для LIKE и добавляет шаблон потомков
+    """
+    escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '/%'
+
+
+def fold_directory_statistics(rows):
+    """
+    Сворачивает строки (директория, статус, агрегаты) в статистику по директориям
+
+    Args:
+        rows (list): Кортежи (directory, status, file_count, nude_files,
+            face_files, nsfw_sum, nsfw_count); directory '' означает файлы
+            самой директории
+
+    Returns:
+        list: Словари {'name', 'total_files', 'nude_files', 'face_files',
+            'avg_nsfw_score', 'by_status'} в порядке имен
+    """
+    folded = {}
+    for name, status, file_count, nude_files, face_files, nsfw_sum, nsfw_count in rows:
+        entry = folded.setdefault(name, {
+            'name': name, 'total_files': 0, 'nude_files': 0, 'face_files': 0,
+            'by_status': {}, '_nsfw_sum': 0.0, '_nsfw_count': 0
+        })
+        entry['total_files'] += int(file_count)
+        entry['nude_files'] += int(nude_files or 0)
+        entry['face_files'] += int(face_files or 0)
+        entry['by_status'][status] = entry['by_status'].get(status, 0) + int(file_count)
+        entry['_nsfw_sum'] += float(nsfw_sum or 0)
+        entry['_nsfw_count'] += int(nsfw_count or 0)
+
+    result = []
+    for name in sorted(folded):
+        entry = folded[name]
+        nsfw_sum, nsfw_count = entry.pop('_nsfw_sum'), entry.pop('_nsfw_count')
+        entry['avg_nsfw_score'] = nsfw_sum / nsfw_count if nsfw_count else None
+        result.append(entry)
+    return result
+
+
+class ConnectionPool:
+    def __init__(self, min_size, max_size, connection_params,
+                 timeout=DB_POOL_TIMEOUT, check_idle=DB_POOL_CHECK_IDLE):
+        """
+        Потокобезопасный пул соединений с PostgreSQL
+
+        В отличие от psycopg2.pool, держит открытыми все возвращенные
+        соединения (до max_size), а при исчерпании пула ждет освобождения
+        соединения до timeout секунд, а не падает сразу.
+
+        Args:
+            min_size (int): Количество соединений, открываемых сразу
+            max_size (int): Максимальное количество соединений
+            connection_params (dict): Параметры psycopg2.connect
+            timeout (float): Сколько ждать свободное соединение
+            check_idle (float): После скольких секунд простоя проверять соединение
+        """
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self.connection_params = connection_params
+        self.pid = os.getpid()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        # Свободные соединения и время их возврата в пул
+        self._idle = []
+        for _ in range(min_size):
+            self._idle.append((psycopg2.connect(**connection_params), time.monotonic()))
+
+    def _is_healthy(self, conn, returned_at):
+        """
+        Проверяет, что соединение живо
+
+        Соединения, простоявшие в пуле дольше check_idle, проверяются
+        запросом SELECT 1, остальные - только по флагу closed.
+        """
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.check_idle:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        """
+        Берет соединение из пула
+
+        Returns:
+            connection: Проверенное соединение psycopg2
+
+        Raises:
+            pg_pool.PoolError: Если свободное соединение не появилось за timeout
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise pg_pool.PoolError("Пул соединений исчерпан")
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    conn, returned_at = self._idle.pop()
+                if self._is_healthy(conn, returned_at):
+                    return conn
+                logger.warning("⚠️ Соединение из пула неработоспособно, открываем новое")
+                self._discard(conn)
+            return psycopg2.connect(**self.connection_params)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, close=False):
+        """
+        Возвращает соединение в пул
+
+        Незавершенная транзакция откатывается, чтобы следующий
+        пользователь получил соединение в чистом состоянии.
+
+        Args:
+            conn: Соединение, полученное через getconn
+            close (bool): Закрыть соединение вместо возврата в пул
+        """
+        try:
+            if not close and not conn.closed:
+                status = conn.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    # Соединение с сервером потеряно
+                    close = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            if close or conn.closed:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка при возврате соединения в пул: {str(e)}")
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def _discard(self, conn):
+        try:
+            if not conn.closed:
+                conn.close()
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка при закрытии соединения: {str(e)}")
+
+    def closeall(self):
+        """
+        Закрывает все свободные соединения пула
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Возвращает общий для процесса пул соединений, создавая его при первом вызове
+
+    После fork (например, в воркерах gunicorn) создается новый пул,
+    соединения родительского процесса не используются.
+
+    Returns:
+        ConnectionPool: Пул соединений
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ConnectionPool(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, PG_CONNECTION_PARAMS)
+        return _pool
+
+
+# Метки операций для метрик SQL-запросов
+_SQL_OPERATIONS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'CREATE', 'ALTER', 'DROP',
+                   'DECLARE', 'LISTEN', 'NOTIFY', 'ANALYZE', 'SAVEPOINT', 'RELEASE', 'ROLLBACK'}
+
+
+def _sql_operation(query) -> str:
+    if isinstance(query, bytes):
+        query = query[:64].decode('utf-8', 'ignore')
+    elif not isinstance(query, str):
+        # psycopg2.sql.Composed и подобные
+        return 'OTHER'
+    words = query.lstrip().split(None, 1)
+    operation = words[0].upper() if words else ''
+    return operation if operation in _SQL_OPERATIONS else 'OTHER'
+
+
+class _MeteredCursorMixin:
+    """
+    Считает SQL-запросы курсора и их время в метриках и трассировке запроса
+    """
+    def _metered(self, method, query, args):
+        operation = _sql_operation(query)
+        started = time.perf_counter()
+        try:
+            return method(query, args)
+        except Exception:
+            DB_QUERY_ERRORS.inc(operation=operation)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_QUERY_SECONDS.observe(elapsed, operation=operation)
+            record_span('db', elapsed, operation)
+
+    def execute(self, query, vars=None):
+        return self._metered(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._metered(super().executemany, query, vars_list)
+
+
+class MeteredCursor(_MeteredCursorMixin, extensions.cursor):
+    pass
+
+
+class MeteredDictCursor(_MeteredCursorMixin, DictCursor):
+    pass
+
+
 class Database:
-    def __init__(self):
+    def __init__(self, pooled=None):
         """
         Инициализация параметров подключения к базе данных
+
+        Args:
+            pooled (bool): Брать соединение из общего пула; по умолчанию DB_POOL_ENABLED
         """
         self.connection_params = PG_CONNECTION_PARAMS
         self.table_name = TABLE_NAME
+        self.pooled = DB_POOL_ENABLED if pooled is None else pooled
         self.conn = None
 
+    def __enter__(self):
+        if not self.connect():
+            raise ConnectionError("Ошибка подключения к базе данных")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.conn is not None and exc_type is not None:
+            self.conn.rollback()
+        self.close()
+
     def connect(self):
         """
-        Устанавливает соединение с PostgreSQL
+        Устанавливает соединение с PostgreSQL или берет его из пула
         
         Returns:
             bool: True если подключение успешно, False в противном случае
         """
         try:
-            self.conn = psycopg2.connect(**self.connection_params)
+            if self.pooled:
+                self.conn = get_pool().getconn()
+            else:
+                self.conn = psycopg2.connect(**self.connection_params)
+            # Все курсоры соединения, в том числе именованные, попадают в метрики
+            self.conn.cursor_factory = MeteredCursor
             return True
         except Exception as e:
             logger.error(f"❌ Ошибка подключения к PostgreSQL: {str(e)}")
@@ -36,7 +338,12 @@ class Database:
 
     def ensure_table_schema(self):
         """
-        Создает таблицу если она не существует
+        Создает таблицу если она не существует и доводит схему до текущей
+
+        Директория файла хранится в вычисляемой колонке dir_path. Индексы
+        text_pattern_ops обслуживают и равенство, и LIKE 'префикс%' при любой
+        collation базы, поэтому выборки по директории и поддереву, а также
+        фильтры по статусу идут через индексы, а не полным сканированием.
         """
         try:
             with self.conn.cursor() as cursor:
@@ -52,15 +359,109 @@ class Database:
                         status TEXT,
                         phash TEXT,
                         shooting_date TIMESTAMP,
-                        modification_date TIMESTAMP
+                        modification_date TIMESTAMP,
+                        file_size BIGINT,
+                        updated_at TIMESTAMPTZ DEFAULT clock_timestamp(),
+                        dir_path TEXT GENERATED ALWAYS AS ({DIR_PATH_EXPRESSION}) STORED
                     )
                 """)
+                self._migrate_schema(cursor)
                 self.conn.commit()
                 logger.info("✅ Схема таблицы проверена/создана")
         except Exception as e:
             logger.error(f"❌ Ошибка при создании схемы: {str(e)}")
             self.conn.rollback()
 
+    def _migrate_schema(self, cursor):
+        """
+        Добавляет в существующую таблицу колонки dir_path, file_size, updated_at и индексы
+
+        Все шаги идемпотентны, DDL выполняется только для того, чего еще
+        нет. Добавление вычисляемой колонки один раз переписывает таблицу,
+        дальше dir_path поддерживает сама PostgreSQL. updated_at добавляется без значения по умолчанию (без перезаписи
+        таблицы), у старых строк он остается NULL до первого изменения.
+        """
+        cursor.execute("""
+            SELECT column_name, column_default FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s
+        """, (self.table_name,))
+        # ALTER TABLE и CREATE TRIGGER берут ACCESS EXCLUSIVE даже при IF NOT EXISTS,
+        # поэтому выполняются только для недостающих колонок и триггеров
+        columns = dict(cursor.fetchall())
+        if 'dir_path' not in columns:
+            logger.info("🔄 Миграция: добавляем колонку dir_path")
+            cursor.execute(f"""
+                ALTER TABLE {self.table_name}
+                ADD COLUMN dir_path TEXT GENERATED ALWAYS AS ({DIR_PATH_EXPRESSION}) STORED
+            """)
+        # Размер файла на диске, по нему сканер замечает измененные файлы
+        if 'file_size' not in columns:
+            cursor.execute(f"ALTER TABLE {self.table_name} ADD COLUMN file_size BIGINT")
+        # Время последнего изменения строки, по нему снимок дерева дочитывает изменения
+        if 'updated_at' not in columns:
+            logger.info("🔄 Миграция: добавляем колонку updated_at")
+            cursor.execute(f"ALTER TABLE {self.table_name} ADD COLUMN updated_at TIMESTAMPTZ")
+        if not columns.get('updated_at'):
+            cursor.execute(f"ALTER TABLE {self.table_name} ALTER COLUMN updated_at SET DEFAULT clock_timestamp()")
+
+        # Счетчик удалений: удаление строки не видно по updated_at, а удаление
+        # вместе со вставкой не меняет количество строк
+        deletes = f"{self.table_name}_deletes"
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {deletes} (
+                id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                deletes BIGINT NOT NULL DEFAULT 0
+            )
+        """)
+
+        cursor.execute("""
+            SELECT tgname FROM pg_trigger
+            WHERE tgrelid = to_regclass(%s) AND NOT tgisinternal
+        """, (self.table_name,))
+        triggers = {row[0] for row in cursor.fetchall()}
+        touch = f"{self.table_name}_touch"
+        if touch not in triggers:
+            cursor.execute(f"""
+                CREATE OR REPLACE FUNCTION {touch}() RETURNS trigger AS $$
+                BEGIN
+                    NEW.updated_at := clock_timestamp();
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER {touch} BEFORE UPDATE ON {self.table_name}
+                FOR EACH ROW EXECUTE FUNCTION {touch}()
+            """)
+        if deletes not in triggers:
+            cursor.execute(f"""
+                CREATE OR REPLACE FUNCTION {deletes}() RETURNS trigger AS $$
+                BEGIN
+                    INSERT INTO {deletes} AS d (id, deletes) VALUES (1, 1)
+                    ON CONFLICT (id) DO UPDATE SET deletes = d.deletes + 1;
+                    RETURN NULL;
+                END
+                $$ LANGUAGE plpgsql
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER {deletes} AFTER DELETE OR TRUNCATE ON {self.table_name}
+                FOR EACH STATEMENT EXECUTE FUNCTION {deletes}()
+            """)
+
+        for name, definition in (
+            ('dir_path_idx', 'dir_path text_pattern_ops'),
+            ('path_pattern_idx', 'path text_pattern_ops'),
+            ('status_idx', 'status'),
+            ('dir_path_status_idx', 'dir_path, status'),
+            # Ключ keyset-пагинации query_photos
+            ('shooting_date_path_idx', f"({SHOOTING_DATE_KEY}), path"),
+            ('updated_at_idx', 'updated_at'),
+        ):
+            cursor.execute(f"""
+                CREATE INDEX IF NOT EXISTS {self.table_name}_{name}
+                ON {self.table_name} ({definition})
+            """)
+
     def insert_or_update_photo(self, photo_data):
         """
         Вставляет или обновляет информацию о фото
@@ -95,6 +496,11 @@ class Database:
                         shooting_date = EXCLUDED.shooting_date,
                         modification_date = EXCLUDED.modification_date
                 """, photo_data)
+                if CHANGE_FEED_ENABLED:
+                    notify_changes(cursor, 'upsert', [[
+                        photo_data['path'], photo_data['status'], photo_data['is_nude'],
+                        photo_data['has_face'], photo_data['nsfw_score']
+                    ]])
                 self.conn.commit()
                 return True
         except Exception as e:
@@ -102,6 +508,135 @@ class Database:
             self.conn.rollback()
             return False
 
+    def bulk_upsert_photos(self, photos, batch_size=DB_BATCH_SIZE, columns=None):
+        """
+        Вставляет или обновляет фото пачками
+
+        Каждая пачка записывается одним INSERT ... ON CONFLICT через
+        execute_values и фиксируется одним COMMIT. Если пачка падает,
+        она откатывается к точке сохранения и записывается построчно, так
+        что ошибочные строки попадают в отчет, а остальные сохраняются.
+
+        Args:
+            photos (Iterable[dict]): Данные о фото (можно генератор)
+            batch_size (int): Строк в одной пачке
+            columns (tuple): Записываемые колонки из WRITABLE_COLUMNS; по
+                умолчанию все. Остальные колонки существующих строк не меняются
+
+        Returns:
+            dict: {'upserted': число записанных строк,
+                'failed': список {'path', 'error'} для незаписанных строк}
+
+        Raises:
+            ValueError: Если колонки неизвестны или среди них нет path
+        """
+        columns = tuple(columns or WRITABLE_COLUMNS)
+        unknown = [column for column in columns if column not in WRITABLE_COLUMNS]
+        if unknown:
+            raise ValueError(f"Неизвестные колонки: {', '.join(unknown)}")
+        if 'path' not in columns:
+            raise ValueError("Среди колонок должна быть path")
+
+        updates = [column for column in columns if column != 'path']
+        query = f"""
+            INSERT INTO {self.table_name} ({', '.join(columns)}) VALUES %s
+            ON CONFLICT (path) DO
+        """ + (("UPDATE SET " + ", ".join(f"{column} = EXCLUDED.{column}" for column in updates))
+               if updates else "NOTHING")
+        feed_columns = [columns.index(column) for column in _FEED_UPSERT_COLUMNS if column in columns]
+
+        result = {'upserted': 0, 'failed': []}
+        photos = iter(photos)
+        while True:
+            batch = list(islice(photos, batch_size))
+            if not batch:
+                break
+            # ON CONFLICT не может дважды изменить одну строку в одном запросе
+            rows = {}
+            for photo in batch:
+                if not photo.get('path'):
+                    result['failed'].append({'path': photo.get('path'), 'error': 'Не указан path'})
+                    continue
+                rows[photo['path']] = tuple(photo.get(column) for column in columns)
+            if not rows:
+                continue
+
+            try:
+                with self.conn.cursor() as cursor:
+                    written = self._upsert_batch(cursor, query, list(rows.values()),
+                                                 result['failed'], columns.index('path'))
+                    if CHANGE_FEED_ENABLED and written and len(feed_columns) == len(_FEED_UPSERT_COLUMNS):
+                        notify_changes(cursor, 'upsert', [[row[i] for i in feed_columns] for row in written])
+                self.conn.commit()
+                result['upserted'] += len(written)
+            except Exception as e:
+                logger.error(f"❌ Ошибка при записи пачки фото: {str(e)}")
+                self.conn.rollback()
+                result['failed'].extend({'path': path, 'error': str(e)} for path in rows)
+        return result
+
+    def _upsert_batch(self, cursor, query, rows, failed, path_index=0):
+        """
+        Записывает пачку строк, при ошибке повторяет построчно
+
+        Returns:
+            list: Записанные строки
+        """
+        cursor.execute("SAVEPOINT bulk_upsert")
+        try:
+            execute_values(cursor, query, rows, page_size=len(rows))
+            cursor.execute("RELEASE SAVEPOINT bulk_upsert")
+            return rows
+        except psycopg2.Error as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT bulk_upsert")
+            cursor.execute("RELEASE SAVEPOINT bulk_upsert")
+            logger.warning(f"⚠️ Пачка фото не записана ({str(e).strip()}), повторяем построчно")
+
+        written = []
+        for row in rows:
+            cursor.execute("SAVEPOINT bulk_upsert_row")
+            try:
+                execute_values(cursor, query, [row])
+                written.append(row)
+            except psycopg2.Error as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT bulk_upsert_row")
+                failed.append({'path': row[path_index], 'error': str(e).strip()})
+            cursor.execute("RELEASE SAVEPOINT bulk_upsert_row")
+        return written
+
+    def delete_photos(self, paths, batch_size=DB_BATCH_SIZE):
+        """
+        Удаляет записи о фото пачками
+
+        Args:
+            paths (Iterable[str]): Пути удаляемых фото
+            batch_size (int): Путей в одном запросе (и одной транзакции)
+
+        Returns:
+            int: Количество удаленных строк или None при ошибке
+        """
+        deleted = 0
+        paths = iter(paths)
+        try:
+            while True:
+                batch = list(islice(paths, batch_size))
+                if not batch:
+                    break
+                with self.conn.cursor() as cursor:
+                    cursor.execute(f"""
+                        DELETE FROM {self.table_name} WHERE path = ANY(%s) RETURNING path
+                    """, (batch,))
+                    removed = [row[0] for row in cursor.fetchall()]
+                    if CHANGE_FEED_ENABLED and removed:
+                        notify_changes(cursor, 'delete', [[path] for path in removed])
+                self.conn.commit()
+                deleted += len(removed)
+            return deleted
+        except Exception as e:
+            logger.error(f"❌ Ошибка при удалении фото: {str(e)}")
+            self.conn.rollback()
+            return None
+
     def get_photo_by_path(self, path):
         """
         Получает информацию о фото по пути
@@ -113,7 +648,7 @@ class Database:
             dict: Данные о фото или None если фото не найдено
         """
         try:
-            with self.conn.cursor(cursor_factory=DictCursor) as cursor:
+            with self.conn.cursor(cursor_factory=MeteredDictCursor) as cursor:
                 cursor.execute(f"""
                     SELECT * FROM {self.table_name}
                     WHERE path = %s
@@ -124,6 +659,145 @@ class Database:
             logger.error(f"❌ Ошибка при получении фото: {str(e)}")
             return None
 
+    def get_photo_version(self, path):
+        """
+        Получает hash_sha256 и modification_date фото по первичному ключу
+
+        Args:
+            path (str): Путь к файлу
+
+        Returns:
+            dict: {'hash_sha256', 'modification_date'} или None если фото не найдено
+        """
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT hash_sha256, modification_date FROM {self.table_name}
+                    WHERE path = %s
+                """, (path,))
+                result = cursor.fetchone()
+                return {'hash_sha256': result[0], 'modification_date': result[1]} if result else None
+        except Exception as e:
+            logger.error(f"❌ Ошибка при получении версии фото: {str(e)}")
+            self.conn.rollback()
+            return None
+
+    def bulk_update_statuses(self, updates):
+        """
+        Обновляет статусы пачки фото одним запросом
+
+        Отсутствующие в таблице пути добавляются, строки, статус которых
+        не меняется, не перезаписываются. Все изменения фиксируются
+        одной транзакцией, в ней же фактические изменения уходят в ленту
+        изменений (NOTIFY).
+
+        Args:
+            updates (list): Список пар (path, status); при повторе пути
+                побеждает последнее значение
+
+        Returns:
+            list: Список словарей {'path', 'status', 'old_status', 'inserted'}
+                для фактически измененных строк или None при ошибке
+        """
+        # ON CONFLICT не может дважды изменить одну строку в одном запросе
+        latest = dict(updates)
+        if not latest:
+            return []
+
+        try:
+            with self.conn.cursor() as cursor:
+                changed = execute_values(cursor, f"""
+                    WITH input (path, status) AS (VALUES %s),
+                    previous AS (
+                        SELECT t.path, t.status
+                        FROM {self.table_name} t
+                        JOIN input i ON i.path = t.path
+                    ),
+                    upserted AS (
+                        INSERT INTO {self.table_name} AS t (path, status)
+                        SELECT path, status FROM input
+                        ON CONFLICT (path) DO UPDATE SET status = EXCLUDED.status
+                        WHERE t.status IS DISTINCT FROM EXCLUDED.status
+                        RETURNING t.path, t.status
+                    )
+                    SELECT u.path, u.status, p.status, p.path IS NULL
+                    FROM upserted u
+                    LEFT JOIN previous p ON p.path = u.path
+                """, list(latest.items()), page_size=len(latest), fetch=True)
+                if CHANGE_FEED_ENABLED and changed:
+                    notify_changes(cursor, 'status', [[path, status] for path, status, _, _ in changed])
+            self.conn.commit()
+            return [
+                {'path': path, 'status': status, 'old_status': old_status, 'inserted': inserted}
+                for path, status, old_status, inserted in changed
+            ]
+        except Exception as e:
+            logger.error(f"❌ Ошибка при массовом обновлении статусов: {str(e)}")
+            self.conn.rollback()
+            return None
+
+    def iter_photos(self, columns=None, prefix=None, itersize=DB_ITERSIZE, dir_path=None,
+                    changed_since=None):
+        """
+        Потоково читает фото через именованный (серверный) курсор
+
+        Строки приходят пачками по itersize, поэтому память не растет
+        вместе с таблицей. Если соединение было свободно, транзакция
+        курсора завершается после чтения.
+
+        Args:
+            columns (tuple): Имена колонок из PHOTO_COLUMNS; по умолчанию все
+            prefix (str): Вернуть только фото внутри этой директории
+            itersize (int): Сколько строк забирать с сервера за раз
+            dir_path (str): Вернуть только фото, лежащие непосредственно в этой директории
+            changed_since (datetime | bool): Вернуть только строки, измененные
+                начиная с этого времени; True - все строки с известным updated_at
+
+        Yields:
+            dict: Данные о фото с запрошенными колонками
+
+        Raises:
+            ValueError: Если запрошена неизвестная колонка
+        """
+        columns = tuple(columns or PHOTO_COLUMNS)
+        unknown = [column for column in columns if column not in PHOTO_COLUMNS]
+        if unknown:
+            raise ValueError(f"Неизвестные колонки: {', '.join(unknown)}")
+
+        query = f"SELECT {', '.join(columns)} FROM {self.table_name}"
+        conditions, params = [], []
+        if prefix is not None:
+            conditions.append("path LIKE %s")
+            params.append(_like_prefix(prefix.rstrip('/')))
+        if dir_path is not None:
+            conditions.append("dir_path = %s")
+            params.append(dir_path.rstrip('/'))
+        if changed_since is True:
+            conditions.append("updated_at IS NOT NULL")
+        elif changed_since is not None:
+            conditions.append("updated_at >= %s")
+            params.append(changed_since)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        idle = self.conn.info.transaction_status == extensions.TRANSACTION_STATUS_IDLE
+        cursor = self.conn.cursor(name=f"iter_photos_{uuid.uuid4().hex}")
+        cursor.itersize = itersize
+        try:
+            cursor.execute(query, params)
+            for row in cursor:
+                yield dict(zip(columns, row))
+        except Exception as e:
+            logger.error(f"❌ Ошибка при потоковом чтении фото: {str(e)}")
+            raise
+        finally:
+            try:
+                cursor.close()
+                if idle:
+                    self.conn.rollback()
+            except psycopg2.Error:
+                pass
+
     def get_all_photos(self):
         """
         Получение всех фото из базы данных
@@ -147,10 +821,281 @@ class Database:
             logger.error(f"❌ Ошибка при получении списка фото: {str(e)}")
             return []
 
+    def query_photos(self, filters=None, columns=None, after=None, limit=200, descending=False):
+        """
+        Выбирает фото по фильтрам с keyset-пагинацией по (shooting_date, path)
+
+        Следующая страница начинается строго после ключа последней строки
+        предыдущей, поэтому стоимость страницы не зависит от ее номера
+        (в отличие от OFFSET). Сортировку обслуживает индекс по ключу.
+
+        Args:
+            filters (dict): Фильтры: status (список, None - без статуса),
+                is_nude, has_face, is_small, nsfw_min/nsfw_max,
+                clip_min/clip_max, date_from/date_to, dir (директория),
+                under (поддерево)
+            columns (tuple): Имена колонок из PHOTO_COLUMNS; по умолчанию все
+            after (tuple): Ключ последней выданной строки (дата в ISO
+                или 'infinity', путь)
+            limit (int): Размер страницы
+            descending (bool): Сортировать по убыванию
+
+        Returns:
+            tuple: (список словарей с фото, ключ последней строки или None,
+                если страница последняя) или None при ошибке
+
+        Raises:
+            ValueError: Если запрошена неизвестная колонка или фильтр
+        """
+        columns = tuple(columns or PHOTO_COLUMNS)
+        unknown = [column for column in columns if column not in PHOTO_COLUMNS]
+        if unknown:
+            raise ValueError(f"Неизвестные колонки: {', '.join(unknown)}")
+
+        conditions, params = [], []
+        for name, value in (filters or {}).items():
+            if name == 'status':
+                statuses = [status for status in value if status is not None]
+                condition = 'status = ANY(%s)'
+                if None in value:
+                    condition = f"({condition} OR status IS NULL)"
+                conditions.append(condition)
+                params.append(statuses)
+            elif name == 'under':
+                prefix = value.rstrip('/')
+                conditions.append('(dir_path = %s OR dir_path LIKE %s)')
+                params.extend([prefix, _like_prefix(prefix)])
+            elif name in _QUERY_CONDITIONS:
+                conditions.append(_QUERY_CONDITIONS[name])
+                params.append(value)
+            else:
+                raise ValueError(f"Неизвестный фильтр: {name}")
+
+        direction, compare = ('DESC', '<') if descending else ('ASC', '>')
+        if after is not None:
+            conditions.append(f"({SHOOTING_DATE_KEY}, path) {compare} (%s::timestamp, %s)")
+            params.extend(after)
+
+        query = f"SELECT shooting_date, path, {', '.join(columns)} FROM {self.table_name}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        # Лишняя строка показывает, есть ли следующая страница
+        query += f" ORDER BY {SHOOTING_DATE_KEY} {direction}, path {direction} LIMIT %s"
+        params.append(limit + 1)
+
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+        except Exception as e:
+            logger.error(f"❌ Ошибка при выборке фото: {str(e)}")
+            self.conn.rollback()
+            return None
+
+        last_key = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            shooting_date, path = rows[-1][:2]
+            last_key = (shooting_date.isoformat() if shooting_date is not None else 'infinity', path)
+        return [dict(zip(columns, row[2:])) for row in rows], last_key
+
+    def get_directory_statistics(self, prefix, use_summary=False):
+        """
+        Считает статистику поддиректорий на стороне PostgreSQL
+
+        Группировка по первой поддиректории внутри prefix и статусу
+        выполняется в базе, клиенту передаются только агрегаты.
+
+        Args:
+            prefix (str): Путь директории
+            use_summary (bool): Читать сводную таблицу, которую поддерживают
+                триггеры (см. ensure_directory_summary), вместо таблицы фото
+
+        Returns:
+            list: Статистика поддиректорий (см. fold_directory_statistics);
+                файлы самой директории идут под именем '' или None при ошибке
+        """
+        prefix = prefix.rstrip('/')
+        params = {'prefix': prefix, 'pattern': _like_prefix(prefix), 'offset': len(prefix) + 2}
+        if use_summary:
+            query = f"""
+                SELECT CASE WHEN dir_path = %(prefix)s THEN ''
+                            ELSE split_part(substr(dir_path, %(offset)s), '/', 1) END,
+                       NULLIF(status, ''), SUM(file_count), SUM(nude_files),
+                       SUM(face_files), SUM(nsfw_sum), SUM(nsfw_count)
+                FROM {STATS_SUMMARY_TABLE}
+                WHERE dir_path = %(prefix)s OR dir_path LIKE %(pattern)s
+                GROUP BY 1, 2
+            """
+        else:
+            # dir_path = ... OR dir_path LIKE ... обслуживается индексом dir_path
+            query = f"""
+                SELECT CASE WHEN dir_path = %(prefix)s THEN ''
+                            ELSE split_part(substr(dir_path, %(offset)s), '/', 1) END,
+                       status, COUNT(*), SUM(is_nude::int), SUM(has_face::int),
+                       SUM(nsfw_score), COUNT(nsfw_score)
+                FROM {self.table_name}
+                WHERE dir_path = %(prefix)s OR dir_path LIKE %(pattern)s
+                GROUP BY 1, 2
+            """
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute(query, params)
+                return fold_directory_statistics(cursor.fetchall())
+        except Exception as e:
+            logger.error(f"❌ Ошибка при получении статистики директорий: {str(e)}")
+            self.conn.rollback()
+            return None
+
+    def ensure_directory_summary(self):
+        """
+        Создает сводную таблицу статистики директорий и триггеры на таблицу фото
+
+        Триггеры уровня оператора с таблицами переходов пересчитывают
+        только затронутые строки сводки одним запросом на оператор, так
+        что массовое обновление статусов не превращается в тысячи
+        отдельных UPSERT. При первом создании сводка заполняется из таблицы.
+        Использует колонку dir_path, поэтому вызывается после ensure_table_schema.
+
+        Returns:
+            bool: True если сводка готова, False при ошибке
+        """
+        table, summary = self.table_name, STATS_SUMMARY_TABLE
+        aggregate = """
+            INSERT INTO {summary} AS s (dir_path, status, file_count, nude_files,
+                                        face_files, nsfw_sum, nsfw_count)
+            SELECT dir_path, COALESCE(status, ''),
+                   {sign} COUNT(*), {sign} COUNT(*) FILTER (WHERE is_nude),
+                   {sign} COUNT(*) FILTER (WHERE has_face),
+                   {sign} COALESCE(SUM(nsfw_score), 0), {sign} COUNT(nsfw_score)
+            FROM {rows}
+            GROUP BY 1, 2
+            ON CONFLICT (dir_path, status) DO UPDATE SET
+                file_count = s.file_count + EXCLUDED.file_count,
+                nude_files = s.nude_files + EXCLUDED.nude_files,
+                face_files = s.face_files + EXCLUDED.face_files,
+                nsfw_sum = s.nsfw_sum + EXCLUDED.nsfw_sum,
+                nsfw_count = s.nsfw_count + EXCLUDED.nsfw_count;
+        """
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute("SELECT to_regclass(%s)", (summary,))
+                created = cursor.fetchone()[0] is None
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {summary} (
+                        dir_path TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        file_count BIGINT NOT NULL DEFAULT 0,
+                        nude_files BIGINT NOT NULL DEFAULT 0,
+                        face_files BIGINT NOT NULL DEFAULT 0,
+                        nsfw_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+                        nsfw_count BIGINT NOT NULL DEFAULT 0,
+                        PRIMARY KEY (dir_path, status)
+                    )
+                """)
+                cursor.execute(f"""
+                    CREATE INDEX IF NOT EXISTS {summary}_dir_path_idx
+                    ON {summary} (dir_path text_pattern_ops)
+                """)
+                cursor.execute(f"""
+                    CREATE OR REPLACE FUNCTION {summary}_apply() RETURNS trigger AS $$
+                    BEGIN
+                        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                            {aggregate.format(summary=summary, sign='-', rows='old_rows')}
+                        END IF;
+                        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                            {aggregate.format(summary=summary, sign='', rows='new_rows')}
+                        END IF;
+                        DELETE FROM {summary} WHERE file_count = 0;
+                        RETURN NULL;
+                    END
+                    $$ LANGUAGE plpgsql
+                """)
+                # CREATE TRIGGER блокирует таблицу фото целиком, создаем только недостающие
+                cursor.execute("""
+                    SELECT tgname FROM pg_trigger
+                    WHERE tgrelid = to_regclass(%s) AND NOT tgisinternal
+                """, (table,))
+                existing = {row[0] for row in cursor.fetchall()}
+                # Таблицы переходов допускаются только у триггеров на одно событие
+                for event, transition in (('INSERT', 'NEW TABLE AS new_rows'),
+                                          ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+                                          ('DELETE', 'OLD TABLE AS old_rows')):
+                    trigger = f"{summary}_{event.lower()}"
+                    if trigger in existing:
+                        continue
+                    cursor.execute(f"""
+                        CREATE TRIGGER {trigger} AFTER {event} ON {table}
+                        REFERENCING {transition}
+                        FOR EACH STATEMENT EXECUTE FUNCTION {summary}_apply()
+                    """)
+                if created:
+                    # Блокируем записи, чтобы не потерять изменения между
+                    # созданием триггеров и начальным заполнением
+                    cursor.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+                    cursor.execute(
+                        aggregate.format(summary=summary, sign='', rows=table)
+                    )
+            self.conn.commit()
+            logger.info("✅ Сводная таблица статистики директорий проверена/создана")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка при создании сводной таблицы статистики: {str(e)}")
+            self.conn.rollback()
+            return False
+
+    def get_tree_watermark(self, previous=None):
+        """
+        Получает отметку таблицы для кэша и снимка дерева
+
+        Время последнего изменения строк (updated_at), количество строк и
+        счетчик операторов DELETE/TRUNCATE. В отличие от счетчиков
+        pg_stat_user_tables, отметка транзакционна: в ней видны только
+        закоммиченные изменения. Дерево, построенное после отметки,
+        дочитывает только строки с updated_at не раньше нее; если с тех пор
+        строки удалялись, дерево нужно строить заново.
+
+        MAX(updated_at) берется из индекса, а COUNT(*) читает всю таблицу,
+        поэтому при переданной прошлой отметке строки считаются, только
+        если сдвинулись updated_at или счетчик удалений: вставка всегда
+        сдвигает updated_at, удаление - счетчик, иначе количество прежнее.
+
+        Args:
+            previous (dict): Прошлая отметка, с которой сравнивается текущая
+
+        Returns:
+            dict: {'updated_at': datetime или None, 'count': int, 'deletes': int}
+                или None при ошибке
+        """
+        previous = previous or {}
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute(f"""
+                    WITH mark AS (
+                        SELECT (SELECT MAX(updated_at) FROM {self.table_name}) AS updated_at,
+                               (SELECT COALESCE(MAX(deletes), 0) FROM {self.table_name}_deletes) AS deletes
+                    )
+                    SELECT updated_at, deletes,
+                           CASE WHEN updated_at IS NOT DISTINCT FROM %s::timestamptz AND deletes = %s
+                                THEN NULL ELSE (SELECT COUNT(*) FROM {self.table_name}) END
+                    FROM mark
+                """, (previous.get('updated_at'), previous.get('deletes')))
+                updated_at, deletes, count = cursor.fetchone()
+                if count is None:
+                    count = previous['count']
+                return {'updated_at': updated_at, 'count': count, 'deletes': deletes}
+        except Exception as e:
+            logger.error(f"❌ Ошибка при получении отметки таблицы: {str(e)}")
+            self.conn.rollback()
+            return None
+
     def close(self):
         """
-        Закрывает соединение с базой данных
+        Закрывает соединение с базой данных или возвращает его в пул
         """
         if self.conn:
-            self.conn.close()
+            if self.pooled:
+                get_pool().putconn(self.conn)
+            else:
+                self.conn.close()
             self.conn = None 
\ No newline at end of file
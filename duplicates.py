@@ -0,0 +1,218 @@
+import logging
+from collections import defaultdict
+from itertools import combinations
+from math import comb
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy необязателен, без него поиск идет на чистом Python
+    np = None
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+# До какой ширины части ключа искать совпадения по таблице, а не двоичным поиском
+DIRECT_TABLE_BITS = 22
+
+
+def parse_phash(value) -> Optional[int]:
+    """
+    Разбирает perceptual hash из таблицы (hex-строка imagehash)
+
+    Returns:
+        Optional[int]: 64-битное значение или None, если хэш пуст или длиннее 64 бит
+    """
+    if not value:
+        return None
+    try:
+        parsed = int(value, 16)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed < (1 << HASH_BITS) else None
+
+
+def _plan(n: int, max_distance: int) -> Tuple[List[int], int]:
+    """
+    Выбирает разбиение хэша на части для многоиндексного поиска
+
+    Если хэш разделен на m частей, у двух хэшей на расстоянии не больше d
+    хотя бы одна часть отличается не больше чем на d // m бит (принцип
+    Дирихле). Чем больше частей, тем меньше вариантов перебора внутри
+    части, но короче ключ и больше случайных кандидатов - выбираем m с
+    наименьшей оценкой числа проверок.
+
+    Returns:
+        Tuple[List[int], int]: Границы частей в битах и допуск внутри части
+    """
+    best = None
+    for chunks in range(1, min(max_distance + 1, HASH_BITS) + 1):
+        width = -(-HASH_BITS // chunks)
+        radius = max_distance // chunks
+        probes = sum(comb(width, k) for k in range(radius + 1))
+        cost = chunks * probes * (n + n * n / 2.0 ** width)
+        if best is None or cost < best[0]:
+            best = (cost, chunks, radius)
+    _, chunks, radius = best
+    return [HASH_BITS * k // chunks for k in range(chunks + 1)], radius
+
+
+def _chunk_masks(width: int, radius: int) -> List[int]:
+    """
+    Все маски ширины width, в которых не больше radius единиц
+    """
+    return [sum(1 << bit for bit in bits)
+            for k in range(radius + 1) for bits in combinations(range(width), k)]
+
+
+def _near_pairs_python(hashes: List[int], max_distance: int) -> Iterable[Tuple[int, int]]:
+    """
+    Многоиндексный поиск близких пар на чистом Python (см. _plan)
+    """
+    bounds, radius = _plan(len(hashes), max_distance)
+    seen = set()
+    for low, high in zip(bounds, bounds[1:]):
+        key_mask = (1 << (high - low)) - 1
+        keys = [(value >> low) & key_mask for value in hashes]
+        index: Dict[int, List[int]] = defaultdict(list)
+        for i, key in enumerate(keys):
+            index[key].append(i)
+        masks = _chunk_masks(high - low, radius)
+        for i, key in enumerate(keys):
+            value = hashes[i]
+            for mask in masks:
+                for j in index.get(key ^ mask, ()):
+                    if j > i and (i, j) not in seen and bin(value ^ hashes[j]).count('1') <= max_distance:
+                        seen.add((i, j))
+                        yield i, j
+
+
+def _popcount(values):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    # numpy < 2.0: считаем единицы побайтно
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def _near_pairs_numpy(hashes: List[int], max_distance: int,
+                      block: int = 65536) -> Iterable[Tuple[int, int]]:
+    """
+    Многоиндексный поиск близких пар на numpy (см. _plan)
+
+    Для каждой части и каждой маски допуска совпадения ключей ищутся
+    через searchsorted по отсортированным ключам сразу для блока хэшей,
+    кандидаты проверяются векторно через popcount от XOR.
+    """
+    values = np.array(hashes, dtype=np.uint64)
+    n = len(values)
+    bounds, radius = _plan(n, max_distance)
+    found = []
+    for low, high in zip(bounds, bounds[1:]):
+        keys = (values >> np.uint64(low)) & np.uint64((1 << (high - low)) - 1)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        # Для коротких ключей таблица начал серий вместо двоичного поиска
+        starts = None
+        if high - low <= DIRECT_TABLE_BITS:
+            starts = np.concatenate(([0], np.cumsum(np.bincount(keys.astype(np.int64), minlength=1 << (high - low)))))
+        for mask in _chunk_masks(high - low, radius):
+            for start in range(0, n, block):
+                probe = keys[start:start + block] ^ np.uint64(mask)
+                if starts is not None:
+                    left = starts[probe]
+                    counts = starts[probe + np.uint64(1)] - left
+                else:
+                    left = np.searchsorted(sorted_keys, probe, 'left')
+                    counts = np.searchsorted(sorted_keys, probe, 'right') - left
+                total = int(counts.sum())
+                if not total:
+                    continue
+                # Разворачиваем диапазоны [left, left + count) в пары кандидатов
+                first = np.repeat(np.arange(start, start + len(probe)), counts)
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                second = order[np.repeat(left, counts) + offsets]
+                keep = second > first
+                first, second = first[keep], second[keep]
+                close = _popcount(values[first] ^ values[second]) <= max_distance
+                found.append(first[close].astype(np.int64) * n + second[close])
+    if not found:
+        return []
+    codes = np.unique(np.concatenate(found))
+    return zip((codes // n).tolist(), (codes % n).tolist())
+
+
+def find_duplicate_clusters(photos: Iterable[Dict], max_distance: int = 6,
+                            use_numpy: Optional[bool] = None) -> List[Dict]:
+    """
+    Группирует точные и почти-дубликаты фотографий
+
+    Точные дубликаты определяются по hash_sha256, почти-дубликаты - по
+    расстоянию Хэмминга между phash. Кластер - компонента связности:
+    серия похожих кадров попадает в один кластер, даже если крайние
+    кадры отличаются сильнее порога.
+
+    Args:
+        photos (Iterable[Dict]): Записи с path, phash и hash_sha256
+        max_distance (int): Максимальное расстояние Хэмминга между phash
+        use_numpy (Optional[bool]): Использовать numpy; по умолчанию если установлен
+
+    Returns:
+        List[Dict]: Кластеры {'paths', 'exact', 'size'} по убыванию размера;
+            exact - группы путей с одинаковым hash_sha256
+    """
+    use_numpy = np is not None if use_numpy is None else use_numpy and np is not None
+
+    # Узлы графа - уникальные файлы (по sha256) или пути без sha256
+    node_of: Dict[str, int] = {}
+    node_paths: List[List[str]] = []
+    node_hash: List[Optional[int]] = []
+    for photo in photos:
+        key = photo.get('hash_sha256') or f"path:{photo['path']}"
+        node = node_of.get(key)
+        if node is None:
+            node = node_of[key] = len(node_paths)
+            node_paths.append([])
+            node_hash.append(parse_phash(photo.get('phash')))
+        node_paths[node].append(photo['path'])
+
+    parent = list(range(len(node_paths)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        i, j = find(i), find(j)
+        if i != j:
+            parent[max(i, j)] = min(i, j)
+
+    # Одинаковые phash склеиваем сразу, дальше ищем пары среди уникальных
+    by_hash: Dict[int, List[int]] = defaultdict(list)
+    for node, value in enumerate(node_hash):
+        if value is not None:
+            by_hash[value].append(node)
+    for nodes in by_hash.values():
+        for node in nodes[1:]:
+            union(nodes[0], node)
+
+    unique = list(by_hash)
+    if max_distance > 0 and len(unique) > 1:
+        near_pairs = _near_pairs_numpy if use_numpy else _near_pairs_python
+        for i, j in near_pairs(unique, max_distance):
+            union(by_hash[unique[i]][0], by_hash[unique[j]][0])
+
+    clusters: Dict[int, List[int]] = defaultdict(list)
+    for node in range(len(node_paths)):
+        clusters[find(node)].append(node)
+
+    result = []
+    for nodes in clusters.values():
+        if len(nodes) == 1 and len(node_paths[nodes[0]]) == 1:
+            continue
+        paths = sorted(path for node in nodes for path in node_paths[node])
+        exact = sorted(sorted(node_paths[node]) for node in nodes if len(node_paths[node]) > 1)
+        result.append({'paths': paths, 'exact': exact, 'size': len(paths)})
+    result.sort(key=lambda cluster: (-cluster['size'], cluster['paths'][0]))
+    return result
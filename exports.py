@@ -0,0 +1,58 @@
+import csv
+import io
+import json
+from typing import Dict, Iterable, Iterator, Sequence
+
+# Сколько строк собирать в один кусок ответа
+EXPORT_CHUNK_ROWS = 500
+
+
+def iter_ndjson(photos: Iterable[Dict], chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[str]:
+    """
+    Сериализует фото в NDJSON (одна JSON-строка на фото) кусками
+
+    Args:
+        photos (Iterable[Dict]): Поток записей о фото
+        chunk_rows (int): Сколько строк отдавать одним куском
+
+    Yields:
+        str: Кусок ответа
+    """
+    lines = []
+    for photo in photos:
+        # Даты и прочие не-JSON типы передаем строками
+        lines.append(json.dumps(photo, ensure_ascii=False, default=str))
+        if len(lines) >= chunk_rows:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def iter_csv(photos: Iterable[Dict], columns: Sequence[str],
+             chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[str]:
+    """
+    Сериализует фото в CSV с заголовком кусками
+
+    Args:
+        photos (Iterable[Dict]): Поток записей о фото
+        columns (Sequence[str]): Колонки в порядке вывода
+        chunk_rows (int): Сколько строк отдавать одним куском
+
+    Yields:
+        str: Кусок ответа
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    rows = 0
+    for photo in photos:
+        writer.writerow(photo)
+        rows += 1
+        if rows >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            rows = 0
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,215 @@
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(*parts) -> str:
+    """
+    Строит ключ кэша из произвольных частей (путь, хэш, дата изменения...)
+
+    Returns:
+        str: sha256 от частей ключа в hex
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class MemoryLRUCache:
+    def __init__(self, max_bytes: int, name: str = 'memory'):
+        """
+        LRU-кэш байтовых значений в памяти с ограничением по объему
+
+        Args:
+            max_bytes (int): Максимальный суммарный размер значений
+            name (str): Имя кэша в метриках попаданий
+        """
+        self.max_bytes = max_bytes
+        self.name = name
+        self.current_bytes = 0
+        self._items: "OrderedDict[str, Tuple[bytes, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Получает значение и отмечает его как недавно использованное
+
+        Returns:
+            Optional[Tuple[bytes, str]]: Данные и mimetype или None
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+        CACHE_REQUESTS.inc(cache=self.name, result='miss' if item is None else 'hit')
+        return item
+
+    def put(self, key: str, data: bytes, mimetype: str):
+        """
+        Сохраняет значение, вытесняя давно не использованные записи
+        """
+        size = len(data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old[0])
+            self._items[key] = (data, mimetype)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (evicted, _) = self._items.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DiskCache:
+    def __init__(self, directory: str, max_bytes: int, name: str = 'disk'):
+        """
+        Кэш файлов на локальном диске, адресуемый по ключу
+
+        Файлы раскладываются по подкаталогам из первых символов ключа.
+        Время последнего использования хранится в mtime файла, при
+        превышении бюджета удаляются самые давно использованные файлы.
+
+        Args:
+            directory (str): Каталог кэша
+            max_bytes (int): Максимальный суммарный размер файлов
+            name (str): Имя кэша в метриках попаданий
+        """
+        self.directory = directory
+        self.name = name
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> (размер, время последнего использования)
+        self._index: Dict[str, Tuple[int, float]] = {}
+        self.current_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith('.'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                self._index[name] = (st.st_size, st.st_mtime)
+                self.current_bytes += st.st_size
+
+    def path_for(self, key: str) -> str:
+        """
+        Возвращает путь к файлу кэша для ключа
+        """
+        return os.path.join(self.directory, key[:2], key)
+
+    def get_path(self, key: str) -> Optional[str]:
+        """
+        Возвращает путь к закэшированному файлу, если он есть
+
+        Returns:
+            Optional[str]: Путь к файлу или None
+        """
+        with self._lock:
+            entry = self._index.get(key)
+        if entry is None:
+            CACHE_REQUESTS.inc(cache=self.name, result='miss')
+            return None
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except OSError:
+            # Файл удалили снаружи
+            with self._lock:
+                if self._index.pop(key, None) is not None:
+                    self.current_bytes -= entry[0]
+            CACHE_REQUESTS.inc(cache=self.name, result='miss')
+            return None
+        CACHE_REQUESTS.inc(cache=self.name, result='hit')
+        with self._lock:
+            if key in self._index:
+                self._index[key] = (entry[0], os.path.getmtime(path))
+        return path
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Читает закэшированные данные
+
+        Returns:
+            Optional[bytes]: Данные или None
+        """
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, key: str, data: bytes) -> Optional[str]:
+        """
+        Атомарно записывает данные в кэш
+
+        Returns:
+            Optional[str]: Путь к записанному файлу или None при ошибке
+        """
+        size = len(data)
+        if size > self.max_bytes:
+            return None
+        path = self.path_for(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Пишем во временный файл и переименовываем, чтобы читатели
+            # никогда не видели недописанный файл
+            fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"⚠️ Ошибка записи в дисковый кэш: {str(e)}")
+            return None
+
+        with self._lock:
+            old = self._index.get(key)
+            if old is not None:
+                self.current_bytes -= old[0]
+            self._index[key] = (size, os.path.getmtime(path))
+            self.current_bytes += size
+            if self.current_bytes > self.max_bytes:
+                self._evict()
+        return path
+
+    def _evict(self):
+        """
+        Удаляет давно использованные файлы до 90% бюджета; вызывается под _lock
+        """
+        target = self.max_bytes * 0.9
+        for key, (size, _) in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if self.current_bytes <= target:
+                break
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"⚠️ Не удалось удалить файл кэша: {str(e)}")
+                continue
+            del self._index[key]
+            self.current_bytes -= size
+
+    def __len__(self):
+        return len(self._index)
@@ -0,0 +1,184 @@
+import io
+import time
+import logging
+from collections import namedtuple
+from typing import Iterator, Optional, Tuple
+from PIL import ExifTags, Image
+from config import PREVIEW_RESAMPLE, PREVIEW_DRAFT_GAP, PREVIEW_USE_EMBEDDED
+
+logger = logging.getLogger(__name__)
+
+RESAMPLE_FILTERS = {
+    'nearest': Image.NEAREST,
+    'box': Image.BOX,
+    'bilinear': Image.BILINEAR,
+    'hamming': Image.HAMMING,
+    'bicubic': Image.BICUBIC,
+    'lanczos': Image.LANCZOS,
+}
+
+# Теги IFD1 с положением встроенной JPEG-миниатюры
+EXIF_THUMBNAIL_OFFSET = 0x0201
+EXIF_THUMBNAIL_LENGTH = 0x0202
+
+
+def get_resample_filter(name: Optional[str] = None) -> int:
+    """
+    Возвращает фильтр Pillow по имени из конфигурации
+
+    Args:
+        name (Optional[str]): Имя фильтра, по умолчанию PREVIEW_RESAMPLE
+
+    Returns:
+        int: Константа фильтра Pillow
+    """
+    name = (name or PREVIEW_RESAMPLE).lower()
+    if name not in RESAMPLE_FILTERS:
+        raise ValueError(f"Неизвестный фильтр ресемплинга: {name}")
+    return RESAMPLE_FILTERS[name]
+
+
+def fit_size(width: int, height: int, size: int) -> Tuple[int, int]:
+    """
+    Размер с длинной стороной size и исходными пропорциями (без увеличения)
+    """
+    scale = min(1.0, size / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _exif_thumbnail(img: Image.Image) -> Optional[bytes]:
+    """
+    Достает JPEG-миниатюру из IFD1 блока EXIF, если она есть
+    """
+    exif = img.info.get('exif')
+    if not exif or not exif.startswith(b'Exif\x00\x00'):
+        return None
+    tiff = exif[6:]
+    try:
+        ifd1 = img.getexif().get_ifd(ExifTags.IFD.IFD1)
+    except Exception:
+        return None
+    offset = ifd1.get(EXIF_THUMBNAIL_OFFSET)
+    length = ifd1.get(EXIF_THUMBNAIL_LENGTH)
+    if not offset or not length or offset + length > len(tiff):
+        return None
+    return tiff[offset:offset + length]
+
+
+def _embedded_previews(img: Image.Image) -> Iterator[Image.Image]:
+    """
+    Перебирает встроенные в файл уменьшенные копии изображения
+
+    Это дополнительные кадры MPF (большие превью, которые пишут многие
+    камеры) и миниатюра EXIF.
+    """
+    if getattr(img, 'n_frames', 1) > 1 and img.format == 'MPO':
+        for frame in range(1, img.n_frames):
+            img.seek(frame)
+            yield img
+        img.seek(0)
+
+    thumbnail = _exif_thumbnail(img)
+    if thumbnail:
+        try:
+            with Image.open(io.BytesIO(thumbnail)) as embedded:
+                embedded.load()
+                yield embedded
+        except Exception:
+            pass
+
+
+def load_reduced(img: Image.Image, size: int, draft_gap: float = PREVIEW_DRAFT_GAP,
+                 use_embedded: bool = PREVIEW_USE_EMBEDDED) -> Image.Image:
+    """
+    Загружает изображение в минимальном разрешении, достаточном для size
+
+    Для JPEG сначала ищется встроенное превью не меньше нужного размера,
+    иначе используется draft(): libjpeg масштабирует DCT-блоки при
+    декодировании в 1/2, 1/4 или 1/8, и полноразмерный растр не создается.
+
+    Args:
+        img (Image.Image): Открытое, но еще не загруженное изображение
+        size (int): Целевая длинная сторона
+        draft_gap (float): Во сколько раз декодированный размер может
+            превышать целевой (больше - качественнее, но медленнее)
+        use_embedded (bool): Использовать встроенные превью
+
+    Returns:
+        Image.Image: Загруженное изображение (возможно, уменьшенное)
+    """
+    width, height = img.size
+    target = fit_size(width, height, size)
+
+    if use_embedded and img.format in ('JPEG', 'MPO'):
+        for embedded in _embedded_previews(img):
+            # Встроенное превью годится, только если оно не меньше
+            # нужного размера и имеет те же пропорции
+            ew, eh = embedded.size
+            if (max(ew, eh) >= size and max(ew, eh) < max(width, height)
+                    and abs(ew / eh - width / height) < 0.01):
+                logger.debug(f"Используем встроенное превью {ew}x{eh} вместо {width}x{height}")
+                embedded.load()
+                return embedded.copy()
+
+    if img.format in ('JPEG', 'MPO'):
+        mode = 'RGB' if img.mode not in ('L', 'RGB') else img.mode
+        img.draft(mode, (int(target[0] * draft_gap), int(target[1] * draft_gap)))
+    img.load()
+    return img
+
+
+# Результат обработки в пуле: данные и длительности этапов (сек).
+# Длительности возвращаются вместе с результатом, потому что воркер
+# может быть отдельным процессом со своими метриками.
+RenderedImage = namedtuple('RenderedImage', ['data', 'timings'])
+
+
+def render_preview(path: str, size: int, resample: Optional[str] = None,
+                   quality: int = 85, optimize: bool = True) -> RenderedImage:
+    """
+    Генерирует JPEG-превью с длинной стороной не больше size
+
+    Args:
+        path (str): Путь к оригиналу
+        size (int): Целевая длинная сторона
+        resample (Optional[str]): Фильтр ресемплинга, по умолчанию PREVIEW_RESAMPLE
+        quality (int): Качество JPEG
+        optimize (bool): Оптимизировать таблицы Хаффмана (медленнее, меньше файл)
+
+    Returns:
+        RenderedImage: Закодированное превью и длительности этапов decode, resize, encode
+    """
+    started = time.perf_counter()
+    with Image.open(path) as original:
+        width, height = original.size
+        img = load_reduced(original, size)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        decoded = time.perf_counter()
+
+        target = fit_size(width, height, size)
+        if img.size != target:
+            img = img.resize(target, get_resample_filter(resample))
+        resized = time.perf_counter()
+
+        output_buffer = io.BytesIO()
+        img.save(output_buffer, format='JPEG', quality=quality, optimize=optimize)
+        encoded = time.perf_counter()
+        logger.debug(f"Превью {path}: {width}x{height} -> {target[0]}x{target[1]}")
+        return RenderedImage(output_buffer.getvalue(), {
+            'decode': decoded - started,
+            'resize': resized - decoded,
+            'encode': encoded - resized,
+        })
+
+
+def make_preview(path: str, size: int, resample: Optional[str] = None,
+                 quality: int = 85, optimize: bool = True) -> bytes:
+    """
+    Генерирует JPEG-превью (см. render_preview) и возвращает только данные
+
+    Returns:
+        bytes: Закодированное превью
+    """
+    return render_preview(path, size, resample, quality, optimize).data
@@ -0,0 +1,168 @@
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Hashable, Optional
+from metrics import IMAGE_JOB_SECONDS, IMAGE_STAGE_SECONDS
+from config import (
+    MAX_WORKERS, IMAGE_POOL_KIND, IMAGE_POOL_MAX_PENDING,
+    IMAGE_JOB_TIMEOUT, IMAGE_POOL_RETRY_AFTER
+)
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPoolBusy(Exception):
+    def __init__(self, retry_after: int = IMAGE_POOL_RETRY_AFTER):
+        """
+        Пул обработки изображений перегружен
+
+        Args:
+            retry_after (int): Через сколько секунд клиенту стоит повторить запрос
+        """
+        super().__init__("Пул обработки изображений перегружен")
+        self.retry_after = retry_after
+
+
+class ImageWorkerPool:
+    def __init__(self, workers: int = MAX_WORKERS, max_pending: int = IMAGE_POOL_MAX_PENDING,
+                 timeout: float = IMAGE_JOB_TIMEOUT, kind: str = IMAGE_POOL_KIND):
+        """
+        Пул процессов для ресайза/кодирования изображений вне потоков Flask
+
+        Одинаковые задания (по ключу), поставленные одновременно, выполняются
+        один раз, и все ожидающие получают общий результат. Количество
+        заданий в работе ограничено: сверх max_pending выбрасывается
+        WorkerPoolBusy, фоновым заданиям доступны только свободные воркеры.
+
+        Args:
+            workers (int): Количество процессов
+            max_pending (int): Максимум заданий в работе и в очереди
+            timeout (float): Сколько ждать результат задания
+            kind (str): process - пул процессов, thread - пул потоков
+        """
+        self.workers = workers
+        self.max_pending = max(max_pending, workers)
+        self.timeout = timeout
+        self.kind = kind
+        self._executor = None
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == 'thread':
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image')
+            else:
+                # spawn безопаснее fork в многопоточном процессе сервера
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+        return self._executor
+
+    @property
+    def pending(self) -> int:
+        """
+        Количество заданий в работе и в очереди
+        """
+        return len(self._inflight)
+
+    def submit(self, key: Hashable, fn: Callable, *args, background: bool = False) -> Future:
+        """
+        Ставит задание в пул или присоединяется к уже выполняющемуся
+
+        Args:
+            key (Hashable): Ключ задания для объединения одинаковых запросов
+            fn (Callable): Функция уровня модуля (должна сериализоваться pickle)
+            background (bool): Фоновое задание, не занимает очередь
+
+        Returns:
+            Future: Результат задания
+
+        Raises:
+            WorkerPoolBusy: Если пул перегружен
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+
+            limit = self.workers if background else self.max_pending
+            if len(self._inflight) >= limit:
+                raise WorkerPoolBusy()
+
+            try:
+                future = self._get_executor().submit(fn, *args)
+            except BrokenProcessPool:
+                logger.error("❌ Пул обработки изображений сломан, пересоздаем")
+                self._executor = None
+                future = self._get_executor().submit(fn, *args)
+            self._inflight[key] = future
+
+        started = time.perf_counter()
+        future.add_done_callback(lambda _: self._release(key, future, started))
+        return future
+
+    def _release(self, key: Hashable, future: Future, started: float):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        self._observe(key, future, time.perf_counter() - started)
+
+    @staticmethod
+    def _observe(key: Hashable, future: Future, elapsed: float):
+        """
+        Записывает метрики завершенного задания (один раз на задание,
+        сколько бы запросов его ни ждали)
+        """
+        kind = key[0] if isinstance(key, tuple) and key else 'other'
+        if future.cancelled():
+            outcome, result = 'cancelled', None
+        elif future.exception() is not None:
+            outcome, result = 'error', None
+        else:
+            outcome, result = 'ok', future.result()
+        IMAGE_JOB_SECONDS.observe(elapsed, kind=kind, outcome=outcome)
+        # Этапы обработки замеряет сам воркер (см. image_processing.RenderedImage)
+        for stage, seconds in (getattr(result, 'timings', None) or {}).items():
+            IMAGE_STAGE_SECONDS.observe(seconds, stage=stage)
+
+    def run(self, key: Hashable, fn: Callable, *args, background: bool = False,
+            timeout: Optional[float] = None):
+        """
+        Выполняет задание в пуле и ждет результат
+
+        По таймауту ожидание прекращается, но задание досчитывается и
+        до завершения продолжает занимать место в пуле.
+
+        Raises:
+            WorkerPoolBusy: Если пул перегружен
+            concurrent.futures.TimeoutError: Если результат не получен за timeout
+        """
+        future = self.submit(key, fn, *args, background=background)
+        return future.result(timeout=self.timeout if timeout is None else timeout)
+
+    def shutdown(self):
+        """
+        Останавливает пул
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_pool: Optional[ImageWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_image_pool() -> ImageWorkerPool:
+    """
+    Возвращает общий для процесса пул обработки изображений
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ImageWorkerPool()
+        return _pool
@@ -0,0 +1,284 @@
+import time
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, получено {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """
+        Монотонно растущий счетчик
+
+        Args:
+            name (str): Имя метрики (с суффиксом _total)
+            documentation (str): Описание для # HELP
+            labelnames (Sequence[str]): Имена меток
+        """
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        Гистограмма длительностей с фиксированными корзинами
+
+        Кроме корзин хранит сумму и количество наблюдений, поэтому
+        отдельный счетчик событий для той же операции не нужен.
+
+        Args:
+            name (str): Имя метрики (с суффиксом _seconds)
+            documentation (str): Описание для # HELP
+            labelnames (Sequence[str]): Имена меток
+            buckets (Sequence[float]): Верхние границы корзин по возрастанию
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # Метки -> [счетчики корзин (не накопленные), сумма, количество]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Замеряет длительность блока with
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, [list(state[0]), state[1], state[2]]) for key, state in self._values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        """
+        Набор метрик процесса, отдаваемый в текстовом формате Prometheus
+        """
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # Повторная регистрация (перезагрузка модуля) возвращает ту же метрику
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Метрика {metric.name} уже зарегистрирована с другим типом или метками")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        Текстовое представление всех метрик (формат exposition 0.0.4)
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Метрики приложения. Каждый процесс (воркер сервера) считает свои значения.
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'photo_admin_http_request_duration_seconds', 'Время обработки HTTP-запроса',
+    ('endpoint', 'method', 'status'))
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    'photo_admin_db_query_duration_seconds', 'Время выполнения SQL-запроса', ('operation',))
+DB_QUERY_ERRORS = REGISTRY.counter(
+    'photo_admin_db_query_errors_total', 'SQL-запросы, завершившиеся ошибкой', ('operation',))
+TREE_BUILD_SECONDS = REGISTRY.histogram(
+    'photo_admin_tree_build_duration_seconds', 'Время построения дерева фотографий', ('tree',),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+IMAGE_JOB_SECONDS = REGISTRY.histogram(
+    'photo_admin_image_job_duration_seconds', 'Время задания пула изображений с учетом очереди',
+    ('kind', 'outcome'))
+IMAGE_STAGE_SECONDS = REGISTRY.histogram(
+    'photo_admin_image_stage_duration_seconds', 'Время этапов обработки изображения', ('stage',))
+CACHE_REQUESTS = REGISTRY.counter(
+    'photo_admin_cache_requests_total', 'Обращения к кэшам', ('cache', 'result'))
+UPSTREAM_REQUEST_SECONDS = REGISTRY.histogram(
+    'photo_admin_upstream_request_duration_seconds', 'Время запроса к внешнему сервису',
+    ('upstream', 'outcome'))
+
+
+class RequestTrace:
+    def __init__(self, name: str):
+        """
+        Подробная трассировка одного запроса
+
+        Собирает длительности отдельных операций (SQL-запросов, построения
+        дерева и т.п.), которые в конце запроса пишутся в лог и в
+        заголовок Server-Timing.
+
+        Args:
+            name (str): Имя запроса (метод и endpoint)
+        """
+        self.name = name
+        self.started = time.perf_counter()
+        # (категория, длительность, подробности)
+        self.spans: List[Tuple[str, float, str]] = []
+
+    def add(self, category: str, seconds: float, detail: str = ''):
+        self.spans.append((category, seconds, detail))
+
+    def totals(self) -> Dict[str, Tuple[int, float]]:
+        """
+        Количество и суммарная длительность операций по категориям
+        """
+        totals: Dict[str, Tuple[int, float]] = {}
+        for category, seconds, _ in self.spans:
+            count, total = totals.get(category, (0, 0.0))
+            totals[category] = (count + 1, total + seconds)
+        return totals
+
+    def server_timing(self) -> str:
+        """
+        Значение заголовка Server-Timing
+        """
+        parts = [f'{category};dur={total * 1000:.1f};desc="{count}"'
+                 for category, (count, total) in sorted(self.totals().items())]
+        parts.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(parts)
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('photo_admin_trace', default=None)
+
+
+def should_trace(forced: bool, sample_rate: float) -> bool:
+    """
+    Решает, трассировать ли запрос: по явному запросу клиента или выборочно
+    """
+    return forced or (sample_rate > 0 and random.random() < sample_rate)
+
+
+def start_trace(name: str) -> RequestTrace:
+    trace = RequestTrace(name)
+    _current_trace.set(trace)
+    return trace
+
+
+def finish_trace() -> Optional[RequestTrace]:
+    trace = _current_trace.get()
+    _current_trace.set(None)
+    return trace
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def record_span(category: str, seconds: float, detail: str = ''):
+    """
+    Добавляет операцию в трассировку текущего запроса, если она ведется
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(category, seconds, detail)
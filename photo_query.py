@@ -0,0 +1,91 @@
+import json
+import base64
+from datetime import datetime
+from typing import Dict, Tuple
+
+_BOOL_VALUES = {'1': True, 'true': True, 'yes': True, '0': False, 'false': False, 'no': False}
+
+
+def _parse_bool(value: str) -> bool:
+    try:
+        return _BOOL_VALUES[value.lower()]
+    except KeyError:
+        raise ValueError(f"Ожидалось булево значение: {value}")
+
+
+def _parse_statuses(value: str):
+    # 'null' означает фото без статуса
+    return [None if status == 'null' else status for status in value.split(',') if status]
+
+
+# Фильтр -> функция разбора значения из строки запроса
+QUERY_FILTERS = {
+    'status': _parse_statuses,
+    'is_nude': _parse_bool,
+    'has_face': _parse_bool,
+    'is_small': _parse_bool,
+    'nsfw_min': float,
+    'nsfw_max': float,
+    'clip_min': float,
+    'clip_max': float,
+    'date_from': datetime.fromisoformat,
+    'date_to': datetime.fromisoformat,
+    'dir': str,
+    'under': str,
+}
+
+
+def parse_query_filters(args) -> Dict:
+    """
+    Разбирает фильтры запроса фото из параметров URL
+
+    Args:
+        args (Mapping): Параметры запроса (request.args)
+
+    Returns:
+        Dict: Фильтры для Database.query_photos
+
+    Raises:
+        ValueError: Если значение фильтра некорректно
+    """
+    filters = {}
+    for name, parse in QUERY_FILTERS.items():
+        value = args.get(name)
+        if value is None or value == '':
+            continue
+        try:
+            filters[name] = parse(value)
+        except ValueError:
+            raise ValueError(f"Некорректное значение фильтра {name}: {value}")
+    return filters
+
+
+def encode_keyset_cursor(key: Tuple[str, str]) -> str:
+    """
+    Кодирует ключ последней выданной строки для передачи клиенту
+
+    Args:
+        key (Tuple[str, str]): Дата съемки в ISO (или 'infinity') и путь,
+            как их возвращает Database.query_photos
+    """
+    raw = json.dumps(list(key), ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_keyset_cursor(cursor: str) -> Tuple[str, str]:
+    """
+    Декодирует курсор, созданный encode_keyset_cursor
+
+    Returns:
+        Tuple[str, str]: Ключ даты съемки (ISO или 'infinity') и путь
+
+    Raises:
+        ValueError: Если курсор некорректен
+    """
+    try:
+        key, path = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if key != 'infinity':
+            datetime.fromisoformat(key)
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError(f"Некорректный курсор: {cursor}")
+    return key, path
@@ -1,8 +1,79 @@
 import os
+import base64
 from collections import defaultdict
-from typing import Dict, List, Optional
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 from database import Database
 
+def _split_parts(path: str, base_path: str) -> Tuple[str, ...]:
+    """
+    Разбивает путь на компоненты, пропуская базовый путь
+    """
+    # Нормализуем путь и разбиваем на компоненты
+    normalized_path = os.path.normpath(path)
+    
+    # Если есть базовый путь, убираем его из начала
+    if base_path and normalized_path.startswith(base_path):
+        normalized_path = normalized_path[len(base_path):].lstrip(os.sep)
+        
+    parts = normalized_path.split(os.sep)
+    # Убираем пустые компоненты и точку в начале пути
+    return tuple(p for p in parts if p and p != '.')
+
+# os.path.normpath заметно дороже поиска в словаре, а одни и те же пути
+# директорий запрашиваются постоянно. При построении дерева кэш не
+# используется, чтобы пути файлов не вытесняли из него директории
+_split_parts_cached = lru_cache(maxsize=4096)(_split_parts)
+
+# Колонки таблицы, которые попадают в дерево
+TREE_COLUMNS = ('path', 'is_nude', 'has_face', 'status', 'nsfw_score')
+
+def _empty_stats() -> Dict:
+    return {
+        'total_files': 0,
+        'nude_files': 0,
+        'face_files': 0,
+        'by_status': {},
+        'directories': 0
+    }
+
+def _add_file_to_stats(stats: Dict, file_info: Dict):
+    stats['total_files'] += 1
+    stats['nude_files'] += 1 if file_info['is_nude'] else 0
+    stats['face_files'] += 1 if file_info['has_face'] else 0
+    by_status = stats['by_status']
+    by_status[file_info['status']] = by_status.get(file_info['status'], 0) + 1
+
+def _remove_file_from_stats(stats: Dict, file_info: Dict):
+    stats['total_files'] -= 1
+    stats['nude_files'] -= 1 if file_info['is_nude'] else 0
+    stats['face_files'] -= 1 if file_info['has_face'] else 0
+    by_status = stats['by_status']
+    by_status[file_info['status']] -= 1
+    if not by_status[file_info['status']]:
+        del by_status[file_info['status']]
+
+def _move_status(stats: Dict, old_status, new_status):
+    by_status = stats['by_status']
+    by_status[old_status] -= 1
+    if not by_status[old_status]:
+        del by_status[old_status]
+    by_status[new_status] = by_status.get(new_status, 0) + 1
+
+def status_counts(by_status: Dict) -> Dict[str, int]:
+    """
+    Копия счетчиков статусов, пригодная для JSON
+
+    Flask сортирует ключи при сериализации, а None со строками не
+    сравнивается, поэтому файлы без статуса идут под ключом 'null'.
+    """
+    return {('null' if status is None else status): count for status, count in by_status.items()}
+
+def _copy_stats(stats: Dict) -> Dict:
+    result = dict(stats)
+    result['by_status'] = defaultdict(int, stats['by_status'])
+    return result
+
 class PhotoTree:
     def __init__(self, db: Database, base_path: str = ""):
         """
@@ -15,6 +86,12 @@ class PhotoTree:
         self.db = db
         self.base_path = os.path.normpath(base_path) if base_path else ""
         self.tree: Dict[str, Dict] = {"files": [], "dirs": {}}
+        # Индексы: путь файла -> запись, ключ директории -> узел
+        self._files_by_path: Dict[str, Dict] = {}
+        self._dirs_by_path: Dict[str, Dict] = {"": self.tree}
+        # Агрегаты поддеревьев по ключу директории; хранятся отдельно,
+        # чтобы не попадать в JSON дерева
+        self._stats_by_path: Dict[str, Dict] = {"": _empty_stats()}
         
     def _split_path(self, path: str) -> List[str]:
         """
@@ -26,16 +103,7 @@ class PhotoTree:
         Returns:
             List[str]: Список компонентов пути
         """
-        # Нормализуем путь и разбиваем на компоненты
-        normalized_path = os.path.normpath(path)
-        
-        # Если есть базовый путь, убираем его из начала
-        if self.base_path and normalized_path.startswith(self.base_path):
-            normalized_path = normalized_path[len(self.base_path):].lstrip(os.sep)
-            
-        parts = normalized_path.split(os.sep)
-        # Убираем пустые компоненты и точку в начале пути
-        return [p for p in parts if p and p != '.']
+        return list(_split_parts_cached(path, self.base_path))
         
     def build_tree(self) -> Dict:
         """
@@ -44,38 +112,159 @@ class PhotoTree:
         Returns:
             Dict: Дерево путей
         """
-        # Получаем все фото из базы
-        photos = self.db.get_all_photos()
+        # Читаем фото потоково и только нужные дереву колонки
+        photos = self.db.iter_photos(TREE_COLUMNS)
         
         # Очищаем текущее дерево
         self.tree = {"files": [], "dirs": {}}
+        self._files_by_path = {}
+        self._dirs_by_path = {"": self.tree}
         
         # Строим дерево
         for photo in photos:
-            path = photo['path']
-            parts = self._split_path(path)
+            self._insert_photo(photo, track_stats=False)
+        
+        # Агрегаты считаем одним проходом снизу вверх, а не на каждый файл
+        self._stats_by_path = {}
+        self._compute_stats(self.tree, "")
+        
+        return self.tree
+    
+    def _compute_stats(self, node: Dict, key: str) -> Dict:
+        """
+        Рекурсивно считает агрегаты поддерева и сохраняет их по ключу директории
+        
+        Args:
+            node (Dict): Узел дерева
+            key (str): Ключ директории в индексе
+            
+        Returns:
+            Dict: Агрегаты поддерева
+        """
+        stats = _empty_stats()
+        for file_info in node['files']:
+            _add_file_to_stats(stats, file_info)
+        
+        for name, child in node['dirs'].items():
+            child_stats = self._compute_stats(child, f"{key}/{name}" if key else name)
+            stats['total_files'] += child_stats['total_files']
+            stats['nude_files'] += child_stats['nude_files']
+            stats['face_files'] += child_stats['face_files']
+            stats['directories'] += 1 + child_stats['directories']
+            for status, count in child_stats['by_status'].items():
+                stats['by_status'][status] = stats['by_status'].get(status, 0) + count
+        
+        self._stats_by_path[key] = stats
+        return stats
+    
+    def _ancestor_keys(self, parts) -> List[str]:
+        """
+        Ключи директорий от корня до родителя файла
+        """
+        return [''] + ['/'.join(parts[:i + 1]) for i in range(len(parts) - 1)]
+    
+    def _insert_photo(self, photo: Dict, track_stats: bool = True) -> Optional[Dict]:
+        """
+        Добавляет запись о фото в дерево
+        
+        Args:
+            photo (Dict): Строка таблицы фотографий
+            track_stats (bool): Обновить агрегаты родительских директорий (O(глубина))
             
-            # Текущий узел дерева
-            current = self.tree
+        Returns:
+            Optional[Dict]: Добавленная запись файла или None если путь пустой
+        """
+        path = photo['path']
+        parts = _split_parts(path, self.base_path)
+        
+        # Текущий узел дерева
+        current = self.tree
+        
+        # Проходим по всем компонентам пути
+        for i, part in enumerate(parts):
+            if i == len(parts) - 1:
+                # Это файл
+                file_info = {
+                    'path': path,
+                    'is_nude': photo.get('is_nude'),
+                    'has_face': photo.get('has_face'),
+                    'status': photo.get('status'),
+                    'nsfw_score': photo.get('nsfw_score')
+                }
+                current['files'].append(file_info)
+                self._files_by_path[path] = file_info
+                if track_stats:
+                    for key in self._ancestor_keys(parts):
+                        _add_file_to_stats(self._stats_by_path[key], file_info)
+                return file_info
+            # Это директория
+            if part not in current['dirs']:
+                current['dirs'][part] = {"files": [], "dirs": {}}
+                key = '/'.join(parts[:i + 1])
+                self._dirs_by_path[key] = current['dirs'][part]
+                if track_stats:
+                    self._stats_by_path[key] = _empty_stats()
+                    for ancestor in self._ancestor_keys(parts[:i + 1]):
+                        self._stats_by_path[ancestor]['directories'] += 1
+            current = current['dirs'][part]
+        
+        return None
+    
+    def update_file_status(self, path: str, status: str) -> bool:
+        """
+        Обновляет статус файла в уже построенном дереве
+        
+        Если файла нет в дереве, он добавляется с пустыми атрибутами,
+        так же как /api/update_statuses создает новую запись в таблице.
+        
+        Args:
+            path (str): Путь к файлу
+            status (str): Новый статус
             
-            # Проходим по всем компонентам пути
-            for i, part in enumerate(parts):
-                if i == len(parts) - 1:
-                    # Это файл
-                    current['files'].append({
-                        'path': path,
-                        'is_nude': photo['is_nude'],
-                        'has_face': photo['has_face'],
-                        'status': photo['status'],
-                        'nsfw_score': photo['nsfw_score']
-                    })
-                else:
-                    # Это директория
-                    if part not in current['dirs']:
-                        current['dirs'][part] = {"files": [], "dirs": {}}
-                    current = current['dirs'][part]
+        Returns:
+            bool: True если файл уже был в дереве, False если он был добавлен
+        """
+        file_info = self.get_file_info(path)
+        if file_info is not None:
+            old_status = file_info['status']
+            if old_status != status:
+                file_info['status'] = status
+                # Агрегаты обновляются только у предков файла
+                parts = _split_parts(file_info['path'], self.base_path)
+                for key in self._ancestor_keys(parts):
+                    _move_status(self._stats_by_path[key], old_status, status)
+            return True
         
-        return self.tree
+        self._insert_photo({'path': path, 'status': status})
+        return False
+    
+    def upsert_photo(self, photo: Dict) -> bool:
+        """
+        Добавляет фото или обновляет атрибуты уже имеющегося в дереве
+        
+        Args:
+            photo (Dict): Строка таблицы с колонками TREE_COLUMNS
+            
+        Returns:
+            bool: True если файл уже был в дереве, False если он был добавлен
+        """
+        file_info = self._files_by_path.get(photo['path'])
+        if file_info is None:
+            self._insert_photo(photo)
+            return False
+        
+        ancestors = [self._stats_by_path[key]
+                     for key in self._ancestor_keys(_split_parts(file_info['path'], self.base_path))]
+        for stats in ancestors:
+            _remove_file_from_stats(stats, file_info)
+        for column in TREE_COLUMNS[1:]:
+            file_info[column] = photo.get(column)
+        for stats in ancestors:
+            _add_file_to_stats(stats, file_info)
+        return True
+    
+    def __len__(self):
+        return len(self._files_by_path)
     
     def get_directory_contents(self, path: str) -> Optional[Dict]:
         """
@@ -87,20 +276,107 @@ class PhotoTree:
         Returns:
             Optional[Dict]: Содержимое директории или None если директория не найдена
         """
-        parts = self._split_path(path)
-        current = self.tree
-        
-        # Проходим по дереву до нужной директории
-        for part in parts:
-            if part not in current['dirs']:
-                return None
-            current = current['dirs'][part]
+        current = self._find_node(path)
+        if current is None:
+            return None
             
         return {
             'files': current['files'],
             'directories': list(current['dirs'].keys())
         }
     
+    def _find_node(self, path: str) -> Optional[Dict]:
+        """
+        Находит узел директории в дереве через индекс директорий
+        
+        Args:
+            path (str): Путь к директории
+            
+        Returns:
+            Optional[Dict]: Узел дерева или None если директория не найдена
+        """
+        return self._dirs_by_path.get('/'.join(_split_parts_cached(path, self.base_path)))
+    
+    @staticmethod
+    def _encode_cursor(offset: int, last_path: str) -> str:
+        raw = f"{offset}:{last_path}".encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+    
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        try:
+            raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+            offset, last_path = raw.split(':', 1)
+            return int(offset), last_path
+        except (ValueError, UnicodeError):
+            raise ValueError(f"Некорректный курсор: {cursor}")
+    
+    def list_directory(self, path: str, cursor: Optional[str] = None,
+                       limit: int = 200) -> Optional[Dict]:
+        """
+        Получает один уровень директории с постраничной выдачей файлов
+        
+        Поддиректории возвращаются только с количеством файлов, без
+        содержимого, поэтому размер ответа не зависит от размера архива.
+        
+        Args:
+            path (str): Путь к директории
+            cursor (Optional[str]): Курсор из next_cursor предыдущей страницы
+            limit (int): Максимальное количество файлов на странице
+            
+        Returns:
+            Optional[Dict]: Содержимое уровня или None если директория не найдена
+            
+        Raises:
+            ValueError: Если курсор некорректен
+        """
+        node = self._find_node(path)
+        if node is None:
+            return None
+        
+        files = node['files']
+        offset = 0
+        if cursor:
+            offset, last_path = self._decode_cursor(cursor)
+            # Курсор привязан к последнему отданному файлу, а не только к
+            # смещению: если список изменился, ищем файл заново
+            if not (0 < offset <= len(files) and files[offset - 1]['path'] == last_path):
+                offset = next(
+                    (i + 1 for i, f in enumerate(files) if f['path'] == last_path),
+                    None
+                )
+                if offset is None:
+                    raise ValueError(f"Некорректный курсор: {cursor}")
+        
+        page = files[offset:offset + limit]
+        next_offset = offset + len(page)
+        next_cursor = None
+        if page and next_offset < len(files):
+            next_cursor = self._encode_cursor(next_offset, page[-1]['path'])
+        
+        prefix = path.rstrip('/')
+        key = '/'.join(_split_parts_cached(path, self.base_path))
+        directories = []
+        for name, child in node['dirs'].items():
+            child_stats = self._stats_by_path[f"{key}/{name}" if key else name]
+            directories.append({
+                'name': name,
+                'path': f"{prefix}/{name}",
+                'file_count': len(child['files']),
+                'total_files': child_stats['total_files'],
+                'by_status': status_counts(child_stats['by_status']),
+                'has_dirs': bool(child['dirs'])
+            })
+        
+        return {
+            'path': path,
+            'directories': directories,
+            'file_count': len(files),
+            'total_files': self._stats_by_path[key]['total_files'],
+            'files': page,
+            'next_cursor': next_cursor
+        }
+    
     def get_file_info(self, path: str) -> Optional[Dict]:
         """
         Получает информацию о файле
@@ -111,21 +387,21 @@ class PhotoTree:
         Returns:
             Optional[Dict]: Информация о файле или None если файл не найден
         """
-        parts = self._split_path(path)
+        # Пути приходят из JSON дерева и совпадают с сохраненными
+        file_info = self._files_by_path.get(path)
+        if file_info is not None:
+            return file_info
+        
+        # Путь записан иначе (например, без начального слеша):
+        # ищем в директории по имени файла
+        parts = _split_parts_cached(path, self.base_path)
         if not parts:
             return None
-            
-        # Получаем директорию, содержащую файл
-        dir_path = os.path.dirname(path)
-        dir_contents = self.get_directory_contents(dir_path)
-        
-        if not dir_contents:
+        node = self._dirs_by_path.get('/'.join(parts[:-1]))
+        if node is None:
             return None
-            
-        # Ищем файл в списке файлов директории
-        filename = os.path.basename(path)
-        for file_info in dir_contents['files']:
-            if os.path.basename(file_info['path']) == filename:
+        for file_info in node['files']:
+            if os.path.basename(file_info['path']) == parts[-1]:
                 return file_info
                 
         return None
@@ -134,34 +410,24 @@ class PhotoTree:
         """
         Получает статистику по дереву
         
+        Агрегаты поддерживаются при построении и обновлении дерева,
+        поэтому обход дерева не нужен.
+        
         Returns:
             Dict: Статистика
         """
-        def count_recursive(node: Dict) -> Dict:
-            stats = {
-                'total_files': len(node['files']),
-                'nude_files': sum(1 for f in node['files'] if f['is_nude']),
-                'face_files': sum(1 for f in node['files'] if f['has_face']),
-                'by_status': defaultdict(int),
-                'directories': 0
-            }
-            
-            # Считаем файлы по статусам
-            for file_info in node['files']:
-                stats['by_status'][file_info['status']] += 1
-                
-            # Рекурсивно обрабатываем поддиректории
-            for dir_name, dir_node in node['dirs'].items():
-                dir_stats = count_recursive(dir_node)
-                stats['total_files'] += dir_stats['total_files']
-                stats['nude_files'] += dir_stats['nude_files']
-                stats['face_files'] += dir_stats['face_files']
-                stats['directories'] += 1 + dir_stats['directories']
-                
-                # Объединяем статистику по статусам
-                for status, count in dir_stats['by_status'].items():
-                    stats['by_status'][status] += count
-                    
-            return stats
+        return _copy_stats(self._stats_by_path[""])
+    
+    def get_directory_statistics(self, path: str) -> Optional[Dict]:
+        """
+        Получает статистику поддерева директории
+        
+        Args:
+            path (str): Путь к директории
             
-        return count_recursive(self.tree) 
\ No newline at end of file
+        Returns:
+            Optional[Dict]: Статистика в формате get_statistics или None
+                если директория не найдена
+        """
+        stats = self._stats_by_path.get('/'.join(_split_parts_cached(path, self.base_path)))
+        return _copy_stats(stats) if stats is not None else None
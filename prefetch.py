@@ -0,0 +1,203 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from image_workers import WorkerPoolBusy
+from config import MAX_WORKERS, PREFETCH_MAX_QUEUE, PREVIEW_DEFAULT_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты заданий: меньше - раньше
+PRIORITY_CURRENT = 0
+PRIORITY_SIBLING = 1
+
+
+class Prefetcher:
+    def __init__(self, preview_service=None, thumbnail_service=None,
+                 workers: int = MAX_WORKERS, max_queue: int = PREFETCH_MAX_QUEUE,
+                 preview_size: int = PREVIEW_DEFAULT_SIZE):
+        """
+        Фоновый прогрев превью и миниатюр для открываемых директорий
+
+        Задания текущей директории выполняются раньше заданий соседних.
+        Каждый клиент имеет свое "поколение" заданий: при переходе в
+        другую директорию старые задания клиента удаляются из очереди,
+        а уже выполняющиеся прерываются. Клиенты без заданий не хранятся.
+
+        Args:
+            preview_service: Сервис превью (по умолчанию общий для процесса)
+            thumbnail_service: Сервис миниатюр (по умолчанию общий для процесса)
+            workers (int): Количество фоновых потоков; 0 - только run_pending()
+            max_queue (int): Максимальная длина очереди заданий
+            preview_size (int): Размер прогреваемых превью
+        """
+        self._preview_service = preview_service
+        self._thumbnail_service = thumbnail_service
+        self.workers = workers
+        self.max_queue = max_queue
+        self.preview_size = preview_size
+        self._heap: List[Tuple] = []
+        self._counter = itertools.count()
+        self._generation_ids = itertools.count(1)
+        # Текущее поколение клиентов с заданиями и число его незавершенных заданий
+        self._generations: Dict[str, int] = {}
+        self._active: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def preview_service(self):
+        if self._preview_service is None:
+            from previews import get_preview_service
+            self._preview_service = get_preview_service()
+        return self._preview_service
+
+    @property
+    def thumbnail_service(self):
+        if self._thumbnail_service is None:
+            from thumbnails import get_thumbnail_service
+            self._thumbnail_service = get_thumbnail_service()
+        return self._thumbnail_service
+
+    def schedule_directory(self, client: str, files: Iterable[str],
+                           siblings: Iterable[Iterable[str]] = ()) -> int:
+        """
+        Ставит в очередь прогрев файлов директории и ее соседей
+
+        Args:
+            client (str): Идентификатор клиента
+            files (Iterable[str]): Пути файлов просматриваемой директории
+            siblings (Iterable[Iterable[str]]): Пути файлов соседних директорий
+
+        Returns:
+            int: Количество поставленных в очередь заданий
+        """
+        batches = [(PRIORITY_CURRENT, files)] + [(PRIORITY_SIBLING, paths) for paths in siblings]
+        jobs = ((priority, kind, path) for priority, paths in batches
+                for path in paths for kind in ('preview', 'thumbnail'))
+        scheduled = 0
+        with self._lock:
+            self._cancel(client)
+            generation = next(self._generation_ids)
+            for priority, kind, path in jobs:
+                if len(self._heap) >= self.max_queue:
+                    logger.debug("Очередь прогрева переполнена, задания отброшены")
+                    break
+                heapq.heappush(self._heap, (priority, next(self._counter), client, generation, kind, path))
+                scheduled += 1
+            if scheduled:
+                self._generations[client] = generation
+                self._active[client] = scheduled
+                self._not_empty.notify(scheduled)
+        self._ensure_workers()
+        return scheduled
+
+    def cancel(self, client: str) -> int:
+        """
+        Отменяет поставленные ранее задания клиента
+
+        Returns:
+            int: Количество удаленных из очереди заданий
+        """
+        with self._lock:
+            return self._cancel(client)
+
+    def _cancel(self, client: str) -> int:
+        # Вызывается под self._lock; выполняющиеся задания увидят смену
+        # поколения и прервутся сами
+        self._generations.pop(client, None)
+        if self._active.pop(client, None) is None:
+            return 0
+        remaining = [job for job in self._heap if job[2] != client]
+        removed = len(self._heap) - len(remaining)
+        if removed:
+            heapq.heapify(remaining)
+            self._heap = remaining
+        return removed
+
+    def pending(self) -> int:
+        """
+        Возвращает количество заданий в очереди
+        """
+        with self._lock:
+            return len(self._heap)
+
+    def run_pending(self) -> int:
+        """
+        Синхронно выполняет все задания из очереди
+
+        Returns:
+            int: Количество выполненных (не отмененных) заданий
+        """
+        done = 0
+        while True:
+            with self._lock:
+                if not self._heap:
+                    return done
+                job = heapq.heappop(self._heap)
+            done += self._execute(job)
+
+    def _ensure_workers(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._worker, name=f"prefetch-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            with self._not_empty:
+                while not self._heap:
+                    self._not_empty.wait()
+                job = heapq.heappop(self._heap)
+            self._execute(job)
+
+    def _execute(self, job) -> int:
+        try:
+            return self._run(job)
+        finally:
+            with self._lock:
+                # Задания отмененного поколения уже списаны в _cancel
+                client, generation = job[2], job[3]
+                if self._generations.get(client) == generation:
+                    self._active[client] -= 1
+                    if not self._active[client]:
+                        del self._active[client], self._generations[client]
+
+    def _is_current(self, client: str, generation: int) -> bool:
+        with self._lock:
+            return self._generations.get(client) == generation
+
+    def _run(self, job) -> int:
+        _, _, client, generation, kind, path = job
+        while self._is_current(client, generation):
+            try:
+                if kind == 'preview':
+                    self.preview_service.get_path(path, self.preview_size, background=True)
+                else:
+                    self.thumbnail_service.get(path, background=True)
+                return 1
+            except WorkerPoolBusy:
+                # Пул занят запросами пользователей - ждем, пока он освободится
+                time.sleep(0.1)
+            except Exception as e:
+                logger.debug(f"Не удалось прогреть {kind} для {path}: {e}")
+                return 0
+        # Клиент ушел из директории
+        return 0
+
+
+_prefetcher: Optional[Prefetcher] = None
+
+
+def get_prefetcher() -> Prefetcher:
+    """
+    Возвращает общий для процесса планировщик прогрева
+    """
+    global _prefetcher
+    if _prefetcher is None:
+        _prefetcher = Prefetcher()
+    return _prefetcher
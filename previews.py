@@ -0,0 +1,105 @@
+import os
+import logging
+from typing import List, Optional, Tuple
+from image_cache import DiskCache, make_cache_key
+from image_processing import render_preview
+from image_workers import ImageWorkerPool, get_image_pool
+from config import CACHE_DIR, PREVIEW_SIZES, PREVIEW_DEFAULT_SIZE, PREVIEW_DISK_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+class PreviewService:
+    def __init__(self, disk_cache: DiskCache = None, sizes: List[int] = None,
+                 image_pool: ImageWorkerPool = None):
+        """
+        Превью фиксированных размеров, один раз сгенерированные и
+        сохраненные на локальный диск
+
+        Ключ кэша включает mtime и размер оригинала, поэтому измененный
+        файл получает новое превью, а старое вытесняется по LRU.
+
+        Args:
+            disk_cache (DiskCache): Кэш на диске
+            sizes (List[int]): Доступные размеры (длинная сторона)
+            image_pool (ImageWorkerPool): Пул, в котором генерируются превью
+        """
+        self.disk_cache = disk_cache or DiskCache(os.path.join(CACHE_DIR, 'previews'), PREVIEW_DISK_BYTES,
+                                                  name='preview_disk')
+        self.sizes = sorted(sizes or PREVIEW_SIZES)
+        self._image_pool = image_pool
+
+    @property
+    def image_pool(self) -> ImageWorkerPool:
+        if self._image_pool is None:
+            self._image_pool = get_image_pool()
+        return self._image_pool
+
+    def pick_size(self, requested: Optional[int]) -> int:
+        """
+        Выбирает ближайший доступный размер не меньше запрошенного
+
+        Args:
+            requested (Optional[int]): Запрошенная длинная сторона
+
+        Returns:
+            int: Размер превью
+        """
+        if requested is None:
+            requested = PREVIEW_DEFAULT_SIZE
+        for size in self.sizes:
+            if size >= requested:
+                return size
+        return self.sizes[-1]
+
+    def cache_key(self, photo_path: str, size: int) -> str:
+        """
+        Вычисляет ключ кэша (он же ETag) превью
+
+        Raises:
+            FileNotFoundError: Если оригинала нет на диске
+        """
+        st = os.stat(photo_path)
+        return make_cache_key('preview', size, photo_path, st.st_mtime_ns, st.st_size)
+
+    def get_path(self, photo_path: str, size: int, key: Optional[str] = None,
+                 background: bool = False) -> Tuple[str, str]:
+        """
+        Возвращает путь к файлу превью, генерируя его при необходимости
+
+        Args:
+            photo_path (str): Путь к оригиналу
+            size (int): Размер превью
+            key (Optional[str]): Заранее вычисленный ключ кэша
+            background (bool): Фоновая генерация (прогрев), не занимает очередь пула
+
+        Returns:
+            Tuple[str, str]: Путь к файлу превью и ключ кэша
+
+        Raises:
+            WorkerPoolBusy: Если пул обработки изображений перегружен
+        """
+        key = key or self.cache_key(photo_path, size)
+        cached_path = self.disk_cache.get_path(key)
+        if cached_path is not None:
+            return cached_path, key
+
+        # Одновременные запросы одного превью делят одно задание пула
+        data = self.image_pool.run(('preview', key), render_preview, photo_path, size,
+                                   background=background).data
+        cached_path = self.disk_cache.put(key, data)
+        if cached_path is None:
+            raise OSError(f"Не удалось сохранить превью в кэш: {photo_path}")
+        return cached_path, key
+
+_service = None
+
+
+def get_preview_service() -> PreviewService:
+    """
+    Возвращает общий для процесса сервис превью
+    """
+    global _service
+    if _service is None:
+        _service = PreviewService()
+    return _service
@@ -0,0 +1,385 @@
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from database import Database
+from config import (
+    PHOTO_DIR, STATUS_REVIEW, SCAN_WORKERS, SCAN_RATE_LIMIT, SCAN_EXTENSIONS,
+    SCAN_DELETE_MISSING, SCAN_STATE_FILE
+)
+
+logger = logging.getLogger(__name__)
+
+# Допуск сравнения времени изменения: SMB хранит mtime с точностью до секунд
+MTIME_TOLERANCE = 2.0
+
+# Колонки, которые сканер читает и пишет
+SCAN_COLUMNS = ('path', 'modification_date', 'file_size')
+
+# Колонки, вычисленные по содержимому файла: при его изменении сбрасываются
+CONTENT_COLUMNS = ('hash_sha256', 'phash')
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        """
+        Ограничитель частоты операций (token bucket), общий для потоков
+
+        Args:
+            rate (float): Операций в секунду; 0 или меньше - без ограничения
+            burst (Optional[float]): Сколько операций можно сделать подряд
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Ждет, пока операция не уложится в лимит
+        """
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # Токен резервируется сразу, поэтому ожидающие потоки встают в очередь
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+def diff_files(disk: Dict[str, Tuple[datetime, int]], known: Dict[str, Tuple],
+               failed_dirs: Iterable[str] = ()) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Сравнивает файлы на диске с записями таблицы
+
+    Args:
+        disk (Dict): path -> (mtime, size) для файлов на диске
+        known (Dict): path -> (modification_date, file_size) из таблицы
+        failed_dirs (Iterable[str]): Директории и файлы, которые не удалось
+            прочитать; они и файлы внутри них не считаются удаленными
+
+    Returns:
+        Tuple[List[str], List[str], List[str]]: Новые, измененные и удаленные пути
+    """
+    inserted, changed = [], []
+    for path, (mtime, size) in disk.items():
+        record = known.get(path)
+        if record is None:
+            inserted.append(path)
+            continue
+        known_mtime, known_size = record
+        if known_mtime is None or abs((mtime - known_mtime).total_seconds()) > MTIME_TOLERANCE \
+                or (known_size is not None and known_size != size):
+            changed.append(path)
+
+    failed = {d.rstrip('/') for d in failed_dirs}
+    failed_prefixes = tuple(d + '/' for d in failed)
+    deleted = [path for path in known
+               if path not in disk and path not in failed and not path.startswith(failed_prefixes)]
+    return inserted, changed, deleted
+
+
+class Scanner:
+    def __init__(self, root: str = PHOTO_DIR, db_factory: Callable[[], Database] = Database,
+                 workers: int = SCAN_WORKERS, rate_limit: float = SCAN_RATE_LIMIT,
+                 extensions: Tuple[str, ...] = SCAN_EXTENSIONS,
+                 delete_missing: bool = SCAN_DELETE_MISSING,
+                 state_file: Optional[str] = SCAN_STATE_FILE, dry_run: bool = False):
+        """
+        Сканер, сверяющий таблицу фотографий с файлами на диске
+
+        Директории читаются через os.scandir параллельно в несколько
+        потоков, число операций с диском ограничено rate_limit. Сканирование
+        идет по верхнеуровневым директориям (фотосессиям): каждая сверяется
+        с таблицей и сразу записывается пачками, а прогресс сохраняется в
+        state_file, так что прерванный проход можно продолжить.
+
+        Args:
+            root (str): Корневая директория с фотографиями
+            db_factory (Callable): Фабрика подключений к базе данных
+            workers (int): Потоков для чтения директорий
+            rate_limit (float): Операций с диском в секунду (0 - без ограничения)
+            extensions (Tuple[str, ...]): Расширения файлов фотографий
+            delete_missing (bool): Удалять записи о пропавших файлах
+            state_file (Optional[str]): Файл прогресса; None - не сохранять
+            dry_run (bool): Только посчитать изменения, не записывая их
+        """
+        self.root = root.rstrip('/') or '/'
+        self.db_factory = db_factory
+        self.workers = workers
+        self.limiter = RateLimiter(rate_limit)
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.delete_missing = delete_missing
+        self.state_file = state_file
+        self.dry_run = dry_run
+        self.progress = {'running': False}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def _list_dir(self, path: str) -> Tuple[Dict[str, Tuple[datetime, int]], List[str], List[str]]:
+        """
+        Читает одну директорию
+
+        Returns:
+            Tuple: Файлы фотографий (path -> (mtime, size)), поддиректории и
+                записи, которые не удалось прочитать
+        """
+        self.limiter.acquire()
+        files, subdirs, unreadable = {}, [], []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(self.extensions) and entry.is_file():
+                        self.limiter.acquire()
+                        st = entry.stat()
+                        files[entry.path] = (datetime.fromtimestamp(st.st_mtime), st.st_size)
+                except FileNotFoundError as e:
+                    # Файл удалили во время сканирования
+                    logger.debug(f"Пропущен {entry.path}: {e}")
+                except OSError as e:
+                    # EIO, ETIMEDOUT и права на SMB-шаре не значат, что файла нет
+                    logger.warning(f"⚠️ Не удалось прочитать {entry.path}: {e}")
+                    unreadable.append(entry.path)
+        return files, subdirs, unreadable
+
+    def _scan_tree(self, pool: ThreadPoolExecutor, top: str, recursive: bool = True):
+        """
+        Параллельно обходит поддерево
+
+        Returns:
+            Tuple: Файлы (path -> (mtime, size)) и директории или файлы, которые
+                не удалось прочитать
+        """
+        disk, failed = {}, set()
+        pending = {pool.submit(self._list_dir, top): top}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    files, subdirs, unreadable = future.result()
+                except OSError as e:
+                    logger.warning(f"⚠️ Не удалось прочитать директорию {path}: {e}")
+                    failed.add(path)
+                    continue
+                disk.update(files)
+                failed.update(unreadable)
+                if recursive:
+                    for subdir in subdirs:
+                        pending[pool.submit(self._list_dir, subdir)] = subdir
+        return disk, failed
+
+    def _load_known(self, db: Database, unit: str, recursive: bool) -> Dict[str, Tuple]:
+        if recursive:
+            photos = db.iter_photos(SCAN_COLUMNS, prefix=unit)
+        else:
+            photos = db.iter_photos(SCAN_COLUMNS, dir_path=unit)
+        return {p['path']: (p['modification_date'], p['file_size']) for p in photos}
+
+    def _apply(self, db: Database, disk: Dict, inserted: List[str], changed: List[str],
+               deleted: List[str]) -> int:
+        """
+        Записывает изменения через пакетные методы Database
+
+        Returns:
+            int: Количество строк, которые не удалось записать
+        """
+        failed = 0
+        if inserted:
+            result = db.bulk_upsert_photos(
+                ({'path': path, 'status': STATUS_REVIEW, 'modification_date': disk[path][0],
+                  'file_size': disk[path][1]} for path in inserted),
+                columns=('path', 'status', 'modification_date', 'file_size')
+            )
+            failed += len(result['failed'])
+        if changed:
+            # Статус и результаты классификации существующих строк не трогаем,
+            # а хеши старого содержимого сбрасываем
+            result = db.bulk_upsert_photos(
+                ({'path': path, 'modification_date': disk[path][0], 'file_size': disk[path][1]}
+                 for path in changed),
+                columns=SCAN_COLUMNS + CONTENT_COLUMNS
+            )
+            failed += len(result['failed'])
+        if deleted and self.delete_missing:
+            if db.delete_photos(deleted) is None:
+                failed += len(deleted)
+        return failed
+
+    def _units(self, db: Database) -> Tuple[List[Tuple[str, bool]], List[str]]:
+        """
+        Делит сканирование на единицы: файлы корня и каждую поддиректорию корня
+
+        Returns:
+            Tuple: Единицы (путь, рекурсивно) и верхнеуровневые директории,
+                которые есть в таблице, но пропали с диска
+        """
+        self.limiter.acquire()
+        with os.scandir(self.root) as entries:
+            visible = [entry for entry in entries if not entry.name.startswith('.')]
+        if not visible:
+            # Пустой корень скорее означает неподключенную SMB-шару, чем
+            # удаление всего архива: не сверяем ни файлы корня, ни директории
+            logger.warning(f"⚠️ Корень сканирования пуст, возможно шара не подключена: {self.root}")
+            return [], []
+
+        subdirs = sorted(entry.path for entry in visible if entry.is_dir(follow_symlinks=False))
+        units = [(self.root, False)] + [(subdir, True) for subdir in subdirs]
+
+        gone = []
+        if subdirs:
+            # По той же причине пропавшие директории ищем, только если на
+            # диске осталась хоть одна
+            prefix = '' if self.root == '/' else self.root
+            on_disk = {os.path.basename(subdir) for subdir in subdirs}
+            known = db.get_directory_statistics(self.root) or []
+            gone = [f"{prefix}/{entry['name']}" for entry in known
+                    if entry['name'] and entry['name'] not in on_disk]
+        return units, gone
+
+    def _load_state(self) -> Set[str]:
+        if not self.state_file:
+            return set()
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        return set(state.get('done', [])) if state.get('root') == self.root else set()
+
+    def _save_state(self, done: Set[str]):
+        if not self.state_file:
+            return
+        os.makedirs(os.path.dirname(self.state_file) or '.', exist_ok=True)
+        tmp_path = self.state_file + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'root': self.root, 'done': sorted(done)}, f)
+        os.replace(tmp_path, self.state_file)
+
+    def run(self, resume: bool = False) -> Dict:
+        """
+        Выполняет полный проход сканирования
+
+        Args:
+            resume (bool): Пропустить директории, обработанные прерванным проходом
+
+        Returns:
+            Dict: Итоги: inserted, changed, deleted, failed, units_done, units_total
+        """
+        db = self.db_factory()
+        if not db.connect():
+            raise ConnectionError("Ошибка подключения к базе данных")
+
+        started = time.monotonic()
+        done = self._load_state() if resume else set()
+        totals = {'inserted': 0, 'changed': 0, 'deleted': 0, 'failed': 0}
+        try:
+            units, gone = self._units(db)
+            with self._lock:
+                self.progress = dict(totals, running=True, units_done=0, units_total=len(units))
+
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scanner') as pool:
+                for unit, recursive in units:
+                    if unit in done:
+                        self._advance(totals)
+                        continue
+                    disk, failed_dirs = self._scan_tree(pool, unit, recursive)
+                    known = self._load_known(db, unit, recursive)
+                    inserted, changed, deleted = diff_files(disk, known, failed_dirs)
+                    failed = 0 if self.dry_run else self._apply(db, disk, inserted, changed, deleted)
+
+                    totals['inserted'] += len(inserted)
+                    totals['changed'] += len(changed)
+                    totals['deleted'] += len(deleted) if self.delete_missing else 0
+                    totals['failed'] += failed
+                    if not self.dry_run:
+                        done.add(unit)
+                        self._save_state(done)
+                    self._advance(totals)
+
+            for unit in gone:
+                deleted = list(self._load_known(db, unit, True))
+                logger.info(f"🗑️ Директория пропала с диска: {unit} ({len(deleted)} фото)")
+                if not self.dry_run and self.delete_missing:
+                    totals['failed'] += self._apply(db, {}, [], [], deleted)
+                totals['deleted'] += len(deleted) if self.delete_missing else 0
+
+            if self.state_file and not self.dry_run and os.path.exists(self.state_file):
+                os.remove(self.state_file)
+        finally:
+            db.close()
+            with self._lock:
+                self.progress = dict(self.progress, **totals, running=False)
+
+        logger.info(f"✅ Сканирование завершено за {time.monotonic() - started:.1f} с: "
+                    f"новых {totals['inserted']}, изменено {totals['changed']}, "
+                    f"удалено {totals['deleted']}, ошибок {totals['failed']}")
+        return dict(self.progress)
+
+    def _advance(self, totals: Dict):
+        with self._lock:
+            self.progress = dict(self.progress, **totals,
+                                 units_done=self.progress.get('units_done', 0) + 1)
+
+    def start(self, resume: bool = True) -> bool:
+        """
+        Запускает сканирование в фоновом потоке
+
+        Returns:
+            bool: False если сканирование уже идет
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self.progress = {'running': True}
+            self._thread = threading.Thread(target=self._run_background, args=(resume,),
+                                            name='scanner-main', daemon=True)
+            self._thread.start()
+            return True
+
+    def _run_background(self, resume: bool):
+        try:
+            self.run(resume=resume)
+        except Exception as e:
+            logger.error(f"❌ Ошибка сканирования: {str(e)}")
+            with self._lock:
+                self.progress = dict(self.progress, running=False, error=str(e))
+
+
+_scanner = None
+
+
+def get_scanner() -> Scanner:
+    """
+    Возвращает общий для процесса сканер
+    """
+    global _scanner
+    if _scanner is None:
+        _scanner = Scanner()
+    return _scanner
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сверка таблицы фотографий с файлами на диске')
+    parser.add_argument('--root', default=PHOTO_DIR, help='Корневая директория с фотографиями')
+    parser.add_argument('--resume', action='store_true', help='Продолжить прерванное сканирование')
+    parser.add_argument('--dry-run', action='store_true', help='Только посчитать изменения')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    summary = Scanner(args.root, dry_run=args.dry_run).run(resume=args.resume)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
@@ -0,0 +1,209 @@
+import gzip
+import json
+import threading
+from datetime import date, datetime
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+from config import GZIP_LEVEL, BROTLI_QUALITY
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен, без него используется стандартный json
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:  # без brotli ответы сжимаются только gzip
+        brotli = None
+
+# Колонки файлов в колоночном формате дерева (path заменяется именем файла)
+COLUMNAR_FILE_COLUMNS = ('is_nude', 'has_face', 'status', 'nsfw_score')
+COLUMNAR_FORMAT = 'columnar-2'
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(payload) -> bytes:
+    """
+    Сериализует ответ в компактный JSON (UTF-8)
+
+    Использует orjson, если он установлен; даты в обоих случаях
+    передаются в ISO 8601.
+
+    Returns:
+        bytes: JSON без лишних пробелов
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def available_encodings() -> Tuple[str, ...]:
+    """
+    Поддерживаемые кодировки сжатия в порядке предпочтения
+    """
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate_encoding(accept_encodings) -> Optional[str]:
+    """
+    Выбирает сжатие по заголовку Accept-Encoding
+
+    Args:
+        accept_encodings (werkzeug.datastructures.Accept): request.accept_encodings
+
+    Returns:
+        Optional[str]: br, gzip или None (без сжатия)
+    """
+    best, best_quality = None, 0
+    for encoding in available_encodings():
+        quality = accept_encodings.quality(encoding)
+        # При равном весе остается первая (более плотная) кодировка
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        # mtime=0 делает результат детерминированным
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    raise ValueError(f"Неизвестная кодировка сжатия: {encoding}")
+
+
+class EncodedPayloadCache:
+    def __init__(self):
+        """
+        Кэш закодированных (и сжатых) ответов, привязанных к версии данных
+
+        Для каждого ключа хранится только последняя версия: JSON строится
+        один раз на версию, каждая кодировка сжатия - при первом запросе.
+        """
+        self._lock = threading.Lock()
+        # ключ -> (версия, {кодировка или None: байты})
+        self._entries: Dict[Hashable, Tuple[Hashable, Dict[Optional[str], bytes]]] = {}
+
+    def get(self, key: Hashable, version: Hashable, build: Callable[[], bytes],
+            encoding: Optional[str] = None) -> bytes:
+        """
+        Возвращает ответ для версии, строя и сжимая его при необходимости
+
+        Args:
+            key (Hashable): Вид ответа (например, формат дерева)
+            version (Hashable): Версия данных (ETag)
+            build (Callable[[], bytes]): Строит несжатый ответ
+            encoding (Optional[str]): Кодировка сжатия или None
+
+        Returns:
+            bytes: Тело ответа
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                entry = (version, {None: build()})
+                self._entries[key] = entry
+            variants = entry[1]
+            if encoding not in variants:
+                variants[encoding] = compress(variants[None], encoding)
+            return variants[encoding]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def columnar_tree(tree: Dict, base_path: str = "") -> Dict:
+    """
+    Переводит дерево PhotoTree.tree в компактный колоночный формат
+
+    Вместо списка словарей файлов каждая директория хранит колонки
+    (name, is_nude, has_face, status, nsfw_score), имена файлов - без
+    пути директории, статусы - индексами в общем словаре statuses.
+    Пустые files и dirs опускаются. Полный путь файла равен
+    prefix + имена директорий через "/" + "/" + name. Если путь в
+    таблице записан иначе, у директории появляется колонка path: в ней
+    полный путь таких файлов и None для остальных.
+
+    Args:
+        tree (Dict): Дерево {'files': [...], 'dirs': {...}}
+        base_path (str): Базовый путь, с которым строилось дерево
+
+    Returns:
+        Dict: {'format', 'prefix', 'columns', 'statuses', 'root'}
+    """
+    prefix = base_path.rstrip('/') + '/' if base_path else '/'
+    statuses: List[Optional[str]] = []
+    status_index: Dict[Optional[str], int] = {}
+
+    def convert(node: Dict, directory: str) -> Dict:
+        result = {}
+        files = node['files']
+        if files:
+            columns = {'name': []}
+            columns.update((column, []) for column in COLUMNAR_FILE_COLUMNS)
+            paths = []
+            for file_info in files:
+                path = file_info['path']
+                relative = path[len(directory):] if path.startswith(directory) else ''
+                if relative and '/' not in relative:
+                    columns['name'].append(relative)
+                    paths.append(None)
+                else:
+                    columns['name'].append(path.rsplit('/', 1)[-1])
+                    paths.append(path)
+                for column in COLUMNAR_FILE_COLUMNS:
+                    value = file_info.get(column)
+                    if column == 'status':
+                        index = status_index.get(value)
+                        if index is None:
+                            index = status_index[value] = len(statuses)
+                            statuses.append(value)
+                        value = index
+                    columns[column].append(value)
+            if any(path is not None for path in paths):
+                columns['path'] = paths
+            result['files'] = columns
+        if node['dirs']:
+            result['dirs'] = {name: convert(child, f"{directory}{name}/") for name, child in node['dirs'].items()}
+        return result
+
+    root = convert(tree, prefix)
+    return {
+        'format': COLUMNAR_FORMAT,
+        'prefix': prefix,
+        'columns': ['name', *COLUMNAR_FILE_COLUMNS],
+        'statuses': statuses,
+        'root': root,
+    }
+
+
+def expand_columnar_tree(payload: Dict) -> Dict:
+    """
+    Восстанавливает дерево PhotoTree.tree из колоночного формата
+    """
+    statuses = payload['statuses']
+
+    def expand(node: Dict, directory: str) -> Dict:
+        files = []
+        columns = node.get('files')
+        if columns:
+            paths = columns.get('path')
+            for i, name in enumerate(columns['name']):
+                path = paths[i] if paths else None
+                file_info = {'path': directory + name if path is None else path}
+                for column in COLUMNAR_FILE_COLUMNS:
+                    value = columns[column][i]
+                    file_info[column] = statuses[value] if column == 'status' else value
+                files.append(file_info)
+        dirs = {name: expand(child, f"{directory}{name}/") for name, child in node.get('dirs', {}).items()}
+        return {'files': files, 'dirs': dirs}
+
+    return expand(payload['root'], payload['prefix'])
@@ -18,9 +18,27 @@ const PhotoGrid = () => {
             setModifiedPhotos({}); // Сбрасываем изменения при смене директории
         };
 
+        // Статусы, измененные другими пользователями (лента изменений из PhotoTree)
+        const handlePhotosChanged = (event) => {
+            if (event.detail.type === 'delete') {
+                const deleted = new Set(event.detail.changes.map(([path]) => path));
+                setPhotos(prev => prev.filter(photo => !deleted.has(photo.path)));
+                return;
+            }
+            const statuses = {};
+            event.detail.changes.forEach(([path, status]) => {
+                statuses[path] = status;
+            });
+            setPhotos(prev => prev.map(photo =>
+                photo.path in statuses ? { ...photo, status: statuses[photo.path] } : photo
+            ));
+        };
+
         document.addEventListener('directorySelected', handleDirectorySelected);
+        document.addEventListener('photosChanged', handlePhotosChanged);
         return () => {
             document.removeEventListener('directorySelected', handleDirectorySelected);
+            document.removeEventListener('photosChanged', handlePhotosChanged);
         };
     }, []);
 
@@ -1,26 +1,88 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './PhotoTree.css';
 
+// Корневая директория фотосессий на сервере
+const ROOT_PATH = '/mnt/smb/OneDrive/Pictures/!Фотосессии';
+
+// Загружает одну страницу содержимого директории
+// prefetch=false - директорию только раскрывают, прогревать превью не нужно
+const fetchDirectoryPage = async (path, cursor = null, prefetch = true) => {
+    const params = new URLSearchParams({ path });
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    if (!prefetch) {
+        params.set('prefetch', '0');
+    }
+    const response = await fetch(`/api/tree/list?${params.toString()}`);
+    if (!response.ok) {
+        throw new Error('Ошибка при загрузке директории');
+    }
+    return response.json();
+};
+
+// Загружает все файлы директории, проходя по страницам
+const fetchDirectoryFiles = async (path) => {
+    let files = [];
+    let cursor = null;
+    do {
+        const page = await fetchDirectoryPage(path, cursor);
+        files = files.concat(page.files);
+        cursor = page.next_cursor;
+    } while (cursor);
+    return files;
+};
+
 const PhotoTree = () => {
-    const [tree, setTree] = useState(null);
+    // Поддиректории уже загруженных уровней: path -> [{name, path, ...}]
+    const [children, setChildren] = useState({});
+    const [expanded, setExpanded] = useState(new Set());
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState(null);
     const [selectedDir, setSelectedDir] = useState(null);
 
+    // Пути уже загруженных уровней, нужны обработчику ленты изменений
+    const loadedPaths = useRef(new Set());
+
+    const loadChildren = async (path) => {
+        const page = await fetchDirectoryPage(path, null, false);
+        loadedPaths.current.add(path);
+        setChildren(prev => ({ ...prev, [path]: page.directories }));
+        return page;
+    };
+
     useEffect(() => {
-        const fetchTree = async () => {
-            try {
-                const response = await fetch('/api/tree');
-                if (!response.ok) {
-                    throw new Error('Ошибка при загрузке дерева');
-                }
-                const data = await response.json();
-                // Находим директорию !Фотосессии
-                const photoSessions = data?.dirs?.mnt?.dirs?.smb?.dirs?.OneDrive?.dirs?.Pictures?.dirs?.['!Фотосессии'];
-                if (!photoSessions) {
-                    throw new Error('Директория !Фотосессии не найдена');
+        // Лента изменений от других пользователей: патчим счетчики загруженных
+        // уровней вместо перезагрузки всего дерева
+        const source = new EventSource('/api/changes');
+
+        const handleChanges = (type) => (event) => {
+            const changes = JSON.parse(event.data);
+            document.dispatchEvent(new CustomEvent('photosChanged', {
+                detail: { type, changes }
+            }));
+
+            const changedPaths = changes.map(change => change[0]);
+            loadedPaths.current.forEach(path => {
+                const affected = type === 'reset'
+                    || changedPaths.some(changed => changed.startsWith(`${path}/`));
+                if (affected) {
+                    loadChildren(path).catch(err => setError(err.message));
                 }
-                setTree(photoSessions);
+            });
+        };
+
+        ['status', 'upsert', 'delete', 'reset'].forEach(type => {
+            source.addEventListener(type, handleChanges(type));
+        });
+        return () => source.close();
+    }, []);
+
+    useEffect(() => {
+        const fetchRoot = async () => {
+            try {
+                // Первый запрос получает только верхний уровень фотосессий
+                await loadChildren(ROOT_PATH);
                 setError(null);
             } catch (err) {
                 setError(err.message);
@@ -29,71 +91,87 @@ const PhotoTree = () => {
             }
         };
 
-        fetchTree();
+        fetchRoot();
     }, []);
 
-    const handleDirClick = (path) => {
-        console.log('PhotoTree: handleDirClick', path);
-        setSelectedDir(path);
-
-        // Находим выбранную директорию и её файлы
-        let currentNode = tree;
-        const pathParts = path.split('/').filter(Boolean);
-        
-        for (const part of pathParts) {
-            if (part && currentNode.dirs && currentNode.dirs[part]) {
-                currentNode = currentNode.dirs[part];
+    const toggleExpanded = async (dir) => {
+        if (expanded.has(dir.path)) {
+            setExpanded(prev => {
+                const next = new Set(prev);
+                next.delete(dir.path);
+                return next;
+            });
+            return;
+        }
+        if (!children[dir.path]) {
+            try {
+                await loadChildren(dir.path);
+            } catch (err) {
+                setError(err.message);
+                return;
             }
         }
-
-        // Генерируем событие для PhotoGrid с файлами
-        const event = new CustomEvent('directorySelected', { 
-            detail: { 
-                path,
-                files: currentNode.files || [] 
-            } 
-        });
-        console.log('PhotoTree: dispatching event with files', event.detail);
-        document.dispatchEvent(event);
+        setExpanded(prev => new Set(prev).add(dir.path));
     };
 
-    const getDirectoryStats = (node) => {
-        const stats = {
-            total: 0,
-            nude: 0,
-            face: 0
-        };
+    const handleDirClick = async (dir) => {
+        console.log('PhotoTree: handleDirClick', dir.path);
+        setSelectedDir(dir.path);
 
-        if (node.files) {
-            stats.total = node.files.length;
-            stats.nude = node.files.filter(f => f.is_nude).length;
-            stats.face = node.files.filter(f => f.has_face).length;
-        }
+        try {
+            const files = await fetchDirectoryFiles(dir.path);
 
-        return stats;
+            // Генерируем событие для PhotoGrid с файлами
+            const event = new CustomEvent('directorySelected', {
+                detail: {
+                    path: dir.path,
+                    files
+                }
+            });
+            console.log('PhotoTree: dispatching event with files', event.detail);
+            document.dispatchEvent(event);
+        } catch (err) {
+            setError(err.message);
+        }
     };
 
-    const renderNode = (node, dirName = '', parentPath = '') => {
-        const stats = getDirectoryStats(node);
-        const currentPath = parentPath ? `${parentPath}/${dirName}` : dirName;
-        
+    const renderNode = (dir) => {
+        const isExpanded = expanded.has(dir.path);
+        const subdirs = children[dir.path] || [];
+
         return (
-            <div key={currentPath} className="tree-node">
+            <div key={dir.path} className="tree-node">
                 <div className="directory">
-                    {dirName && (
-                        <div 
-                            className={`directory-name ${selectedDir === currentPath ? 'selected' : ''}`}
-                            onClick={() => handleDirClick(currentPath)}
-                        >
-                            {dirName}
-                            <span className="directory-stats">
-                                ({stats.total} фото, {stats.nude} ню, {stats.face} с лицами)
+                    <div
+                        className={`directory-name ${selectedDir === dir.path ? 'selected' : ''}`}
+                        onClick={() => handleDirClick(dir)}
+                    >
+                        {dir.has_dirs && (
+                            <span
+                                className="directory-toggle"
+                                onClick={(e) => {
+                                    e.stopPropagation();
+                                    toggleExpanded(dir);
+                                }}
+                            >
+                                {isExpanded ? '▾' : '▸'}{' '}
                             </span>
-                        </div>
-                    )}
-                    {node.dirs && Object.entries(node.dirs).length > 0 && (
+                        )}
+                        {dir.name}
+                        <span className="directory-stats">
+                            ({dir.file_count} фото, всего {dir.total_files})
+                        </span>
+                        {dir.by_status && (
+                            <span className="directory-progress">
+                                {Object.entries(dir.by_status)
+                                    .map(([status, count]) => `${status}: ${count}`)
+                                    .join(', ')}
+                            </span>
+                        )}
+                    </div>
+                    {isExpanded && subdirs.length > 0 && (
                         <div className="directories">
-                            {Object.entries(node.dirs).map(([name, dir]) => renderNode(dir, name, currentPath))}
+                            {subdirs.map(renderNode)}
                         </div>
                     )}
                 </div>
@@ -109,14 +187,17 @@ const PhotoTree = () => {
         return <div className="error">Ошибка: {error}</div>;
     }
 
-    if (!tree) {
+    const rootDirs = children[ROOT_PATH] || [];
+    if (rootDirs.length === 0) {
         return <div className="empty">Дерево фотографий пусто</div>;
     }
 
     return (
         <div className="photo-tree">
             <h2>Фотосессии</h2>
-            {renderNode(tree)}
+            <div className="directories">
+                {rootDirs.map(renderNode)}
+            </div>
             {selectedDir && (
                 <div className="selected-directory">
                     <h3>Выбрана директория: {selectedDir}</h3>
@@ -126,4 +207,4 @@ const PhotoTree = () => {
     );
 };
 
-export default PhotoTree; 
\ No newline at end of file
+export default PhotoTree;
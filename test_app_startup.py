@@ -0,0 +1,74 @@
+import importlib.util
+import logging
+import os
+import database
+import change_feed
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+
+def load_app(name):
+    # Пакет app/ затеняет app.py, поэтому модуль грузим по пути
+    spec = importlib.util.spec_from_file_location(name, APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_worker_import_has_no_side_effects(monkeypatch):
+    """
+    Процессы пула (spawn) импортируют app.py как __mp_main__: без DDL, LISTEN и лог-файла
+    """
+    monkeypatch.chdir(os.path.dirname(APP_PATH))
+    connects, listeners = [], []
+    monkeypatch.setattr(database.Database, 'connect', lambda self: connects.append(self) or False)
+    monkeypatch.setattr(change_feed.ChangeFeed, 'add_listener', lambda self, listener: listeners.append(listener))
+
+    module = load_app('__mp_main__')
+
+    assert connects == []
+    assert listeners == []
+    assert not any(isinstance(handler, logging.FileHandler) for handler in module.app.logger.handlers)
+
+
+class ExportDatabase:
+    closed = 0
+
+    def connect(self):
+        return True
+
+    def iter_photos(self, columns, prefix=None):
+        yield {'path': '/photos/a/1.jpg'}
+
+    def close(self):
+        ExportDatabase.closed += 1
+
+
+def test_export_releases_connection_when_body_is_never_read(monkeypatch):
+    monkeypatch.chdir(os.path.dirname(APP_PATH))
+    module = load_app('app_export')
+    monkeypatch.setattr(module, 'Database', ExportDatabase)
+    ExportDatabase.closed = 0
+
+    response = module.app.test_client().get('/api/export', buffered=False)
+    assert response.status_code == 200 and ExportDatabase.closed == 0
+    response.close()
+    assert ExportDatabase.closed == 1
+
+
+class UnreadablePreviews:
+    def pick_size(self, requested):
+        return 400
+
+    def cache_key(self, photo_path, size):
+        raise PermissionError(13, 'Permission denied', photo_path)
+
+
+def test_unreadable_photo_returns_json_error(monkeypatch):
+    monkeypatch.chdir(os.path.dirname(APP_PATH))
+    module = load_app('app_photo')
+    monkeypatch.setattr(module, 'get_preview_service', UnreadablePreviews)
+
+    response = module.app.test_client().get('/api/photo/photos/a/1.jpg')
+    assert response.status_code == 503
+    assert response.get_json()['path'] == '/photos/a/1.jpg'
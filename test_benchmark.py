@@ -0,0 +1,39 @@
+from benchmark import MemoryDatabase, compare_to_baseline, generate_photos, run_benchmarks
+from database import PHOTO_COLUMNS
+
+
+def test_generated_archive_is_deterministic():
+    first = list(generate_photos(500, seed=1))
+    assert first == list(generate_photos(500, seed=1))
+    assert len({photo['path'] for photo in first}) == 500
+    assert set(first[0]) == set(PHOTO_COLUMNS)
+    # root/год/съемка[/подпапка]/файл
+    assert all(photo['path'].startswith('/mnt/photos/!Фотосессии/') for photo in first)
+    assert {photo['path'].count('/') for photo in first} <= {6, 7}
+
+
+def test_memory_database_filters_and_updates():
+    db = MemoryDatabase(generate_photos(300, seed=2))
+    some = next(iter(db.rows.values()))
+    inside = list(db.iter_photos(('path', 'status'), dir_path=some['dir_path']))
+    assert inside and all(set(photo) == {'path', 'status'} for photo in inside)
+    assert len(list(db.iter_photos(prefix=some['dir_path']))) == len(inside)
+
+    changed = db.bulk_update_statuses([(some['path'], 'approved'), ('/new/1.jpg', 'pending')])
+    assert {change['path'] for change in changed} >= {'/new/1.jpg'}
+    assert db.bulk_update_statuses([(some['path'], 'approved')]) == []
+
+
+def test_run_and_compare():
+    results = run_benchmarks(sizes=[300], trees=['photo'], repeat=1, lookups=20, updates=10,
+                             memory=False, log=lambda line: None)
+    assert set(results) == {f"photo/300/{case}" for case in (
+        'build_tree', 'get_directory_contents', 'get_file_info', 'get_statistics',
+        'serialize_tree', 'serialize_directories', 'update_statuses')}
+
+    baseline = {'photo/300/build_tree': {'seconds': 0.5, 'peak_mb': 10.0}}
+    assert compare_to_baseline({'photo/300/build_tree': {'seconds': 0.55, 'peak_mb': 10.0}}, baseline) == []
+    regressions = compare_to_baseline({'photo/300/build_tree': {'seconds': 1.0, 'peak_mb': 20.0}}, baseline)
+    assert len(regressions) == 2
+    # Шум на микросекундных замерах не считается регрессией
+    assert compare_to_baseline({'x': {'seconds': 0.004}}, {'x': {'seconds': 0.001}}) == []
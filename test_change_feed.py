@@ -0,0 +1,69 @@
+import json
+from change_feed import ChangeFeed, encode_notifications, process_origin
+from test_tree_cache import FakeDatabase, make_cache
+
+
+def test_notifications_are_split_by_payload_size():
+    deltas = [[f'/photos/shoot/{i:04d}.jpg', 'approved'] for i in range(500)]
+    payloads = encode_notifications('status', deltas, origin='abc', max_bytes=1000)
+    assert len(payloads) > 1
+    assert all(len(p.encode('utf-8')) <= 1000 for p in payloads)
+
+    decoded = [json.loads(p) for p in payloads]
+    assert all(message['o'] == 'abc' and message['t'] == 'status' for message in decoded)
+    assert [d for message in decoded for d in message['d']] == deltas
+
+
+def test_oversized_delta_is_replaced_with_reset():
+    deltas = [['/photos/a/1.jpg', 'approved'], ['/photos/' + 'x' * 2000 + '.jpg', 'approved']]
+    payloads = encode_notifications('status', deltas, origin='abc', max_bytes=1000)
+    decoded = [json.loads(p) for p in payloads]
+    assert decoded == [{'o': 'abc', 't': 'status', 'd': [['/photos/a/1.jpg', 'approved']]},
+                       {'o': 'abc', 't': 'reset', 'd': []}]
+
+    # Чужой reset заставляет кэш дерева сверить таблицу при следующем get()
+    cache = make_cache()
+    cache.get()
+    FakeDatabase.write('/photos/a/1.jpg', status='approved')
+    cache.apply_change_event({'origin': 'other', 'type': 'reset', 'changes': []})
+    tree, _ = cache.get()
+    assert tree.get_file_info('/photos/a/1.jpg')['status'] == 'approved'
+
+
+def test_events_fan_out_and_slow_subscriber_is_reset():
+    feed = ChangeFeed(queue_size=2)
+    # Поток слушателя не нужен: события подаются напрямую
+    feed.start = lambda: None
+    fast, slow = feed.subscribe(), feed.subscribe()
+    received = []
+    feed.add_listener(received.append)
+
+    for i in range(3):
+        feed.publish(json.dumps({'o': 'x', 't': 'status', 'd': [[f'/p/{i}.jpg', 'approved']]}))
+        fast.get_nowait()
+
+    assert [event['id'] for event in received] == [1, 2, 3]
+    assert slow.get_nowait()['type'] == 'reset'
+    assert slow.empty()
+
+    feed.unsubscribe(fast)
+    feed.publish('not json')
+    assert len(received) == 3
+
+
+def test_tree_cache_applies_foreign_status_events():
+    cache = make_cache()
+    tree, etag = cache.get()
+
+    cache.apply_change_event({'origin': process_origin(), 'type': 'status',
+                              'changes': [['/photos/a/1.jpg', 'published']]})
+    assert tree.get_file_info('/photos/a/1.jpg')['status'] == 'review'
+
+    cache.apply_change_event({'origin': 'other', 'type': 'status',
+                              'changes': [['/photos/a/1.jpg', 'approved']]})
+    # Запись другого процесса уже в дереве, перестроение не нужно
+    FakeDatabase.write('/photos/a/1.jpg', status='approved')
+    patched, new_etag = cache.get()
+    assert patched is tree and new_etag != etag
+    assert tree.get_file_info('/photos/a/1.jpg')['status'] == 'approved'
+    assert FakeDatabase.loads == 1
@@ -0,0 +1,68 @@
+import json
+from compact_tree import CompactPhotoTree
+from photo_tree import PhotoTree
+
+
+class InMemoryDatabase:
+    """
+    Подмена Database для тестов без PostgreSQL
+    """
+    def __init__(self, photos):
+        self.photos = photos
+
+    def iter_photos(self, columns=None):
+        return iter(self.photos)
+
+
+PHOTOS = [
+    {'path': '/base/shoot/1.jpg', 'is_nude': True, 'has_face': False,
+     'status': 'review', 'nsfw_score': 0.9},
+    {'path': '/base/shoot/2.jpg', 'is_nude': False, 'has_face': True,
+     'status': 'approved', 'nsfw_score': 0.125},
+    {'path': '/base/shoot/day2/3.jpg', 'is_nude': None, 'has_face': None,
+     'status': None, 'nsfw_score': None},
+    {'path': '/base/other/4.jpg', 'is_nude': False, 'has_face': False,
+     'status': 'rejected', 'nsfw_score': 0.33},
+]
+
+
+def build_both(base_path=""):
+    db = InMemoryDatabase(PHOTOS)
+    tree = PhotoTree(db, base_path=base_path)
+    tree.build_tree()
+    compact = CompactPhotoTree(db, base_path=base_path)
+    compact.build_tree()
+    return tree, compact
+
+
+def test_compact_tree_produces_same_json():
+    for base_path in ("", "/base"):
+        tree, compact = build_both(base_path)
+        assert json.dumps(compact.tree, sort_keys=True) == json.dumps(tree.tree, sort_keys=True)
+        assert compact.get_statistics() == tree.get_statistics()
+        assert compact.list_directory("/base/shoot" if not base_path else "shoot") == \
+            tree.list_directory("/base/shoot" if not base_path else "shoot")
+
+
+def test_compact_tree_status_updates():
+    tree, compact = build_both()
+    for t in (tree, compact):
+        assert t.update_file_status('/base/shoot/1.jpg', 'published') is True
+        assert t.update_file_status('/base/new/5.jpg', 'review') is False
+
+    assert compact.get_file_info('/base/shoot/1.jpg')['status'] == 'published'
+    assert compact.tree == tree.tree
+    assert compact.get_statistics() == tree.get_statistics()
+    assert compact.get_directory_statistics('/base/shoot') == tree.get_directory_statistics('/base/shoot')
+
+
+def test_file_lookup_uses_directory_index():
+    _, compact = build_both("/base")
+    assert compact.get_file_info('/base/shoot/2.jpg')['status'] == 'approved'
+    node = compact.root.dirs['shoot']
+    assert node.index == {'1.jpg': 0, '2.jpg': 1}
+    # Файлы, добавленные после построения индекса, тоже находятся
+    assert not compact.update_file_status('/base/shoot/5.jpg', 'review')
+    assert compact.update_file_status('/base/shoot/5.jpg', 'approved')
+    assert compact.get_file_info('/base/shoot/5.jpg')['status'] == 'approved'
+    assert compact.root.dirs['other'].index is None
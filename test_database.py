@@ -0,0 +1,386 @@
+import threading
+from datetime import datetime, timezone
+import psycopg2
+import pytest
+from psycopg2 import extensions
+from psycopg2 import pool as pg_pool
+import database
+from database import ConnectionPool, Database, fold_directory_statistics, _sql_operation
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection")
+
+
+class FakeInfo:
+    transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeConnection:
+    """
+    Подмена соединения psycopg2 для тестов пула
+    """
+    opened = 0
+
+    def __init__(self, **params):
+        FakeConnection.opened += 1
+        self.closed = 0
+        self.broken = False
+        self.info = FakeInfo()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture(autouse=True)
+def fake_connect(monkeypatch):
+    FakeConnection.opened = 0
+    monkeypatch.setattr(psycopg2, 'connect', FakeConnection)
+
+
+def test_connections_are_reused():
+    pool = ConnectionPool(1, 2, {}, timeout=0.1)
+    first = pool.getconn()
+    pool.putconn(first)
+    second = pool.getconn()
+    assert second is first
+    assert FakeConnection.opened == 1
+
+
+def test_exhausted_pool_waits_then_fails():
+    pool = ConnectionPool(0, 1, {}, timeout=0.05)
+    conn = pool.getconn()
+    with pytest.raises(pg_pool.PoolError):
+        pool.getconn()
+
+    # Соединение, возвращенное другим потоком, достается ожидающему
+    threading.Timer(0.01, pool.putconn, args=(conn,)).start()
+    pool.timeout = 1
+    assert pool.getconn() is conn
+
+
+def test_broken_idle_connection_is_replaced():
+    pool = ConnectionPool(0, 2, {}, timeout=0.1, check_idle=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.broken = True
+
+    fresh = pool.getconn()
+    assert fresh is not conn
+    assert conn.closed
+    assert FakeConnection.opened == 2
+
+
+def test_fold_directory_statistics():
+    rows = [
+        ('shoot', 'review', 3, 1, 2, 1.5, 3),
+        ('shoot', None, 1, 0, 0, 0, 0),
+        ('', 'approved', 2, None, 1, None, 0),
+    ]
+    folded = fold_directory_statistics(rows)
+    assert [entry['name'] for entry in folded] == ['', 'shoot']
+    assert folded[0]['avg_nsfw_score'] is None
+    assert folded[1] == {
+        'name': 'shoot', 'total_files': 4, 'nude_files': 1, 'face_files': 2,
+        'by_status': {'review': 3, None: 1}, 'avg_nsfw_score': 0.5
+    }
+
+
+class FakeNamedCursor:
+    def __init__(self, name, rows):
+        self.name = name
+        self.rows = rows
+        self.itersize = None
+        self.query = None
+        self.closed = False
+
+    def execute(self, query, params=None):
+        self.query = query
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        self.closed = True
+
+
+def test_iter_photos_uses_server_side_cursor(monkeypatch):
+    conn = FakeConnection()
+    conn.rolled_back = False
+    cursors = []
+
+    def named_cursor(name=None):
+        cursors.append(FakeNamedCursor(name, [('/a/1.jpg', 'review'), ('/a/2.jpg', None)]))
+        return cursors[-1]
+
+    def rollback():
+        conn.rolled_back = True
+
+    conn.cursor = named_cursor
+    conn.rollback = rollback
+    db = Database(pooled=False)
+    db.conn = conn
+
+    photos = list(db.iter_photos(('path', 'status'), itersize=100))
+    assert photos == [{'path': '/a/1.jpg', 'status': 'review'}, {'path': '/a/2.jpg', 'status': None}]
+    cursor = cursors[0]
+    assert cursor.name and cursor.itersize == 100
+    assert cursor.query.startswith('SELECT path, status FROM')
+    assert cursor.closed and conn.rolled_back
+
+    with pytest.raises(ValueError):
+        next(db.iter_photos(('path', 'password')))
+
+
+class RecordingCursor:
+    def __init__(self, columns=(), triggers=()):
+        # Колонки таблицы -> значение по умолчанию, существующие триггеры
+        self.columns = dict(columns)
+        self.triggers = set(triggers)
+        self.queries = []
+        self.params = []
+
+    def execute(self, query, params=None):
+        self.queries.append(' '.join(query.split()))
+        self.params.append(params)
+
+    def fetchall(self):
+        if 'information_schema' in self.queries[-1]:
+            return list(self.columns.items())
+        return [(name,) for name in self.triggers]
+
+
+def test_schema_migration_adds_dir_path_once():
+    db = Database(pooled=False)
+    cursor = RecordingCursor({'path': None, 'status': None})
+    db._migrate_schema(cursor)
+    assert any(q.startswith(f'ALTER TABLE {db.table_name} ADD COLUMN dir_path') for q in cursor.queries)
+    assert any('ADD COLUMN updated_at' in q for q in cursor.queries)
+    assert any(q.startswith(f'CREATE TRIGGER {db.table_name}_touch') for q in cursor.queries)
+    assert any(q.startswith(f'CREATE TRIGGER {db.table_name}_deletes AFTER DELETE OR TRUNCATE')
+               for q in cursor.queries)
+    assert sum('CREATE INDEX IF NOT EXISTS' in q for q in cursor.queries) == 6
+    assert any('(dir_path text_pattern_ops)' in q for q in cursor.queries)
+
+    # Повторный запуск не берет эксклюзивных блокировок таблицы
+    cursor = RecordingCursor({'path': None, 'dir_path': None, 'file_size': None,
+                              'updated_at': 'clock_timestamp()'},
+                             {f'{db.table_name}_touch', f'{db.table_name}_deletes'})
+    db._migrate_schema(cursor)
+    assert not any(q.startswith(('ALTER TABLE', 'CREATE TRIGGER', 'DROP TRIGGER', 'CREATE OR REPLACE'))
+                   for q in cursor.queries)
+
+
+class WatermarkCursor:
+    def __init__(self, row):
+        self.row = row
+        self.queries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        self.queries.append((' '.join(query.split()), params))
+
+    def fetchone(self):
+        return self.row
+
+
+def test_tree_watermark_counts_rows_only_after_changes():
+    stamp = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    db = Database(pooled=False)
+    db.conn = FakeConnection()
+    cursor = WatermarkCursor((stamp, 3, 1200))
+    db.conn.cursor = lambda: cursor
+    watermark = db.get_tree_watermark()
+    assert watermark == {'updated_at': stamp, 'count': 1200, 'deletes': 3}
+    assert cursor.queries[0][1] == (None, None)
+
+    # updated_at и счетчик удалений те же: база не считает строки и возвращает NULL
+    cursor.row = (stamp, 3, None)
+    assert db.get_tree_watermark(watermark) == watermark
+    query, params = cursor.queries[1]
+    assert params == (stamp, 3)
+    assert f'THEN NULL ELSE (SELECT COUNT(*) FROM {db.table_name}) END' in query
+
+
+class UpsertCursor:
+    def __init__(self):
+        self.statements = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+
+
+def test_bulk_upsert_isolates_failed_rows(monkeypatch):
+    batches = []
+
+    def fake_execute_values(cursor, query, rows, page_size=100):
+        batches.append(len(rows))
+        if any(row[0] == '/bad.jpg' for row in rows):
+            raise psycopg2.DataError('invalid input syntax for type boolean')
+
+    monkeypatch.setattr(database, 'execute_values', fake_execute_values)
+    monkeypatch.setattr(database, 'CHANGE_FEED_ENABLED', False)
+    cursor = UpsertCursor()
+    conn = FakeConnection()
+    conn.cursor = lambda: cursor
+    conn.commits = 0
+    conn.commit = lambda: setattr(conn, 'commits', conn.commits + 1)
+    db = Database(pooled=False)
+    db.conn = conn
+
+    photos = [{'path': f'/{i}.jpg', 'status': 'review'} for i in range(5)]
+    photos[2] = {'path': '/bad.jpg', 'is_nude': 'maybe'}
+    photos.append({'status': 'review'})
+    photos.append({'path': '/0.jpg', 'status': 'approved'})
+
+    result = db.bulk_upsert_photos(photos, batch_size=3, columns=('path', 'status', 'is_nude'))
+    assert result['upserted'] == 5
+    assert [f['path'] for f in result['failed']] == ['/bad.jpg', None]
+    # Первая пачка упала целиком и была повторена построчно
+    assert batches == [3, 1, 1, 1, 2, 1]
+    assert conn.commits == 3
+    assert 'ROLLBACK TO SAVEPOINT bulk_upsert_row' in cursor.statements
+
+
+def make_status_database(monkeypatch, result):
+    """
+    Database с подменой execute_values и NOTIFY: запоминает запрос, параметры и исходы транзакции
+    """
+    calls = {'queries': [], 'notified': [], 'commits': 0, 'rollbacks': 0}
+
+    def fake_execute_values(cursor, query, rows, page_size=100, fetch=False):
+        calls['queries'].append({'query': ' '.join(query.split()), 'rows': rows,
+                                 'page_size': page_size, 'fetch': fetch})
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(database, 'execute_values', fake_execute_values)
+    monkeypatch.setattr(database, 'CHANGE_FEED_ENABLED', True)
+    monkeypatch.setattr(database, 'notify_changes',
+                        lambda cursor, kind, deltas: calls['notified'].append((kind, deltas)))
+    conn = FakeConnection()
+    conn.cursor = UpsertCursor
+    conn.commit = lambda: calls.__setitem__('commits', calls['commits'] + 1)
+    conn.rollback = lambda: calls.__setitem__('rollbacks', calls['rollbacks'] + 1)
+    db = Database(pooled=False)
+    db.conn = conn
+    return db, calls
+
+
+def test_bulk_update_statuses_sends_one_row_per_path(monkeypatch):
+    # Сервер вернул только реально измененные строки: /b уже был approved
+    db, calls = make_status_database(monkeypatch, [('/a.jpg', 'rejected', 'review', False),
+                                                   ('/new.jpg', 'review', None, True)])
+    result = db.bulk_update_statuses([('/a.jpg', 'approved'), ('/b.jpg', 'approved'),
+                                      ('/new.jpg', 'review'), ('/a.jpg', 'rejected')])
+
+    (call,) = calls['queries']
+    # Повтор пути схлопнут до последнего значения, иначе ON CONFLICT упадет
+    assert call['rows'] == [('/a.jpg', 'rejected'), ('/b.jpg', 'approved'), ('/new.jpg', 'review')]
+    assert call['page_size'] == 3 and call['fetch']
+    assert f'INSERT INTO {db.table_name} AS t (path, status)' in call['query']
+    assert 'ON CONFLICT (path) DO UPDATE SET status = EXCLUDED.status' in call['query']
+    assert 'WHERE t.status IS DISTINCT FROM EXCLUDED.status' in call['query']
+
+    assert result == [
+        {'path': '/a.jpg', 'status': 'rejected', 'old_status': 'review', 'inserted': False},
+        {'path': '/new.jpg', 'status': 'review', 'old_status': None, 'inserted': True},
+    ]
+    assert calls['notified'] == [('status', [['/a.jpg', 'rejected'], ['/new.jpg', 'review']])]
+    assert (calls['commits'], calls['rollbacks']) == (1, 0)
+
+
+def test_bulk_update_statuses_without_changes(monkeypatch):
+    db, calls = make_status_database(monkeypatch, [])
+    assert db.bulk_update_statuses([('/a.jpg', 'approved')]) == []
+    assert calls['notified'] == [] and calls['commits'] == 1
+
+    assert db.bulk_update_statuses([]) == []
+    assert len(calls['queries']) == 1
+
+
+def test_bulk_update_statuses_rolls_back_on_error(monkeypatch):
+    db, calls = make_status_database(monkeypatch, psycopg2.DataError('invalid input value for enum'))
+    assert db.bulk_update_statuses([('/a.jpg', 'approved')]) is None
+    assert (calls['commits'], calls['rollbacks']) == (0, 1)
+    assert calls['notified'] == []
+
+
+def test_sql_operation_labels():
+    assert _sql_operation("\n    SELECT path FROM photos") == 'SELECT'
+    assert _sql_operation(b"INSERT INTO photos VALUES (1)") == 'INSERT'
+    assert _sql_operation("vacuum photos") == 'OTHER'
+
+
+class SummaryCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        self.connection.queries.append(' '.join(query.split()))
+
+    def fetchone(self):
+        return (None,) if self.connection.triggers is None else ('summary',)
+
+    def fetchall(self):
+        return [(name,) for name in self.connection.triggers or ()]
+
+
+class SummaryConnection:
+    def __init__(self, triggers=None):
+        self.triggers = triggers
+        self.queries = []
+
+    def cursor(self):
+        return SummaryCursor(self)
+
+    def commit(self):
+        pass
+
+
+def test_directory_summary_triggers_created_once():
+    db = Database(pooled=False)
+    db.conn = SummaryConnection()
+    assert db.ensure_directory_summary()
+    created = [q for q in db.conn.queries if q.startswith('CREATE TRIGGER')]
+    assert len(created) == 3
+
+    names = [q.split()[2] for q in created]
+    db.conn = SummaryConnection(triggers=names)
+    assert db.ensure_directory_summary()
+    assert not any(q.startswith(('CREATE TRIGGER', 'DROP TRIGGER', 'LOCK TABLE')) for q in db.conn.queries)
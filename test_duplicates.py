@@ -0,0 +1,66 @@
+import random
+import pytest
+from duplicates import find_duplicate_clusters, parse_phash, _near_pairs_python
+
+
+def _photo(path, phash, sha=None):
+    return {'path': path, 'phash': f'{phash:016x}', 'hash_sha256': sha or f'sha-{path}'}
+
+
+def _random_photos(count, seed=7):
+    rng = random.Random(seed)
+    photos = []
+    for i in range(count):
+        value = rng.getrandbits(64)
+        photos.append(_photo(f'/base/{i}.jpg', value))
+        if i % 5 == 0:
+            for bit in rng.sample(range(64), rng.randint(1, 8)):
+                value ^= 1 << bit
+            photos.append(_photo(f'/base/{i}b.jpg', value))
+    return photos
+
+
+def test_parse_phash():
+    assert parse_phash('ff00') == 0xff00
+    assert parse_phash('') is None
+    assert parse_phash('not-hex') is None
+    assert parse_phash('1' * 17) is None
+
+
+def test_exact_and_near_duplicates_are_clustered():
+    base = 0x0123456789abcdef
+    photos = [
+        _photo('/a/1.jpg', base, 'same'),
+        _photo('/b/1-copy.jpg', base, 'same'),
+        _photo('/a/2.jpg', base ^ 0b111),
+        # Цепочка: далеко от первого кадра, но близко ко второму
+        _photo('/a/3.jpg', base ^ 0b111 ^ (0b1111 << 40)),
+        _photo('/a/other.jpg', ~base & (2 ** 64 - 1)),
+        {'path': '/a/nohash.jpg', 'phash': None, 'hash_sha256': None},
+    ]
+    for use_numpy in (False, None):
+        clusters = find_duplicate_clusters(photos, max_distance=4, use_numpy=use_numpy)
+        assert clusters == [{
+            'paths': ['/a/1.jpg', '/a/2.jpg', '/a/3.jpg', '/b/1-copy.jpg'],
+            'exact': [['/a/1.jpg', '/b/1-copy.jpg']],
+            'size': 4,
+        }]
+
+    only_exact = find_duplicate_clusters(photos, max_distance=0)
+    assert [cluster['paths'] for cluster in only_exact] == [['/a/1.jpg', '/b/1-copy.jpg']]
+
+
+def test_python_search_matches_brute_force():
+    rng = random.Random(3)
+    hashes = list({rng.getrandbits(64) for _ in range(200)})
+    hashes += [value ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for value in hashes[:50]]
+    hashes = list(dict.fromkeys(hashes))
+    expected = {(i, j) for i in range(len(hashes)) for j in range(i + 1, len(hashes))
+                if bin(hashes[i] ^ hashes[j]).count('1') <= 5}
+    assert set(_near_pairs_python(hashes, 5)) == expected
+
+
+def test_numpy_and_python_agree():
+    pytest.importorskip('numpy')
+    photos = _random_photos(2000)
+    assert find_duplicate_clusters(photos, use_numpy=True) == find_duplicate_clusters(photos, use_numpy=False)
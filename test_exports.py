@@ -0,0 +1,32 @@
+import csv
+import io
+import json
+from datetime import datetime
+from exports import iter_csv, iter_ndjson
+
+
+PHOTOS = [
+    {'path': '/base/shoot/1.jpg', 'status': 'review', 'shooting_date': datetime(2024, 5, 1, 12, 0)},
+    {'path': '/base/shoot/2.jpg', 'status': None, 'shooting_date': None},
+    {'path': '/base/shoot/3.jpg', 'status': 'approved', 'shooting_date': None},
+]
+
+
+def test_ndjson_is_streamed_in_chunks():
+    chunks = list(iter_ndjson(iter(PHOTOS), chunk_rows=2))
+    assert len(chunks) == 2
+    rows = [json.loads(line) for line in ''.join(chunks).splitlines()]
+    assert rows[0]['shooting_date'] == '2024-05-01 12:00:00'
+    assert [row['path'] for row in rows] == [photo['path'] for photo in PHOTOS]
+
+
+def test_csv_has_header_and_selected_columns():
+    chunks = list(iter_csv(iter(PHOTOS), ('path', 'status'), chunk_rows=2))
+    assert len(chunks) == 2
+    rows = list(csv.DictReader(io.StringIO(''.join(chunks))))
+    assert rows[1] == {'path': '/base/shoot/2.jpg', 'status': ''}
+    assert len(rows) == 3
+
+
+def test_empty_csv_still_has_header():
+    assert ''.join(iter_csv(iter([]), ('path',))) == 'path\r\n'
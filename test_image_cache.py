@@ -0,0 +1,39 @@
+import os
+from image_cache import DiskCache, MemoryLRUCache, make_cache_key
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryLRUCache(max_bytes=10)
+    cache.put('a', b'1234', 'image/jpeg')
+    cache.put('b', b'1234', 'image/jpeg')
+    # Обращение к "a" делает "b" самым старым
+    assert cache.get('a') == (b'1234', 'image/jpeg')
+    cache.put('c', b'1234', 'image/jpeg')
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    assert cache.current_bytes == 8
+
+
+def test_disk_cache_respects_byte_budget(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=100)
+    keys = [make_cache_key('photo', i) for i in range(5)]
+    for i, key in enumerate(keys):
+        cache.put(key, bytes(30))
+        # Делаем порядок использования детерминированным
+        os.utime(cache.path_for(key), (i, i))
+        cache._index[key] = (30, float(i))
+
+    assert cache.current_bytes <= 100
+    assert cache.get(keys[-1]) == bytes(30)
+    assert cache.get(keys[0]) is None
+
+
+def test_disk_cache_index_survives_restart(tmp_path):
+    key = make_cache_key('photo', 'a.jpg', '2024-01-01')
+    DiskCache(str(tmp_path), max_bytes=100).put(key, b'data')
+
+    reopened = DiskCache(str(tmp_path), max_bytes=100)
+    assert reopened.get(key) == b'data'
+    assert reopened.current_bytes == 4
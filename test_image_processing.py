@@ -0,0 +1,50 @@
+import io
+import struct
+from PIL import Image
+from image_processing import load_reduced, make_preview
+
+
+def make_exif_with_thumbnail(thumbnail: bytes) -> bytes:
+    """
+    Собирает EXIF (TIFF little-endian) с пустым IFD0 и миниатюрой в IFD1
+    """
+    data_offset = 44
+    tiff = b'II*\x00' + struct.pack('<I', 8)
+    tiff += struct.pack('<HI', 0, 14)
+    tiff += struct.pack('<H', 2)
+    tiff += struct.pack('<HHII', 0x0201, 4, 1, data_offset)
+    tiff += struct.pack('<HHII', 0x0202, 4, 1, len(thumbnail))
+    tiff += struct.pack('<I', 0)
+    return b'Exif\x00\x00' + tiff + thumbnail
+
+
+def test_jpeg_is_decoded_at_reduced_scale(tmp_path):
+    path = tmp_path / 'large.jpg'
+    Image.new('RGB', (4000, 3000), (200, 10, 10)).save(path, 'JPEG')
+
+    with Image.open(path) as img:
+        reduced = load_reduced(img, 1000)
+        # DCT-масштабирование 1/2 или 1/4, но не меньше целевого размера
+        assert 1000 <= max(reduced.size) < 4000
+
+    preview = Image.open(io.BytesIO(make_preview(str(path), 1000)))
+    assert preview.size == (1000, 750)
+
+
+def test_embedded_exif_preview_is_used_when_large_enough(tmp_path):
+    buffer = io.BytesIO()
+    Image.new('RGB', (600, 400), (0, 255, 0)).save(buffer, 'JPEG')
+    path = tmp_path / 'camera.jpg'
+    Image.new('RGB', (6000, 4000), (255, 0, 0)).save(
+        path, 'JPEG', exif=make_exif_with_thumbnail(buffer.getvalue())
+    )
+
+    with Image.open(path) as img:
+        small = load_reduced(img, 480)
+        assert small.size == (600, 400)
+        assert small.getpixel((10, 10))[1] > 200
+
+    with Image.open(path) as img:
+        # Встроенное превью меньше нужного размера - декодируем оригинал
+        large = load_reduced(img, 1024)
+        assert large.getpixel((10, 10))[0] > 200
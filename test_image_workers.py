@@ -0,0 +1,59 @@
+import threading
+import time
+import pytest
+from image_processing import RenderedImage
+from image_workers import ImageWorkerPool, WorkerPoolBusy
+from metrics import IMAGE_JOB_SECONDS, IMAGE_STAGE_SECONDS
+
+
+def test_identical_jobs_share_one_computation():
+    pool = ImageWorkerPool(workers=2, max_pending=4, kind='thread')
+    release = threading.Event()
+    calls = []
+
+    def render(path):
+        calls.append(path)
+        release.wait(1)
+        return path.upper()
+
+    first = pool.submit('a', render, 'a.jpg')
+    second = pool.submit('a', render, 'a.jpg')
+    release.set()
+
+    assert first is second
+    assert first.result(1) == 'A.JPG'
+    assert calls == ['a.jpg']
+    pool.shutdown()
+
+
+def test_saturated_pool_rejects_jobs():
+    pool = ImageWorkerPool(workers=1, max_pending=2, kind='thread')
+    release = threading.Event()
+
+    pool.submit('a', release.wait, 1)
+    # Фоновым заданиям доступны только свободные воркеры
+    with pytest.raises(WorkerPoolBusy):
+        pool.submit('b', release.wait, 1, background=True)
+    pool.submit('b', release.wait, 1)
+    with pytest.raises(WorkerPoolBusy):
+        pool.submit('c', release.wait, 1)
+
+    release.set()
+    pool.shutdown()
+
+
+def test_job_and_stage_timings_are_recorded_once():
+    pool = ImageWorkerPool(workers=1, max_pending=2, kind='thread')
+    jobs = IMAGE_JOB_SECONDS.count(kind='preview', outcome='ok')
+    decodes = IMAGE_STAGE_SECONDS.count(stage='decode')
+
+    future = pool.submit(('preview', 'key'), RenderedImage, b'data', {'decode': 0.01, 'encode': 0.02})
+    assert future.result(1).data == b'data'
+    # Колбэки завершения выполняются сразу после выдачи результата
+    deadline = time.monotonic() + 1
+    while IMAGE_JOB_SECONDS.count(kind='preview', outcome='ok') == jobs and time.monotonic() < deadline:
+        time.sleep(0.01)
+    pool.shutdown()
+
+    assert IMAGE_JOB_SECONDS.count(kind='preview', outcome='ok') == jobs + 1
+    assert IMAGE_STAGE_SECONDS.count(stage='decode') == decodes + 1
@@ -0,0 +1,46 @@
+import pytest
+from metrics import Registry, RequestTrace, finish_trace, record_span, start_trace
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.histogram('demo_seconds', 'Пример', ('endpoint',), buckets=(0.1, 1.0))
+    histogram.observe(0.05, endpoint='/a')
+    histogram.observe(0.5, endpoint='/a')
+    histogram.observe(5, endpoint='/a')
+
+    lines = registry.render().splitlines()
+    assert '# TYPE demo_seconds histogram' in lines
+    assert 'demo_seconds_bucket{endpoint="/a",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{endpoint="/a",le="1.0"} 2' in lines
+    assert 'demo_seconds_bucket{endpoint="/a",le="+Inf"} 3' in lines
+    assert 'demo_seconds_count{endpoint="/a"} 3' in lines
+    assert histogram.count(endpoint='/a') == 3
+
+
+def test_counter_labels_and_registration():
+    registry = Registry()
+    counter = registry.counter('demo_total', 'Пример', ('cache', 'result'))
+    counter.inc(cache='thumb', result='hit')
+    counter.inc(2, cache='thumb', result='hit')
+    assert registry.counter('demo_total', 'Пример', ('cache', 'result')) is counter
+    assert 'demo_total{cache="thumb",result="hit"} 3' in registry.render()
+
+    with pytest.raises(ValueError):
+        counter.inc(cache='thumb')
+    with pytest.raises(ValueError):
+        registry.histogram('demo_total', 'Другой тип')
+
+
+def test_spans_are_recorded_only_inside_trace():
+    record_span('db', 1.0)
+    trace = start_trace('GET /api/tree')
+    record_span('db', 0.002, 'SELECT')
+    record_span('db', 0.003, 'UPDATE')
+    record_span('tree_build', 0.5)
+    assert finish_trace() is trace
+    record_span('db', 1.0)
+
+    assert trace.totals() == {'db': (2, pytest.approx(0.005)), 'tree_build': (1, 0.5)}
+    assert trace.server_timing().startswith('db;dur=5.0;desc="2", tree_build;dur=500.0;desc="1", total;dur=')
+    assert isinstance(RequestTrace('x').server_timing(), str)
@@ -0,0 +1,76 @@
+from datetime import datetime
+import pytest
+from database import Database
+from photo_query import decode_keyset_cursor, encode_keyset_cursor, parse_query_filters
+
+
+def test_parse_query_filters():
+    filters = parse_query_filters({
+        'status': 'rejected,null', 'nsfw_min': '0.8', 'is_nude': 'true',
+        'date_from': '2024-01-01', 'under': '/base/shoot', 'has_face': ''
+    })
+    assert filters == {
+        'status': ['rejected', None], 'nsfw_min': 0.8, 'is_nude': True,
+        'date_from': datetime(2024, 1, 1), 'under': '/base/shoot'
+    }
+    with pytest.raises(ValueError):
+        parse_query_filters({'nsfw_max': 'high'})
+
+
+def test_keyset_cursor_roundtrip():
+    key = ('2024-05-01T12:00:00', '/base/Фото/1.jpg')
+    assert decode_keyset_cursor(encode_keyset_cursor(key)) == key
+    assert decode_keyset_cursor(encode_keyset_cursor(('infinity', '/a.jpg'))) == ('infinity', '/a.jpg')
+    with pytest.raises(ValueError):
+        decode_keyset_cursor('not-a-cursor')
+
+
+class QueryCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        self.query = ' '.join(query.split())
+        self.params = params
+
+    def fetchall(self):
+        return self.rows
+
+
+class QueryConnection:
+    def __init__(self, rows):
+        self.last_cursor = QueryCursor(rows)
+
+    def cursor(self):
+        return self.last_cursor
+
+
+def test_query_photos_seeks_after_last_key():
+    rows = [
+        (datetime(2024, 5, 1), '/a/1.jpg', '/a/1.jpg', 'rejected'),
+        (None, '/a/2.jpg', '/a/2.jpg', 'rejected'),
+        (None, '/a/3.jpg', '/a/3.jpg', 'rejected'),
+    ]
+    db = Database(pooled=False)
+    db.conn = QueryConnection(rows)
+
+    photos, last_key = db.query_photos(
+        {'status': ['rejected'], 'nsfw_min': 0.8, 'under': '/a'},
+        columns=('path', 'status'), after=('2024-04-01T00:00:00', '/a/0.jpg'), limit=2
+    )
+    assert photos == [{'path': '/a/1.jpg', 'status': 'rejected'}, {'path': '/a/2.jpg', 'status': 'rejected'}]
+    assert last_key == ('infinity', '/a/2.jpg')
+
+    cursor = db.conn.last_cursor
+    assert "(COALESCE(shooting_date, 'infinity'::timestamp), path) > (%s::timestamp, %s)" in cursor.query
+    assert cursor.query.endswith("path ASC LIMIT %s")
+    assert cursor.params == [['rejected'], 0.8, '/a', '/a/%', '2024-04-01T00:00:00', '/a/0.jpg', 3]
+
+    with pytest.raises(ValueError):
+        db.query_photos({'password': 'x'})
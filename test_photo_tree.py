@@ -85,5 +85,105 @@ def test_photo_tree():
         db.close()
         logger.info("✅ Тестирование завершено")
 
+class InMemoryDatabase:
+    """
+    Подмена Database для тестов без PostgreSQL
+    """
+    def __init__(self, photos):
+        self.photos = photos
+
+    def iter_photos(self, columns=None):
+        return iter(self.photos)
+
+def make_photo(path, status="review"):
+    return {
+        'path': path,
+        'is_nude': False,
+        'has_face': False,
+        'status': status,
+        'nsfw_score': 0.0
+    }
+
+def test_list_directory_pagination():
+    """
+    Постраничная выдача одного уровня директории
+    """
+    photos = [make_photo(f"/base/shoot/{i:03d}.jpg") for i in range(5)]
+    photos.append(make_photo("/base/shoot/day2/a.jpg"))
+    photos.append(make_photo("/base/other/b.jpg"))
+    tree = PhotoTree(InMemoryDatabase(photos), base_path="/base")
+    tree.build_tree()
+
+    root = tree.list_directory("")
+    assert [d['name'] for d in root['directories']] == ['shoot', 'other']
+    assert root['directories'][0]['file_count'] == 5
+    assert root['directories'][0]['total_files'] == 6
+    assert root['files'] == []
+
+    seen = []
+    cursor = None
+    while True:
+        page = tree.list_directory("shoot", cursor=cursor, limit=2)
+        seen.extend(f['path'] for f in page['files'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert seen == [p['path'] for p in photos[:5]]
+
+    assert tree.list_directory("missing") is None
+
+def test_indexed_lookups():
+    """
+    Поиск файлов и директорий через индексы дерева
+    """
+    photos = [make_photo(f"/base/shoot/{i:03d}.jpg") for i in range(3000)]
+    tree = PhotoTree(InMemoryDatabase(photos), base_path="/base")
+    tree.build_tree()
+
+    info = tree.get_file_info("/base/shoot/2999.jpg")
+    assert info is tree.tree['dirs']['shoot']['files'][-1]
+    # Ненормализованный путь находится через индекс директорий
+    assert tree.get_file_info("/base//shoot/005.jpg")['path'] == "/base/shoot/005.jpg"
+    assert tree.get_file_info("/base//shoot/0005.jpg") is None
+    assert tree.get_file_info("/base/missing/1.jpg") is None
+
+    assert tree.update_file_status("/base/shoot/010.jpg", "approved") is True
+    assert photos[10]['status'] == "review"
+    assert tree.get_file_info("/base/shoot/010.jpg")['status'] == "approved"
+
+    assert tree.update_file_status("/base/new/a.jpg", "review") is False
+    assert tree.get_directory_contents("new")['files'][0]['path'] == "/base/new/a.jpg"
+
+def test_directory_statistics():
+    """
+    Агрегаты директорий обновляются при изменении статусов и добавлении файлов
+    """
+    photos = [make_photo(f"/base/shoot/{i}.jpg") for i in range(3)]
+    photos.append(make_photo("/base/shoot/day2/a.jpg", status="approved"))
+    photos.append(make_photo("/base/other/b.jpg"))
+    tree = PhotoTree(InMemoryDatabase(photos), base_path="/base")
+    tree.build_tree()
+
+    stats = tree.get_directory_statistics("shoot")
+    assert stats['total_files'] == 4
+    assert stats['directories'] == 1
+    assert dict(stats['by_status']) == {'review': 3, 'approved': 1}
+
+    tree.update_file_status("/base/shoot/day2/a.jpg", "rejected")
+    tree.update_file_status("/base/shoot/new/c.jpg", "review")
+    assert dict(tree.get_directory_statistics("shoot/day2")['by_status']) == {'rejected': 1}
+    stats = tree.get_directory_statistics("shoot")
+    assert dict(stats['by_status']) == {'review': 4, 'rejected': 1}
+    assert stats['directories'] == 2
+    assert tree.get_directory_statistics("missing") is None
+
+    tree.update_file_status("/base/other/b.jpg", None)
+    assert tree.list_directory("")['directories'][1]['by_status'] == {'null': 1}
+
+    # Агрегаты совпадают с полным пересчетом
+    rebuilt = PhotoTree(InMemoryDatabase(list(tree._files_by_path.values())), base_path="/base")
+    rebuilt.build_tree()
+    assert rebuilt.get_statistics() == tree.get_statistics()
+
 if __name__ == "__main__":
-    test_photo_tree() 
\ No newline at end of file
+    test_photo_tree()
@@ -0,0 +1,65 @@
+from prefetch import Prefetcher
+
+
+class RecordingService:
+    """
+    Подмена сервисов превью и миниатюр, запоминающая вызовы
+    """
+    def __init__(self, calls, kind):
+        self.calls = calls
+        self.kind = kind
+
+    def get_path(self, path, size, background=False):
+        self.calls.append((self.kind, path))
+
+    def get(self, path, background=False):
+        self.calls.append((self.kind, path))
+
+
+def make_prefetcher(max_queue=100):
+    calls = []
+    prefetcher = Prefetcher(
+        preview_service=RecordingService(calls, 'preview'),
+        thumbnail_service=RecordingService(calls, 'thumbnail'),
+        workers=0, max_queue=max_queue
+    )
+    return prefetcher, calls
+
+
+def test_current_directory_is_warmed_before_siblings():
+    prefetcher, calls = make_prefetcher()
+    prefetcher.schedule_directory('client', ['/a/1.jpg'], [['/b/1.jpg']])
+    prefetcher.schedule_directory('other', ['/c/1.jpg'])
+    assert prefetcher.run_pending() == 6
+
+    paths = [path for _, path in calls]
+    assert paths.index('/b/1.jpg') > paths.index('/a/1.jpg')
+    assert paths.index('/b/1.jpg') > paths.index('/c/1.jpg')
+
+
+def test_navigation_cancels_previous_jobs():
+    prefetcher, calls = make_prefetcher()
+    prefetcher.schedule_directory('client', ['/a/1.jpg', '/a/2.jpg'])
+    prefetcher.schedule_directory('client', ['/b/1.jpg'])
+    assert prefetcher.run_pending() == 2
+    assert {path for _, path in calls} == {'/b/1.jpg'}
+
+
+def test_navigation_after_full_queue_schedules_new_directory():
+    prefetcher, calls = make_prefetcher(max_queue=4)
+    assert prefetcher.schedule_directory('client', [f'/big/{i}.jpg' for i in range(10)]) == 4
+    assert prefetcher.schedule_directory('client', ['/small/1.jpg']) == 2
+    assert prefetcher.pending() == 2
+    assert prefetcher.run_pending() == 2
+    assert {path for _, path in calls} == {'/small/1.jpg'}
+
+
+def test_clients_without_jobs_are_forgotten():
+    prefetcher, _ = make_prefetcher()
+    for i in range(50):
+        prefetcher.schedule_directory(f'client-{i}', [])
+    prefetcher.schedule_directory('viewer', ['/a/1.jpg'])
+    assert list(prefetcher._generations) == ['viewer']
+
+    prefetcher.run_pending()
+    assert prefetcher._generations == {} and prefetcher._active == {}
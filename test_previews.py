@@ -0,0 +1,55 @@
+import os
+from PIL import Image
+from image_cache import DiskCache
+from image_workers import ImageWorkerPool
+from previews import PreviewService
+
+
+class CountingPool(ImageWorkerPool):
+    """
+    Пул в потоках, считающий задания генерации
+    """
+    def __init__(self):
+        super().__init__(workers=1, kind='thread')
+        self.jobs = []
+
+    def run(self, key, fn, *args, **kwargs):
+        self.jobs.append(key)
+        return super().run(key, fn, *args, **kwargs)
+
+
+def make_service(tmp_path):
+    pool = CountingPool()
+    service = PreviewService(DiskCache(str(tmp_path / 'cache'), 10 ** 7), sizes=[1600, 400, 800],
+                             image_pool=pool)
+    return service, pool
+
+
+def test_pick_size_rounds_up_to_available_tier(tmp_path):
+    service, pool = make_service(tmp_path)
+    pool.shutdown()
+    assert service.pick_size(100) == 400
+    assert service.pick_size(400) == 400
+    assert service.pick_size(401) == 800
+    assert service.pick_size(5000) == 1600
+
+
+def test_preview_is_rendered_once_and_invalidated_by_mtime(tmp_path):
+    path = str(tmp_path / 'photo.jpg')
+    Image.new('RGB', (1200, 900), 'blue').save(path)
+    service, pool = make_service(tmp_path)
+
+    preview_path, key = service.get_path(path, 400)
+    with Image.open(preview_path) as image:
+        assert max(image.size) == 400
+    assert service.get_path(path, 400) == (preview_path, key)
+    assert len(pool.jobs) == 1
+
+    # Измененный оригинал получает новый ключ и новое превью
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    new_key = service.cache_key(path, 400)
+    assert new_key != key
+    assert service.get_path(path, 400)[1] == new_key
+    assert len(pool.jobs) == 2
+    pool.shutdown()
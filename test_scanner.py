@@ -0,0 +1,194 @@
+import errno
+import os
+import time
+from datetime import datetime
+import scanner
+from scanner import RateLimiter, Scanner, diff_files
+
+
+class FakeDatabase:
+    """
+    Подмена Database для сканера: строки таблицы в словаре
+    """
+    def __init__(self, rows):
+        self.rows = rows
+
+    def connect(self):
+        return True
+
+    def close(self):
+        pass
+
+    def iter_photos(self, columns=None, prefix=None, dir_path=None):
+        for path, row in list(self.rows.items()):
+            if prefix is not None and not path.startswith(prefix.rstrip('/') + '/'):
+                continue
+            if dir_path is not None and os.path.dirname(path) != dir_path:
+                continue
+            yield {'path': path, **row}
+
+    def bulk_upsert_photos(self, photos, columns=None):
+        for photo in photos:
+            # Как и настоящий upsert, пишет все переданные колонки
+            self.rows.setdefault(photo['path'], {'status': None}).update(
+                {column: photo.get(column) for column in columns or photo})
+        return {'upserted': 0, 'failed': []}
+
+    def delete_photos(self, paths):
+        for path in paths:
+            del self.rows[path]
+        return len(paths)
+
+    def get_directory_statistics(self, prefix):
+        names = {path[len(prefix) + 1:].split('/')[0] for path in self.rows
+                 if path.startswith(prefix + '/') and path.count('/') > prefix.count('/') + 1}
+        return [{'name': name} for name in names]
+
+
+def write_photo(path, data=b'jpeg'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def test_diff_files():
+    now = datetime(2024, 5, 1, 12, 0, 0)
+    disk = {'/a/new.jpg': (now, 1), '/a/same.jpg': (now, 5), '/a/touched.jpg': (now, 5)}
+    known = {
+        '/a/same.jpg': (datetime(2024, 5, 1, 12, 0, 1), 5),
+        '/a/touched.jpg': (datetime(2024, 4, 1), 5),
+        '/a/gone.jpg': (now, 1),
+        '/a/unreadable/x.jpg': (now, 1),
+    }
+    inserted, changed, deleted = diff_files(disk, known, failed_dirs=['/a/unreadable'])
+    assert inserted == ['/a/new.jpg']
+    assert changed == ['/a/touched.jpg']
+    assert deleted == ['/a/gone.jpg']
+
+
+def test_scanner_reconciles_table_with_disk(tmp_path):
+    root = str(tmp_path / 'photos')
+    kept = write_photo(f'{root}/shoot/1.jpg')
+    new = write_photo(f'{root}/shoot/day2/2.JPG')
+    write_photo(f'{root}/shoot/notes.txt')
+    write_photo(f'{root}/top.jpg')
+    st = os.stat(kept)
+    db = FakeDatabase({
+        kept: {'modification_date': datetime.fromtimestamp(st.st_mtime), 'file_size': st.st_size,
+               'status': 'approved'},
+        f'{root}/shoot/deleted.jpg': {'modification_date': None, 'file_size': None, 'status': 'review'},
+        f'{root}/old_shoot/3.jpg': {'modification_date': None, 'file_size': None, 'status': 'review'},
+    })
+    state_file = str(tmp_path / 'state.json')
+    scanner = Scanner(root, db_factory=lambda: db, workers=2, rate_limit=0, state_file=state_file)
+
+    summary = scanner.run()
+    assert (summary['inserted'], summary['changed'], summary['deleted']) == (2, 0, 2)
+    assert sorted(db.rows) == sorted([kept, new, f'{root}/top.jpg'])
+    assert db.rows[new]['status'] == 'review'
+    assert db.rows[kept]['status'] == 'approved'
+    assert not os.path.exists(state_file)
+
+    # Повторный проход ничего не меняет
+    summary = scanner.run()
+    assert (summary['inserted'], summary['changed'], summary['deleted']) == (0, 0, 0)
+
+
+def test_scanner_resumes_and_dry_run_writes_nothing(tmp_path):
+    root = str(tmp_path / 'photos')
+    write_photo(f'{root}/a/1.jpg')
+    write_photo(f'{root}/b/2.jpg')
+    db = FakeDatabase({})
+    state_file = str(tmp_path / 'state.json')
+    with open(state_file, 'w') as f:
+        f.write('{"root": "%s", "done": ["%s/a"]}' % (root, root))
+
+    summary = Scanner(root, db_factory=lambda: db, rate_limit=0, state_file=state_file).run(resume=True)
+    assert summary['units_done'] == summary['units_total'] == 3
+    assert list(db.rows) == [f'{root}/b/2.jpg']
+
+    summary = Scanner(root, db_factory=lambda: FakeDatabase({}), rate_limit=0,
+                      state_file=None, dry_run=True).run()
+    assert summary['inserted'] == 2
+
+
+def test_empty_root_deletes_nothing(tmp_path):
+    root = tmp_path / 'photos'
+    root.mkdir()
+    db = FakeDatabase({
+        f'{root}/top.jpg': {'modification_date': None, 'file_size': None, 'status': 'approved'},
+        f'{root}/shoot/1.jpg': {'modification_date': None, 'file_size': None, 'status': 'approved'},
+    })
+    summary = Scanner(str(root), db_factory=lambda: db, rate_limit=0, state_file=None).run()
+    assert summary['deleted'] == 0
+    assert len(db.rows) == 2
+
+
+def test_changed_file_resets_content_hashes(tmp_path):
+    root = str(tmp_path / 'photos')
+    path = write_photo(f'{root}/shoot/1.jpg')
+    db = FakeDatabase({path: {'modification_date': datetime(2020, 1, 1), 'file_size': 1,
+                              'status': 'approved', 'hash_sha256': 'abc', 'phash': 'ff00'}})
+    summary = Scanner(root, db_factory=lambda: db, rate_limit=0, state_file=None).run()
+    assert summary['changed'] == 1
+    assert db.rows[path]['status'] == 'approved'
+    assert db.rows[path]['hash_sha256'] is None and db.rows[path]['phash'] is None
+
+
+class FlakyEntry:
+    """
+    Запись os.scandir, у которой stat() падает с ошибкой SMB
+    """
+    def __init__(self, entry, error):
+        self._entry = entry
+        self._error = error
+        self.name, self.path = entry.name, entry.path
+
+    def is_dir(self, follow_symlinks=True):
+        return self._entry.is_dir(follow_symlinks=follow_symlinks)
+
+    def is_file(self, follow_symlinks=True):
+        return self._entry.is_file(follow_symlinks=follow_symlinks)
+
+    def stat(self, follow_symlinks=True):
+        raise self._error
+
+
+def test_unreadable_file_is_not_deleted(tmp_path, monkeypatch):
+    root = str(tmp_path / 'photos')
+    broken = write_photo(f'{root}/shoot/1.jpg')
+    denied = write_photo(f'{root}/shoot/2.jpg')
+    errors = {broken: OSError(errno.EIO, 'Input/output error'),
+              denied: PermissionError(errno.EACCES, 'Permission denied')}
+    real_scandir = os.scandir
+
+    class FlakyScandir:
+        def __init__(self, path):
+            self._entries = real_scandir(path)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            self._entries.close()
+
+        def __iter__(self):
+            for entry in self._entries:
+                yield FlakyEntry(entry, errors[entry.path]) if entry.path in errors else entry
+
+    monkeypatch.setattr(scanner.os, 'scandir', FlakyScandir)
+    db = FakeDatabase({path: {'modification_date': None, 'file_size': None, 'status': 'approved'}
+                       for path in errors})
+    summary = Scanner(root, db_factory=lambda: db, rate_limit=0, state_file=None).run()
+    assert summary['deleted'] == 0
+    assert sorted(db.rows) == sorted(errors)
+    assert all(row['status'] == 'approved' for row in db.rows.values())
+
+
+def test_rate_limiter_spaces_operations():
+    limiter = RateLimiter(rate=100, burst=1)
+    started = time.monotonic()
+    for _ in range(6):
+        limiter.acquire()
+    assert time.monotonic() - started >= 0.045
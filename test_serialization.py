@@ -0,0 +1,74 @@
+import gzip
+import json
+from datetime import datetime
+from werkzeug.datastructures import Accept
+from serialization import (
+    EncodedPayloadCache, columnar_tree, compress, dumps, expand_columnar_tree, negotiate_encoding
+)
+
+
+TREE = {
+    'files': [],
+    'dirs': {'shoot': {
+        'files': [
+            {'path': '/base/shoot/1.jpg', 'is_nude': False, 'has_face': True, 'status': 'approved', 'nsfw_score': 0.1},
+            {'path': '/base/shoot/2.jpg', 'is_nude': None, 'has_face': None, 'status': None, 'nsfw_score': None},
+            # Путь, записанный не так, как его восстановит клиент
+            {'path': '/base//shoot/3.jpg', 'is_nude': True, 'has_face': False, 'status': 'approved', 'nsfw_score': 0.9},
+            # Путь без ведущего "/" не должен стать относительным
+            {'path': 'shoot/4.jpg', 'is_nude': False, 'has_face': False, 'status': 'review', 'nsfw_score': 0.2},
+        ],
+        'dirs': {'raw': {'files': [], 'dirs': {}}},
+    }},
+}
+
+
+def test_dumps_is_compact_and_encodes_dates():
+    body = dumps({'name': 'Фото', 'date': datetime(2024, 5, 1, 12, 30)})
+    assert json.loads(body) == {'name': 'Фото', 'date': '2024-05-01T12:30:00'}
+    assert b' ' not in body
+
+
+def test_negotiate_encoding():
+    assert negotiate_encoding(Accept([('gzip', 1), ('deflate', 1)])) == 'gzip'
+    assert negotiate_encoding(Accept([('identity', 1)])) is None
+    assert negotiate_encoding(Accept([('*', 1)])) in ('br', 'gzip')
+    assert negotiate_encoding(Accept([('gzip', 0)])) is None
+
+
+def test_payload_cache_builds_once_per_version():
+    cache = EncodedPayloadCache()
+    builds = []
+
+    def build():
+        builds.append(1)
+        return b'{"a":1}' * 100
+
+    plain = cache.get('tree', 'v1', build)
+    packed = cache.get('tree', 'v1', build, 'gzip')
+    assert gzip.decompress(packed) == plain
+    assert cache.get('tree', 'v1', build, 'gzip') is packed
+    assert len(builds) == 1
+
+    cache.get('tree', 'v2', build, 'gzip')
+    assert len(builds) == 2
+    assert compress(plain, 'gzip') == packed
+
+
+def test_columnar_tree_roundtrip():
+    payload = columnar_tree(TREE, base_path='/base')
+    assert payload['prefix'] == '/base/'
+    files = payload['root']['dirs']['shoot']['files']
+    assert files['name'] == ['1.jpg', '2.jpg', '3.jpg', '4.jpg']
+    assert files['path'] == [None, None, '/base//shoot/3.jpg', 'shoot/4.jpg']
+    assert [payload['statuses'][i] for i in files['status']] == ['approved', None, 'approved', 'review']
+    assert payload['root']['dirs']['shoot']['dirs'] == {'raw': {}}
+    assert expand_columnar_tree(json.loads(dumps(payload))) == TREE
+
+
+def test_columnar_tree_omits_path_column_for_regular_files():
+    tree = {'files': [{'path': '/1.jpg', 'is_nude': False, 'has_face': False, 'status': None,
+                       'nsfw_score': None}], 'dirs': {}}
+    payload = columnar_tree(tree)
+    assert 'path' not in payload['root']['files']
+    assert expand_columnar_tree(payload) == tree
@@ -0,0 +1,65 @@
+import io
+from PIL import Image
+import thumbnails
+from image_cache import DiskCache, MemoryLRUCache
+from image_workers import ImageWorkerPool
+from thumbnails import ThumbnailError, ThumbnailService
+
+
+class OfflineDatabase:
+    def connect(self):
+        return False
+
+
+def test_local_fallback_when_upstream_fails(tmp_path, monkeypatch):
+    path = tmp_path / 'photo.jpg'
+    Image.new('RGB', (800, 600), 'red').save(path)
+    pool = ImageWorkerPool(workers=1, kind='thread')
+    monkeypatch.setattr(thumbnails, 'get_image_pool', lambda: pool)
+
+    service = ThumbnailService(MemoryLRUCache(10 ** 6), DiskCache(str(tmp_path / 'cache'), 10 ** 6),
+                               db_factory=OfflineDatabase, size=200)
+
+    def upstream_down(photo_path):
+        raise ThumbnailError('pigallery2 недоступен', 502)
+
+    monkeypatch.setattr(service, '_fetch_upstream', upstream_down)
+    thumbnail = service.get(str(path))
+    pool.shutdown()
+
+    assert thumbnail.source == 'local'
+    assert thumbnail.mimetype == 'image/jpeg'
+    assert max(Image.open(io.BytesIO(thumbnail.data)).size) == 200
+
+
+class VersionDatabase:
+    queries = []
+    modification_date = '2024-01-01'
+
+    def connect(self):
+        return True
+
+    def close(self):
+        pass
+
+    def get_photo_version(self, path):
+        VersionDatabase.queries.append(path)
+        return {'hash_sha256': 'abc', 'modification_date': VersionDatabase.modification_date}
+
+
+def test_cache_key_is_remembered_for_ttl(tmp_path, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(thumbnails.time, 'monotonic', lambda: now[0])
+    VersionDatabase.queries = []
+    service = ThumbnailService(MemoryLRUCache(10 ** 6), DiskCache(str(tmp_path), 10 ** 6),
+                               db_factory=VersionDatabase, key_ttl=30)
+
+    key = service.cache_key('photos/a/1.jpg')
+    assert service.cache_key('/photos/a/1.jpg') == key
+    assert VersionDatabase.queries == ['/photos/a/1.jpg']
+
+    # После TTL версия файла перечитывается
+    VersionDatabase.modification_date = '2024-02-01'
+    now[0] += 31
+    assert service.cache_key('/photos/a/1.jpg') != key
+    assert len(VersionDatabase.queries) == 2
@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta, timezone
+from tree_cache import TreeCache
+
+START = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+class FakeDatabase:
+    """
+    Подмена Database, хранящая строки таблицы (с updated_at) в памяти
+    """
+    rows = []
+    deletes = 0
+    previous = []
+    clock = START
+    loads = 0
+    delta_loads = 0
+
+    def connect(self):
+        return True
+
+    def close(self):
+        pass
+
+    def get_tree_watermark(self, previous=None):
+        FakeDatabase.previous.append(previous)
+        stamps = [row['updated_at'] for row in FakeDatabase.rows if row.get('updated_at')]
+        return {'updated_at': max(stamps, default=None), 'count': len(FakeDatabase.rows),
+                'deletes': FakeDatabase.deletes}
+
+    def iter_photos(self, columns=None, changed_since=None):
+        rows = FakeDatabase.rows
+        if changed_since is None:
+            FakeDatabase.loads += 1
+        else:
+            FakeDatabase.delta_loads += 1
+            rows = [row for row in rows if row.get('updated_at')
+                    and (changed_since is True or row['updated_at'] >= changed_since)]
+        return [{column: row.get(column) for column in columns} for row in rows]
+
+    @staticmethod
+    def write(path, **values):
+        """
+        Записывает строку так, как это сделала бы база (с новым updated_at)
+        """
+        FakeDatabase.clock += timedelta(seconds=1)
+        row = next((row for row in FakeDatabase.rows if row['path'] == path), None)
+        if row is None:
+            row = {'path': path, 'is_nude': None, 'has_face': None, 'status': None, 'nsfw_score': None}
+            FakeDatabase.rows.append(row)
+        row.update(values, updated_at=FakeDatabase.clock)
+
+
+def make_cache():
+    FakeDatabase.rows = [
+        {'path': '/photos/a/1.jpg', 'is_nude': False, 'has_face': True,
+         'status': 'review', 'nsfw_score': 0.1, 'updated_at': START},
+        {'path': '/photos/a/2.jpg', 'is_nude': True, 'has_face': False,
+         'status': 'review', 'nsfw_score': 0.9, 'updated_at': START},
+    ]
+    FakeDatabase.clock = START
+    FakeDatabase.deletes = 0
+    FakeDatabase.previous = []
+    FakeDatabase.loads = FakeDatabase.delta_loads = 0
+    return TreeCache(check_interval=0, db_factory=FakeDatabase)
+
+
+def test_tree_is_built_once():
+    cache = make_cache()
+    tree, etag = cache.get()
+    again, same_etag = cache.get()
+    assert again is tree
+    assert same_etag == etag
+    assert FakeDatabase.loads == 1
+    # Проверка передает прошлую отметку, чтобы база не пересчитывала строки
+    assert FakeDatabase.previous[0] is None
+    assert FakeDatabase.previous[-1]['count'] == 2
+
+
+def test_status_updates_patch_tree_in_place():
+    cache = make_cache()
+    tree, etag = cache.get()
+    updates = [
+        {'path': '/photos/a/1.jpg', 'status': 'approved'},
+        {'path': '/photos/b/3.jpg', 'status': 'rejected'},
+    ]
+    for update in updates:
+        FakeDatabase.write(update['path'], status=update['status'])
+    cache.apply_status_updates(updates)
+    _, patched_etag = cache.get()
+
+    # Наши собственные записи уже в дереве: дочитывание их пропускает
+    patched, new_etag = cache.get()
+    assert patched is tree
+    assert new_etag == patched_etag != etag
+    assert FakeDatabase.loads == 1
+    assert tree.get_file_info('/photos/a/1.jpg')['status'] == 'approved'
+    assert tree.get_file_info('/photos/b/3.jpg')['status'] == 'rejected'
+
+
+def test_external_changes_are_applied_in_place():
+    cache = make_cache()
+    tree, etag = cache.get()
+    FakeDatabase.write('/photos/a/1.jpg', status='published', nsfw_score=0.5)
+    FakeDatabase.write('/photos/c/4.jpg', status='review')
+    patched, new_etag = cache.get()
+
+    assert patched is tree
+    assert new_etag != etag
+    assert FakeDatabase.loads == 1
+    assert tree.get_file_info('/photos/a/1.jpg')['status'] == 'published'
+    assert tree.get_file_info('/photos/a/1.jpg')['nsfw_score'] == 0.5
+    assert tree.get_statistics()['total_files'] == 3
+
+
+def test_external_change_is_not_hidden_by_own_writes():
+    cache = make_cache()
+    tree, _ = cache.get()
+    # Своя запись (база, затем дерево) и одновременная чужая
+    FakeDatabase.write('/photos/a/1.jpg', status='approved')
+    cache.apply_status_updates([{'path': '/photos/a/1.jpg', 'status': 'approved'}])
+    FakeDatabase.write('/photos/a/2.jpg', status='rejected')
+    cache.get()
+
+    assert tree.get_file_info('/photos/a/1.jpg')['status'] == 'approved'
+    assert tree.get_file_info('/photos/a/2.jpg')['status'] == 'rejected'
+
+
+def test_deleted_rows_rebuild_tree():
+    cache = make_cache()
+    tree, etag = cache.get()
+    del FakeDatabase.rows[1]
+    rebuilt, new_etag = cache.get()
+
+    assert rebuilt is not tree
+    assert new_etag != etag
+    assert FakeDatabase.loads == 2
+    assert rebuilt.get_file_info('/photos/a/2.jpg') is None
+
+
+def test_delete_paired_with_insert_rebuilds_tree():
+    cache = make_cache()
+    tree, _ = cache.get()
+    del FakeDatabase.rows[1]
+    FakeDatabase.deletes += 1
+    FakeDatabase.write('/photos/c/5.jpg', status='review')
+    rebuilt, _ = cache.get()
+
+    assert rebuilt is not tree
+    assert rebuilt.get_file_info('/photos/a/2.jpg') is None
+    assert rebuilt.get_file_info('/photos/c/5.jpg') is not None
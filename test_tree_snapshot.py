@@ -0,0 +1,174 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from photo_tree import PhotoTree
+from compact_tree import CompactPhotoTree
+from tree_cache import TreeCache
+from tree_snapshot import load_snapshot, save_snapshot, snapshot_watermark
+
+START = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+class FakeDatabase:
+    """
+    Подмена Database: строки таблицы с updated_at в памяти
+    """
+    rows = []
+    deletes = 0
+    full_loads = 0
+    delta_loads = 0
+
+    def connect(self):
+        return True
+
+    def close(self):
+        pass
+
+    def get_tree_watermark(self, previous=None):
+        stamps = [row['updated_at'] for row in FakeDatabase.rows if row['updated_at'] is not None]
+        return {'updated_at': max(stamps, default=None), 'count': len(FakeDatabase.rows),
+                'deletes': FakeDatabase.deletes}
+
+    def iter_photos(self, columns=None, changed_since=None):
+        rows = FakeDatabase.rows
+        if changed_since is None:
+            FakeDatabase.full_loads += 1
+        else:
+            FakeDatabase.delta_loads += 1
+            rows = [row for row in rows if row['updated_at'] is not None
+                    and (changed_since is True or row['updated_at'] >= changed_since)]
+        return [{column: row.get(column) for column in columns} for row in rows]
+
+
+def make_rows():
+    return [
+        {'path': '/photos/a/1.jpg', 'is_nude': False, 'has_face': True,
+         'status': 'review', 'nsfw_score': 0.1, 'updated_at': START},
+        {'path': '/photos/a/2.jpg', 'is_nude': True, 'has_face': None,
+         'status': None, 'nsfw_score': None, 'updated_at': None},
+        {'path': '/photos/a/b/3.jpg', 'is_nude': None, 'has_face': False,
+         'status': 'approved', 'nsfw_score': 0.75, 'updated_at': START},
+        # Путь, который не восстанавливается как префикс директории + имя
+        {'path': '/photos//a/4.jpg', 'is_nude': False, 'has_face': False,
+         'status': 'review', 'nsfw_score': 0.5, 'updated_at': START},
+        {'path': '/photos/c/д/5.jpg', 'is_nude': False, 'has_face': True,
+         'status': 'rejected', 'nsfw_score': 0.0, 'updated_at': START},
+    ]
+
+
+def build(tree_class, rows=None):
+    FakeDatabase.rows = rows if rows is not None else make_rows()
+    tree = tree_class(FakeDatabase(), base_path='/photos')
+    tree.build_tree()
+    return tree
+
+
+@pytest.mark.parametrize('source_class', [PhotoTree, CompactPhotoTree])
+@pytest.mark.parametrize('target_class', [PhotoTree, CompactPhotoTree])
+def test_snapshot_round_trip(tmp_path, source_class, target_class):
+    source = build(source_class)
+    path = str(tmp_path / 'tree.bin')
+    save_snapshot(source, path, {'updated_at': START, 'count': 5, 'deletes': 2})
+
+    target = target_class(FakeDatabase(), base_path='/photos')
+    header = load_snapshot(target, path)
+    assert header is not None
+    assert snapshot_watermark(header) == {'updated_at': START, 'count': 5, 'deletes': 2}
+
+    assert target.tree == source.tree
+    assert len(target) == 5
+    assert target.get_statistics() == source.get_statistics()
+    assert target.get_directory_statistics('/photos/a') == source.get_directory_statistics('/photos/a')
+    assert target.get_file_info('/photos//a/4.jpg')['path'] == '/photos//a/4.jpg'
+    # Загруженное дерево изменяемо так же, как построенное
+    assert target.update_file_status('/photos/a/b/3.jpg', 'review')
+    assert target.get_statistics()['by_status']['review'] == 3
+    target.update_file_status('/photos/a/6.jpg', 'review')
+    assert target.get_file_info('/photos/a/6.jpg')['status'] == 'review'
+
+
+def test_incompatible_snapshot_is_ignored(tmp_path):
+    path = str(tmp_path / 'tree.bin')
+    assert load_snapshot(PhotoTree(FakeDatabase(), base_path='/photos'), path) is None
+
+    save_snapshot(build(PhotoTree), path, {'updated_at': START, 'count': 5})
+    assert load_snapshot(PhotoTree(FakeDatabase(), base_path='/other'), path) is None
+
+    with open(path, 'r+b') as f:
+        f.write(b'garbage!')
+    assert load_snapshot(PhotoTree(FakeDatabase(), base_path='/photos'), path) is None
+
+
+@pytest.mark.parametrize('tree_class', [PhotoTree, CompactPhotoTree])
+def test_upsert_matches_full_build(tree_class):
+    rows = make_rows()
+    tree = build(tree_class, [dict(row) for row in rows])
+    rows[0].update(is_nude=True, status='approved', nsfw_score=0.95)
+    rows.append({'path': '/photos/e/6.jpg', 'is_nude': None, 'has_face': True,
+                 'status': 'review', 'nsfw_score': None})
+    assert tree.upsert_photo(rows[0])
+    assert not tree.upsert_photo(rows[-1])
+
+    expected = build(tree_class, rows)
+    assert tree.tree == expected.tree
+    assert tree.get_statistics() == expected.get_statistics()
+    assert tree.get_directory_statistics('/photos/a') == expected.get_directory_statistics('/photos/a')
+
+
+def make_cache(tmp_path, compact=False):
+    return TreeCache(base_path='/photos', check_interval=0, db_factory=FakeDatabase, compact=compact,
+                     snapshot_path=str(tmp_path / 'tree.bin'), snapshot_overlap=60)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_cache_loads_snapshot_and_reads_changes(tmp_path, compact):
+    FakeDatabase.rows = make_rows()
+    FakeDatabase.full_loads = FakeDatabase.delta_loads = 0
+    FakeDatabase.deletes = 0
+    tree, _ = make_cache(tmp_path, compact).get()
+    assert FakeDatabase.full_loads == 1
+    assert (tmp_path / 'tree.bin').exists()
+
+    # Второй воркер (или перезапуск) берет снимок и дочитывает изменения
+    FakeDatabase.rows[1].update(status='approved', updated_at=START + timedelta(seconds=5))
+    FakeDatabase.rows.append({'path': '/photos/f/7.jpg', 'is_nude': False, 'has_face': False,
+                              'status': 'review', 'nsfw_score': 0.2,
+                              'updated_at': START + timedelta(seconds=10)})
+    loaded, _ = make_cache(tmp_path, compact).get()
+    assert FakeDatabase.full_loads == 1
+    assert FakeDatabase.delta_loads == 1
+    assert loaded.get_file_info('/photos/a/2.jpg')['status'] == 'approved'
+    assert loaded.get_file_info('/photos/f/7.jpg') is not None
+    assert len(loaded) == 6
+    assert loaded.get_statistics() == build(type(loaded), FakeDatabase.rows).get_statistics()
+
+
+def test_cache_rebuilds_when_rows_were_deleted(tmp_path):
+    FakeDatabase.rows = make_rows()
+    FakeDatabase.full_loads = FakeDatabase.delta_loads = 0
+    FakeDatabase.deletes = 0
+    make_cache(tmp_path).get()
+
+    # Удаление не видно по updated_at, но видно по количеству строк
+    del FakeDatabase.rows[2]
+    tree, _ = make_cache(tmp_path).get()
+    assert FakeDatabase.full_loads == 2
+    assert tree.get_file_info('/photos/a/b/3.jpg') is None
+    assert len(tree) == 4
+
+
+def test_cache_rebuilds_when_delete_is_paired_with_insert(tmp_path):
+    FakeDatabase.rows = make_rows()
+    FakeDatabase.full_loads = FakeDatabase.delta_loads = 0
+    FakeDatabase.deletes = 0
+    make_cache(tmp_path).get()
+
+    # Количество строк то же, но счетчик удалений изменился
+    del FakeDatabase.rows[2]
+    FakeDatabase.deletes += 1
+    FakeDatabase.rows.append({'path': '/photos/g/8.jpg', 'is_nude': False, 'has_face': False,
+                              'status': 'review', 'nsfw_score': 0.3,
+                              'updated_at': START + timedelta(seconds=20)})
+    tree, _ = make_cache(tmp_path).get()
+    assert FakeDatabase.full_loads == 2
+    assert tree.get_file_info('/photos/a/b/3.jpg') is None
+    assert tree.get_file_info('/photos/g/8.jpg') is not None
@@ -0,0 +1,156 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from upstream import CircuitBreaker, CircuitOpenError, UpstreamClient, UpstreamError
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Заглушка pigallery2: /ok, /slow (ответ через 0.3 с), /hang (дольше таймаута), /fail (500)
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] = server.hits.get(self.path, 0) + 1
+            server.clients.add(self.client_address)
+        if self.path.startswith('/slow'):
+            time.sleep(0.3)
+        elif self.path == '/hang':
+            time.sleep(1.0)
+        status = 500 if self.path == '/fail' else 200
+        body = f'thumb:{self.path}'.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.hits = {}
+    httpd.clients = set()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server, path):
+    return f'http://127.0.0.1:{server.server_address[1]}{path}'
+
+
+def make_client(**kwargs):
+    kwargs.setdefault('breaker', CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    return UpstreamClient('stub', connect_timeout=1, read_timeout=0.5, **kwargs)
+
+
+def test_connection_is_reused(server):
+    client = make_client()
+    for _ in range(3):
+        response = client.get(url(server, '/ok'))
+        assert response.status_code == 200
+        assert response.content == b'thumb:/ok'
+    assert server.hits['/ok'] == 3
+    # Все запросы прошли через одно keep-alive соединение
+    assert len(server.clients) == 1
+
+
+def test_read_timeout(server):
+    client = make_client()
+    started = time.monotonic()
+    with pytest.raises(UpstreamError) as error:
+        client.get(url(server, '/hang'))
+    assert error.value.status_code == 504
+    assert time.monotonic() - started < 0.9
+
+
+def test_identical_requests_are_coalesced(server):
+    client = make_client()
+    results = []
+
+    def fetch():
+        results.append(client.get(url(server, '/slow')).content)
+
+    threads = [threading.Thread(target=fetch) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [b'thumb:/slow'] * 5
+    assert server.hits['/slow'] == 1
+
+
+def test_concurrency_limit(server):
+    client = make_client(max_concurrency=1, queue_timeout=0.05)
+    slow = threading.Thread(target=client.get, args=(url(server, '/slow'),))
+    slow.start()
+    time.sleep(0.1)
+    with pytest.raises(UpstreamError) as error:
+        client.get(url(server, '/slow?other'))
+    assert error.value.status_code == 503
+    slow.join()
+    assert client.get(url(server, '/ok')).status_code == 200
+
+
+def test_circuit_opens_and_recovers(server):
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: now[0])
+    client = make_client(breaker=breaker)
+
+    assert client.get(url(server, '/fail')).status_code == 500
+    assert client.get(url(server, '/fail')).status_code == 500
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError) as error:
+        client.get(url(server, '/ok'))
+    assert error.value.retry_after == 30
+    assert '/ok' not in server.hits
+
+    # После паузы пробный запрос проходит и замыкает цепь
+    now[0] = 31
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert client.get(url(server, '/ok')).status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_probe_reopens_circuit():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert not breaker.allow()
+    now[0] = 10
+    assert breaker.allow()
+    # Пока пробный запрос выполняется, остальные не пропускаются
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_after == 10
+
+
+def test_unexpected_probe_error_reopens_circuit(monkeypatch):
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    now[0] = 10
+    client = make_client(breaker=breaker)
+
+    def broken_get(*args, **kwargs):
+        raise ValueError('неожиданная ошибка')
+
+    monkeypatch.setattr(client.session, 'get', broken_get)
+    with pytest.raises(ValueError):
+        client.get('http://127.0.0.1:9/ok')
+    # Пробный запрос учтен: цепь снова разомкнута, а не застряла полуоткрытой
+    assert breaker.state == CircuitBreaker.OPEN
+    now[0] = 20
+    assert breaker.allow()
@@ -0,0 +1,229 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from typing import Callable, Optional
+from database import Database
+from image_cache import DiskCache, MemoryLRUCache, make_cache_key
+from image_processing import render_preview
+from image_workers import get_image_pool
+from upstream import UpstreamClient, UpstreamError, get_pigallery_client
+from config import (
+    PIGALLERY_URL, CACHE_DIR, THUMBNAIL_SIZE,
+    THUMBNAIL_MEMORY_BYTES, THUMBNAIL_DISK_BYTES, THUMBNAIL_KEY_TTL, THUMBNAIL_KEY_CACHE_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+# Миниатюра и источник, из которого она получена:
+# memory, disk, upstream (pigallery2) или local (сгенерирована из оригинала)
+Thumbnail = namedtuple('Thumbnail', ['data', 'mimetype', 'etag', 'source'])
+
+
+class ThumbnailError(Exception):
+    def __init__(self, message: str, status_code: int = 500, url: str = None):
+        """
+        Ошибка получения миниатюры
+
+        Args:
+            message (str): Описание ошибки
+            status_code (int): HTTP-статус для ответа клиенту
+            url (str): URL запроса к pigallery2
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.url = url
+
+
+def normalize_photo_path(photo_path: str) -> str:
+    """
+    Приводит путь из URL к виду, в котором он хранится в таблице
+    """
+    return photo_path if photo_path.startswith('/') else '/' + photo_path
+
+
+def build_thumbnail_url(photo_path: str, size: int = THUMBNAIL_SIZE) -> str:
+    """
+    Формирует URL миниатюры в pigallery2
+
+    Args:
+        photo_path (str): Путь к фото на SMB-шаре
+        size (int): Размер миниатюры
+
+    Returns:
+        str: URL миниатюры
+    """
+    # Ищем позицию "Pictures/!Фотосессии" в пути
+    target_prefix = "Pictures/!Фотосессии"
+    processed_path = photo_path
+
+    # Удаляем префикс /mnt/smb/OneDrive из пути
+    if photo_path.startswith('/mnt/smb/OneDrive/'):
+        processed_path = photo_path[len('/mnt/smb/OneDrive/'):]
+    elif photo_path.startswith('mnt/smb/OneDrive/'):
+        processed_path = photo_path[len('mnt/smb/OneDrive/'):]
+
+    # Находим позицию "Pictures/!Фотосессии" в обработанном пути
+    target_index = processed_path.find(target_prefix)
+
+    # Если нашли, откусываем путь до "Pictures/!Фотосессии"
+    if target_index != -1:
+        processed_path = processed_path[target_index:]
+
+    return f"{PIGALLERY_URL}/pgapi/gallery/content/{processed_path}/thumbnail/{size}"
+
+
+class ThumbnailService:
+    def __init__(self, memory_cache: MemoryLRUCache = None, disk_cache: DiskCache = None,
+                 db_factory: Callable[[], Database] = Database, size: int = THUMBNAIL_SIZE,
+                 client: UpstreamClient = None, key_ttl: float = THUMBNAIL_KEY_TTL):
+        """
+        Миниатюры с двухуровневым кэшем (память + диск)
+
+        Ключ кэша строится из пути, hash_sha256 и modification_date из
+        таблицы фотографий, поэтому измененный файл получает новую миниатюру.
+        Вычисленные ключи помнятся key_ttl секунд: повторные запросы (304,
+        прогрев) не ходят в базу, новая версия файла видна с этой задержкой.
+
+        Args:
+            memory_cache (MemoryLRUCache): Кэш в памяти
+            disk_cache (DiskCache): Кэш на диске
+            db_factory (Callable): Фабрика подключений к базе данных
+            size (int): Размер миниатюры
+            client (UpstreamClient): Клиент pigallery2
+            key_ttl (float): Сколько секунд помнить ключ файла
+        """
+        self.memory_cache = memory_cache or MemoryLRUCache(THUMBNAIL_MEMORY_BYTES, name='thumbnail_memory')
+        self.disk_cache = disk_cache or DiskCache(os.path.join(CACHE_DIR, 'thumbnails'), THUMBNAIL_DISK_BYTES,
+                                                  name='thumbnail_disk')
+        self.db_factory = db_factory
+        self.size = size
+        self.client = client or get_pigallery_client()
+        self.key_ttl = key_ttl
+        # Путь -> (ключ, время вычисления), самые старые в начале
+        self._keys: OrderedDict = OrderedDict()
+        self._keys_lock = threading.Lock()
+
+    def cache_key(self, photo_path: str) -> str:
+        """
+        Вычисляет ключ кэша (он же ETag) миниатюры
+
+        Args:
+            photo_path (str): Путь к фото
+
+        Returns:
+            str: Ключ кэша
+        """
+        path = normalize_photo_path(photo_path)
+        now = time.monotonic()
+        with self._keys_lock:
+            cached = self._keys.get(path)
+            if cached is not None and now - cached[1] < self.key_ttl:
+                return cached[0]
+
+        record = None
+        db = self.db_factory()
+        connected = db.connect()
+        if connected:
+            try:
+                record = db.get_photo_version(path)
+            finally:
+                db.close()
+
+        if record is None:
+            # Без записи в таблице версионировать нечем
+            key = make_cache_key('thumbnail', self.size, path)
+        else:
+            key = make_cache_key('thumbnail', self.size, path,
+                                 record.get('hash_sha256'), record.get('modification_date'))
+        if not connected:
+            # Ключ без версии из-за недоступной базы не запоминаем
+            return key
+        with self._keys_lock:
+            self._keys[path] = (key, now)
+            self._keys.move_to_end(path)
+            while len(self._keys) > THUMBNAIL_KEY_CACHE_SIZE:
+                self._keys.popitem(last=False)
+        return key
+
+    def get(self, photo_path: str, key: Optional[str] = None, background: bool = False) -> Thumbnail:
+        """
+        Получает миниатюру: из памяти, с диска, из pigallery2 или из оригинала
+
+        Args:
+            photo_path (str): Путь к фото
+            key (Optional[str]): Заранее вычисленный ключ кэша
+            background (bool): Фоновый запрос (прогрев)
+
+        Returns:
+            Thumbnail: Миниатюра
+
+        Raises:
+            ThumbnailError: Если миниатюру не удалось получить ни одним способом
+        """
+        key = key or self.cache_key(photo_path)
+
+        cached = self.memory_cache.get(key)
+        if cached is not None:
+            return Thumbnail(cached[0], cached[1], key, 'memory')
+
+        data = self.disk_cache.get(key)
+        if data is not None:
+            self.memory_cache.put(key, data, 'image/jpeg')
+            return Thumbnail(data, 'image/jpeg', key, 'disk')
+
+        try:
+            data, mimetype = self._fetch_upstream(photo_path)
+            source = 'upstream'
+        except ThumbnailError as e:
+            logger.warning(f"⚠️ pigallery2 недоступен ({e}), генерируем миниатюру локально")
+            data = self._generate_local(photo_path, background)
+            if data is None:
+                raise
+            mimetype, source = 'image/jpeg', 'local'
+
+        self.memory_cache.put(key, data, mimetype)
+        if mimetype == 'image/jpeg':
+            self.disk_cache.put(key, data)
+        return Thumbnail(data, mimetype, key, source)
+
+    def _fetch_upstream(self, photo_path: str):
+        thumbnail_url = build_thumbnail_url(photo_path, self.size)
+        try:
+            response = self.client.get(thumbnail_url)
+        except UpstreamError as e:
+            raise ThumbnailError(f'Ошибка при запросе к pigallery2: {str(e)}', e.status_code, thumbnail_url)
+
+        if response.status_code != 200:
+            raise ThumbnailError(f'Ошибка получения миниатюры: {response.status_code}',
+                                 response.status_code, thumbnail_url)
+        mimetype = response.headers.get('Content-Type', 'image/jpeg').split(';')[0]
+        return response.content, mimetype
+
+    def _generate_local(self, photo_path: str, background: bool = False) -> Optional[bytes]:
+        """
+        Генерирует миниатюру из оригинала, если он доступен на диске
+        """
+        path = normalize_photo_path(photo_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            return get_image_pool().run(('thumbnail', path, self.size), render_preview,
+                                        path, self.size, None, 85, False, background=background).data
+        except Exception as e:
+            logger.error(f"Ошибка генерации миниатюры {path}: {e}")
+            return None
+
+
+_service = None
+
+
+def get_thumbnail_service() -> ThumbnailService:
+    """
+    Возвращает общий для процесса сервис миниатюр
+    """
+    global _service
+    if _service is None:
+        _service = ThumbnailService()
+    return _service
@@ -0,0 +1,349 @@
+import logging
+import threading
+import time
+import uuid
+import hashlib
+import os
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from database import Database
+from photo_tree import PhotoTree, TREE_COLUMNS
+from compact_tree import CompactPhotoTree
+from change_feed import process_origin
+from metrics import TREE_BUILD_SECONDS, record_span
+from tree_snapshot import load_snapshot, save_snapshot, snapshot_lock, snapshot_watermark
+from config import (
+    TREE_CACHE_CHECK_INTERVAL, TREE_COMPACT, TABLE_NAME,
+    TREE_SNAPSHOT_ENABLED, TREE_SNAPSHOT_DIR, TREE_SNAPSHOT_OVERLAP
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TreeCache:
+    def __init__(self, base_path: str = "",
+                 check_interval: float = TREE_CACHE_CHECK_INTERVAL,
+                 db_factory: Callable[[], Database] = Database,
+                 compact: bool = TREE_COMPACT,
+                 snapshot_path: Optional[str] = None,
+                 snapshot_overlap: float = TREE_SNAPSHOT_OVERLAP):
+        """
+        Процессный кэш построенного дерева фотографий
+
+        Дерево строится один раз и точечно обновляется: записи статусов через
+        приложение патчат его сразу, а изменения таблицы извне дочитываются
+        по отметке updated_at. Если строки удалялись, дерево перестраивается.
+
+        Args:
+            base_path (str): Базовый путь, передаваемый в PhotoTree
+            check_interval (float): Как часто (сек) сверять отметку таблицы
+            db_factory (Callable): Фабрика подключений к базе данных
+            compact (bool): Хранить дерево в CompactPhotoTree вместо PhotoTree
+            snapshot_path (Optional[str]): Файл снимка дерева; None - без снимка
+            snapshot_overlap (float): На сколько секунд раньше отметки дочитывать
+                изменения (транзакции, закоммиченные позже отметки)
+        """
+        self.base_path = base_path
+        self.tree_class = CompactPhotoTree if compact else PhotoTree
+        self.check_interval = check_interval
+        self.db_factory = db_factory
+        self.snapshot_path = snapshot_path
+        self.snapshot_overlap = snapshot_overlap
+
+        # lock защищает само дерево (чтение/патчи), _build_lock - перестроение
+        self.lock = threading.RLock()
+        self._build_lock = threading.Lock()
+
+        self._tree: Optional[PhotoTree] = None
+        # Отметка таблицы {'updated_at', 'count'}, на которую актуально дерево
+        self._watermark: Optional[Dict] = None
+        self._last_check = 0.0
+        # Токен процесса делает ETag уникальным между перезапусками
+        self._token = uuid.uuid4().hex[:12]
+        self._version = 0
+        # Патчи, пришедшие во время перестроения дерева
+        self._pending_patches: Optional[List[Tuple[str, str]]] = None
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def etag(self) -> str:
+        """
+        ETag текущей версии дерева (без кавычек)
+        """
+        return f"tree-{self._token}-{self._version}"
+
+    def get(self) -> Tuple[PhotoTree, str]:
+        """
+        Возвращает актуальное дерево и его ETag
+
+        Первый вызов строит дерево, последующие не чаще раза в check_interval
+        сверяют отметку таблицы и при необходимости дочитывают изменения.
+
+        Returns:
+            Tuple[PhotoTree, str]: Дерево и ETag его версии
+        """
+        if self._tree is None:
+            with self._build_lock:
+                if self._tree is None:
+                    self._rebuild()
+        elif time.monotonic() - self._last_check >= self.check_interval:
+            # Если другой поток уже проверяет таблицу, отдаем текущее дерево
+            if self._build_lock.acquire(blocking=False):
+                try:
+                    self._check_for_changes()
+                finally:
+                    self._build_lock.release()
+
+        with self.lock:
+            return self._tree, self.etag
+
+    def invalidate(self):
+        """
+        Сбрасывает дерево, следующий запрос построит его заново
+        """
+        with self._build_lock, self.lock:
+            self._tree = None
+            self._watermark = None
+            self._version += 1
+
+    def apply_status_updates(self, updates: Iterable[Dict]) -> int:
+        """
+        Применяет записанные в базу статусы к закэшированному дереву
+
+        Args:
+            updates (Iterable[Dict]): Обновления вида {'path': ..., 'status': ...}
+
+        Returns:
+            int: Количество примененных обновлений
+        """
+        patches = [(u['path'], u['status']) for u in updates]
+        if not patches:
+            return 0
+
+        with self.lock:
+            if self._pending_patches is not None:
+                self._pending_patches.extend(patches)
+            if self._tree is None:
+                return 0
+            for path, status in patches:
+                self._tree.update_file_status(path, status)
+            self._version += 1
+
+        logger.debug(f"Кэш дерева: применено {len(patches)} обновлений статусов")
+        return len(patches)
+
+    def apply_change_event(self, event: Dict):
+        """
+        Применяет событие ленты изменений (см. change_feed.ChangeFeed)
+
+        Собственные записи процесса уже применены через apply_status_updates.
+        Чужие изменения статусов накатываются как патчи; для upsert, delete
+        и reset дерево не знает всех полей, поэтому ближайший get() сверит
+        отметку таблицы и дочитает изменения.
+
+        Args:
+            event (Dict): Событие {'origin', 'type', 'changes'}
+        """
+        if event.get('origin') == process_origin():
+            return
+        if event['type'] == 'status':
+            self.apply_status_updates({'path': path, 'status': status}
+                                      for path, status in event['changes'])
+        else:
+            with self.lock:
+                self._last_check = 0.0
+
+    def _check_for_changes(self):
+        """
+        Сверяет отметку таблицы и дочитывает в дерево измененные строки
+
+        Отметка (количество строк и max(updated_at)) транзакционна: в ней
+        видны только закоммиченные изменения, и свои записи не отличаются
+        от чужих. Перечитываются строки с updated_at не раньше прошлой
+        отметки (с запасом snapshot_overlap); уже совпадающие с деревом
+        (например, собственные записи) пропускаются. Удаления по updated_at
+        не видны, их выдают счетчик удалений и расхождение количества -
+        тогда дерево перестраивается.
+        """
+        self._last_check = time.monotonic()
+        db = self.db_factory()
+        if not db.connect():
+            # Если база недоступна, продолжаем отдавать закэшированное дерево
+            return
+        try:
+            watermark = db.get_tree_watermark(self._watermark)
+            if watermark is None or _same_watermark(watermark, self._watermark):
+                return
+            if self._watermark is None or watermark.get('deletes') != self._watermark.get('deletes'):
+                rows = None
+            else:
+                since = self._watermark['updated_at']
+                changed_since = True if since is None else since - timedelta(seconds=self.snapshot_overlap)
+                rows = list(db.iter_photos(TREE_COLUMNS, changed_since=changed_since))
+        finally:
+            db.close()
+
+        if rows is not None:
+            with self.lock:
+                changed = 0
+                for photo in rows:
+                    if not _matches(self._tree.get_file_info(photo['path']), photo):
+                        self._tree.upsert_photo(photo)
+                        changed += 1
+                if len(self._tree) == watermark['count']:
+                    self._watermark = watermark
+                    if changed:
+                        self._version += 1
+                        logger.info(f"Кэш дерева: дочитано изменений таблицы: {changed}")
+                    return
+
+        logger.info("Кэш дерева: строки таблицы удалялись, перестраиваем дерево")
+        self._rebuild()
+
+    def _rebuild(self):
+        """
+        Строит дерево заново; вызывается под _build_lock
+        """
+        db = self.db_factory()
+        if not db.connect():
+            raise ConnectionError("Ошибка подключения к базе данных")
+
+        with self.lock:
+            self._pending_patches = []
+        try:
+            started = time.monotonic()
+            # Отметку снимаем до чтения таблицы: изменения во время
+            # построения будут дочитаны при следующей проверке
+            watermark = db.get_tree_watermark()
+            if self.snapshot_path is None or watermark is None:
+                tree, source = self._build(db), "построено"
+            else:
+                tree, source = self._build_with_snapshot(db, watermark)
+        finally:
+            db.close()
+            with self.lock:
+                pending, self._pending_patches = self._pending_patches, None
+
+        with self.lock:
+            # Записи, сделанные во время построения, накатываем на новое дерево
+            for path, status in pending:
+                tree.update_file_status(path, status)
+            self._tree = tree
+            self._watermark = watermark
+            self._last_check = time.monotonic()
+            self._version += 1
+
+        elapsed = time.monotonic() - started
+        TREE_BUILD_SECONDS.observe(elapsed, tree=self.tree_class.__name__)
+        record_span('tree_build', elapsed)
+        logger.info(f"Кэш дерева: дерево {source} за {elapsed:.2f} с")
+
+    def _build(self, db: Database) -> PhotoTree:
+        tree = self.tree_class(db, base_path=self.base_path)
+        tree.build_tree()
+        return tree
+
+    def _build_with_snapshot(self, db: Database, watermark: Dict) -> Tuple[PhotoTree, str]:
+        """
+        Загружает дерево из снимка с дочитыванием изменений или строит и сохраняет снимок
+
+        Блокировка файла снимка общая для воркеров: пока один строит дерево,
+        остальные ждут и затем загружают готовый снимок.
+        """
+        with snapshot_lock(self.snapshot_path):
+            tree = self._load_snapshot(db, watermark)
+            if tree is not None:
+                return tree, "загружено из снимка"
+
+            tree = self._build(db)
+            self._save_snapshot(tree, watermark)
+            return tree, "построено"
+
+    def _load_snapshot(self, db: Database, watermark: Dict) -> Optional[PhotoTree]:
+        """
+        Загружает снимок и накатывает строки, измененные после его отметки
+
+        Returns:
+            Optional[PhotoTree]: Дерево или None, если снимка нет или он
+                не сходится с таблицей (например, строки удалялись)
+        """
+        tree = self.tree_class(db, base_path=self.base_path)
+        header = load_snapshot(tree, self.snapshot_path)
+        if header is None:
+            return None
+
+        saved = snapshot_watermark(header)
+        if saved.get('deletes') != watermark.get('deletes'):
+            # После снимка строки удалялись: по updated_at это не дочитать
+            logger.info("🔄 Кэш дерева: после снимка строки удалялись, строим дерево заново")
+            return None
+        since = saved['updated_at']
+        # Без отметки (в таблице не было updated_at) дочитываем все строки, где он есть
+        changed_since = True if since is None else since - timedelta(seconds=self.snapshot_overlap)
+        changed = 0
+        for photo in db.iter_photos(TREE_COLUMNS, changed_since=changed_since):
+            tree.upsert_photo(photo)
+            changed += 1
+
+        if len(tree) != watermark['count']:
+            logger.info(f"🔄 Кэш дерева: в снимке {len(tree)} файлов, в таблице {watermark['count']}, "
+                        f"строим дерево заново")
+            return None
+        if changed:
+            self._save_snapshot(tree, watermark)
+        logger.info(f"Кэш дерева: снимок от {header['created']}, дочитано изменений: {changed}")
+        return tree
+
+    def _save_snapshot(self, tree: PhotoTree, watermark: Dict):
+        try:
+            size = save_snapshot(tree, self.snapshot_path, watermark)
+            logger.info(f"✅ Кэш дерева: снимок сохранен ({size / 1024 / 1024:.1f} МБ)")
+        except OSError as e:
+            # Без снимка кэш работает как раньше, только старт медленнее
+            logger.warning(f"⚠️ Не удалось сохранить снимок дерева: {str(e)}")
+
+
+def _same_watermark(watermark: Dict, other: Optional[Dict]) -> bool:
+    return (other is not None and watermark['count'] == other['count']
+            and watermark['updated_at'] == other['updated_at']
+            and watermark.get('deletes') == other.get('deletes'))
+
+
+def _matches(file_info: Optional[Dict], photo: Dict) -> bool:
+    """
+    Совпадает ли файл в дереве со строкой таблицы по колонкам дерева
+    """
+    return file_info is not None and all(file_info[column] == photo.get(column) for column in TREE_COLUMNS)
+
+
+def snapshot_path_for(base_path: str) -> str:
+    """
+    Путь к файлу снимка дерева для таблицы и базового пути
+    """
+    digest = hashlib.sha1(base_path.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(TREE_SNAPSHOT_DIR, f"{TABLE_NAME}_{digest}.bin")
+
+
+_caches: Dict[str, TreeCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_tree_cache(base_path: str = "") -> TreeCache:
+    """
+    Возвращает общий для процесса кэш дерева для указанного базового пути
+
+    Args:
+        base_path (str): Базовый путь дерева
+
+    Returns:
+        TreeCache: Кэш дерева
+    """
+    with _caches_lock:
+        cache = _caches.get(base_path)
+        if cache is None:
+            snapshot_path = snapshot_path_for(base_path) if TREE_SNAPSHOT_ENABLED else None
+            cache = _caches[base_path] = TreeCache(base_path, snapshot_path=snapshot_path)
+        return cache
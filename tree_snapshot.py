@@ -0,0 +1,415 @@
+import gc
+import os
+import sys
+import json
+import math
+import mmap
+import struct
+import logging
+import tempfile
+from array import array
+from collections import deque
+from itertools import chain, islice
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+from photo_tree import PhotoTree, _empty_stats, _split_parts
+from compact_tree import CompactPhotoTree, DirNode, _set_bit
+
+try:
+    import fcntl
+except ImportError:  # на Windows воркеры не блокируют друг друга
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'PHTSNAP\0'
+SNAPSHOT_VERSION = 1
+# Магия, смещение и длина JSON-заголовка
+_PREFIX = struct.Struct('<8sQQ')
+# Секции выравниваются, чтобы массивы можно было читать прямо из mmap
+_ALIGN = 8
+
+# Секция -> тип элементов массива (None - байты как есть)
+_ARRAY_SECTIONS = {
+    'dir_parent': 'i',
+    'dir_first': 'I',
+    'dir_count': 'I',
+    'status': 'H',
+    'nsfw': 'd',
+}
+
+
+def _stats_to_json(stats: Dict) -> list:
+    # Ключ None (файлы без статуса) в JSON-объекте невозможен
+    return [stats['total_files'], stats['nude_files'], stats['face_files'], stats['directories'],
+            [[status, count] for status, count in stats['by_status'].items()]]
+
+
+def _stats_from_json(value: list) -> Dict:
+    stats = _empty_stats()
+    stats['total_files'], stats['nude_files'], stats['face_files'], stats['directories'] = value[:4]
+    stats['by_status'] = {status: count for status, count in value[4]}
+    return stats
+
+
+def _walk(tree):
+    """
+    Обходит директории дерева в ширину: родители раньше детей, дети в порядке вставки
+
+    Yields:
+        Tuple[int, str, List[Dict], List[str], Dict]: Индекс родителя, имя,
+            файлы в формате PhotoTree, их имена и агрегаты поддерева
+    """
+    if isinstance(tree, CompactPhotoTree):
+        queue = deque([(-1, '', tree.root)])
+        index = 0
+        while queue:
+            parent, name, node = queue.popleft()
+            yield (parent, name, [tree._file_record(i) for i in node.files],
+                   [tree._names[i] for i in node.files], node.stats)
+            queue.extend((index, child_name, child) for child_name, child in node.dirs.items())
+            index += 1
+    else:
+        queue = deque([(-1, '', '', tree.tree)])
+        index = 0
+        while queue:
+            parent, name, key, node = queue.popleft()
+            # Имя файла - последний компонент пути, как при поиске по дереву
+            yield (parent, name, node['files'],
+                   [_split_parts(file_info['path'], tree.base_path)[-1] for file_info in node['files']],
+                   tree._stats_by_path[key])
+            queue.extend((index, child_name, f"{key}/{child_name}" if key else child_name, child)
+                         for child_name, child in node['dirs'].items())
+            index += 1
+
+
+@contextmanager
+def snapshot_lock(path: str):
+    """
+    Межпроцессная блокировка снимка (файл path + '.lock')
+
+    Воркеры, стартующие одновременно, по очереди загружают или строят
+    снимок, поэтому дерево из таблицы строит только первый из них.
+    """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def save_snapshot(tree, path: str, watermark: Dict) -> int:
+    """
+    Сохраняет построенное дерево в бинарный снимок
+
+    Файлы лежат по директориям подряд, атрибуты - в типизированных
+    массивах (статус - индекс в словаре статусов, булевы значения -
+    битовые множества), поэтому загрузка - это несколько копирований
+    массивов из mmap, а не разбор строк таблицы. Файл записывается во
+    временный и атомарно переименовывается: читатели (другие воркеры)
+    видят либо старый, либо новый снимок целиком.
+
+    Args:
+        tree (PhotoTree | CompactPhotoTree): Построенное дерево
+        path (str): Путь к файлу снимка
+        watermark (Dict): Отметка таблицы {'updated_at', 'count', 'deletes'}, снятая
+            до чтения строк, из которых построено дерево
+
+    Returns:
+        int: Размер снимка в байтах
+    """
+    dir_parent, dir_first, dir_count = array('i'), array('I'), array('I')
+    dir_names, dir_prefixes, dir_stats = [], [], []
+    names, status, nsfw = [], array('H'), array('d')
+    bits = {'nude': bytearray(), 'nude_null': bytearray(), 'face': bytearray(), 'face_null': bytearray()}
+    statuses: List[Optional[str]] = []
+    status_codes: Dict[Optional[str], int] = {}
+    overrides: Dict[int, str] = {}
+
+    for parent, name, files, file_names, stats in _walk(tree):
+        dir_parent.append(parent)
+        dir_first.append(len(names))
+        dir_count.append(len(files))
+        dir_names.append(name)
+        dir_stats.append(_stats_to_json(stats))
+        prefix = None
+        for file_info, file_name in zip(files, file_names):
+            index = len(names)
+            file_path = file_info['path']
+            if prefix is None and file_path.endswith(file_name):
+                prefix = file_path[:len(file_path) - len(file_name)]
+            if prefix is None or prefix + file_name != file_path:
+                overrides[index] = file_path
+            names.append(file_name)
+
+            code = status_codes.get(file_info['status'])
+            if code is None:
+                code = status_codes[file_info['status']] = len(statuses)
+                statuses.append(file_info['status'])
+            status.append(code)
+            score = file_info['nsfw_score']
+            nsfw.append(math.nan if score is None else score)
+
+            if index % 8 == 0:
+                for values in bits.values():
+                    values.append(0)
+            for attr, key in (('is_nude', 'nude'), ('has_face', 'face')):
+                value = file_info[attr]
+                if value is None:
+                    _set_bit(bits[f'{key}_null'], index, True)
+                elif value:
+                    _set_bit(bits[key], index, True)
+        dir_prefixes.append(prefix or '')
+
+    sections = {
+        'dir_parent': dir_parent.tobytes(),
+        'dir_first': dir_first.tobytes(),
+        'dir_count': dir_count.tobytes(),
+        'dir_names': '\0'.join(dir_names).encode('utf-8'),
+        'dir_prefixes': '\0'.join(dir_prefixes).encode('utf-8'),
+        'dir_stats': json.dumps(dir_stats, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+        'names': '\0'.join(names).encode('utf-8'),
+        'status': status.tobytes(),
+        'nsfw': nsfw.tobytes(),
+    }
+    sections.update((key, bytes(values)) for key, values in bits.items())
+
+    updated_at = watermark.get('updated_at')
+    header = {
+        'version': SNAPSHOT_VERSION,
+        'byteorder': sys.byteorder,
+        'itemsizes': {key: array(code).itemsize for key, code in _ARRAY_SECTIONS.items()},
+        'base_path': tree.base_path,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'watermark': {
+            'updated_at': updated_at.isoformat() if updated_at is not None else None,
+            'count': watermark.get('count'),
+            'deletes': watermark.get('deletes'),
+        },
+        'files': len(names),
+        'dirs': len(dir_names),
+        'statuses': statuses,
+        'overrides': {str(index): file_path for index, file_path in overrides.items()},
+        'sections': {},
+    }
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            offset = _PREFIX.size
+            f.write(b'\0' * offset)
+            for key, data in sections.items():
+                padding = -offset % _ALIGN
+                f.write(b'\0' * padding)
+                offset += padding
+                header['sections'][key] = [offset, len(data)]
+                f.write(data)
+                offset += len(data)
+            encoded = json.dumps(header, ensure_ascii=False).encode('utf-8')
+            f.write(encoded)
+            f.seek(0)
+            f.write(_PREFIX.pack(SNAPSHOT_MAGIC, offset, len(encoded)))
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return offset + len(encoded)
+
+
+def read_snapshot_header(path: str) -> Optional[Dict]:
+    """
+    Читает заголовок снимка, не загружая дерево
+
+    Returns:
+        Optional[Dict]: Заголовок или None, если снимка нет или он другой версии
+    """
+    try:
+        with open(path, 'rb') as f:
+            magic, offset, length = _PREFIX.unpack(f.read(_PREFIX.size))
+            if magic != SNAPSHOT_MAGIC:
+                return None
+            f.seek(offset)
+            header = json.loads(f.read(length))
+    except (OSError, struct.error, ValueError):
+        return None
+    if header.get('version') != SNAPSHOT_VERSION or header.get('byteorder') != sys.byteorder:
+        return None
+    return header
+
+
+def _read_array(view: memoryview, code: str) -> array:
+    values = array(code)
+    values.frombytes(view)
+    return values
+
+
+# Байт -> значения его восьми битов (младший бит - первый файл)
+_BYTE_BITS = [tuple(bool(byte >> bit & 1) for bit in range(8)) for byte in range(256)]
+
+
+def _unpack_bools(bits, null_bits, count: int) -> List[Optional[bool]]:
+    values = islice(chain.from_iterable(_BYTE_BITS[byte] for byte in bytes(bits)), count)
+    nulls = islice(chain.from_iterable(_BYTE_BITS[byte] for byte in bytes(null_bits)), count)
+    return [None if null else value for value, null in zip(values, nulls)]
+
+
+def _split_strings(view: memoryview, count: int) -> List[str]:
+    if not count:
+        return []
+    return bytes(view).decode('utf-8').split('\0')
+
+
+def _restore_photo_tree(tree: PhotoTree, header: Dict, sections: Dict):
+    names = _split_strings(sections['names'], header['files'])
+    dir_names = _split_strings(sections['dir_names'], header['dirs'])
+    dir_prefixes = _split_strings(sections['dir_prefixes'], header['dirs'])
+    dir_parent = _read_array(sections['dir_parent'], 'i')
+    dir_first = _read_array(sections['dir_first'], 'I')
+    dir_count = _read_array(sections['dir_count'], 'I')
+    dir_stats = json.loads(bytes(sections['dir_stats']))
+    # Колонки раскладываем целиком, а не по одному файлу
+    count = header['files']
+    statuses = header['statuses']
+    status = [statuses[code] for code in _read_array(sections['status'], 'H')]
+    nsfw = [None if score != score else score for score in _read_array(sections['nsfw'], 'd')]
+    nude = _unpack_bools(sections['nude'], sections['nude_null'], count)
+    face = _unpack_bools(sections['face'], sections['face_null'], count)
+    overrides = {int(index): file_path for index, file_path in header['overrides'].items()}
+
+    tree.tree = {"files": [], "dirs": {}}
+    tree._files_by_path = {}
+    tree._dirs_by_path = {}
+    tree._stats_by_path = {}
+    nodes, keys = [], []
+    for d, name in enumerate(dir_names):
+        parent = dir_parent[d]
+        if parent < 0:
+            node, key = tree.tree, ""
+        else:
+            node = {"files": [], "dirs": {}}
+            nodes[parent]['dirs'][name] = node
+            key = f"{keys[parent]}/{name}" if keys[parent] else name
+        nodes.append(node)
+        keys.append(key)
+        tree._dirs_by_path[key] = node
+        tree._stats_by_path[key] = _stats_from_json(dir_stats[d])
+
+        prefix, files = dir_prefixes[d], node['files']
+        for i in range(dir_first[d], dir_first[d] + dir_count[d]):
+            file_info = {
+                'path': overrides.get(i) or prefix + names[i],
+                'is_nude': nude[i],
+                'has_face': face[i],
+                'status': status[i],
+                'nsfw_score': nsfw[i],
+            }
+            files.append(file_info)
+        tree._files_by_path.update((file_info['path'], file_info) for file_info in files)
+
+
+def _restore_compact_tree(tree: CompactPhotoTree, header: Dict, sections: Dict):
+    tree._reset()
+    dir_names = _split_strings(sections['dir_names'], header['dirs'])
+    dir_prefixes = _split_strings(sections['dir_prefixes'], header['dirs'])
+    dir_parent = _read_array(sections['dir_parent'], 'i')
+    dir_first = _read_array(sections['dir_first'], 'I')
+    dir_count = _read_array(sections['dir_count'], 'I')
+    dir_stats = json.loads(bytes(sections['dir_stats']))
+
+    tree._names = _split_strings(sections['names'], header['files'])
+    tree._status = _read_array(sections['status'], 'H')
+    tree._nsfw = array('f', _read_array(sections['nsfw'], 'd'))
+    for key in ('nude', 'nude_null', 'face', 'face_null'):
+        setattr(tree, f'_{key}', bytearray(sections[key]))
+    tree._path_overrides = {int(index): file_path for index, file_path in header['overrides'].items()}
+    tree._status_names = list(header['statuses'])
+    tree._status_codes = {status: code for code, status in enumerate(tree._status_names)}
+
+    nodes = []
+    for d, name in enumerate(dir_names):
+        parent = dir_parent[d]
+        if parent < 0:
+            node = tree.root
+        else:
+            name = sys.intern(name)
+            node = nodes[parent].dirs[name] = DirNode(name, nodes[parent])
+        nodes.append(node)
+        node.prefix = sys.intern(dir_prefixes[d]) if dir_count[d] else None
+        node.files = array('I', range(dir_first[d], dir_first[d] + dir_count[d]))
+        node.stats = _stats_from_json(dir_stats[d])
+        tree._file_dir.extend([node] * dir_count[d])
+    tree._dir_count = len(nodes)
+
+
+def load_snapshot(tree, path: str) -> Optional[Dict]:
+    """
+    Загружает снимок в только что созданное дерево
+
+    Файл отображается в память только для чтения (mmap), массивы
+    копируются в дерево целиком, без разбора отдельных строк. Каждый
+    воркер получает свою изменяемую копию дерева (статусы патчатся на
+    месте), общей остается только память файла на время загрузки.
+
+    Args:
+        tree (PhotoTree | CompactPhotoTree): Пустое дерево с тем же base_path
+        path (str): Путь к файлу снимка
+
+    Returns:
+        Optional[Dict]: Заголовок снимка (с watermark) или None, если снимка
+            нет, он несовместим или поврежден; тогда дерево нужно строить заново
+    """
+    header = read_snapshot_header(path)
+    if header is None:
+        return None
+    if header['base_path'] != tree.base_path:
+        logger.info(f"Снимок дерева {path} построен для другого базового пути, пропускаем")
+        return None
+    if header['itemsizes'] != {key: array(code).itemsize for key, code in _ARRAY_SECTIONS.items()}:
+        return None
+
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            sections = {key: view[offset:offset + length]
+                        for key, (offset, length) in header['sections'].items()}
+            # Восстановление создает сотни тысяч объектов без циклов, сборщик
+            # мусора на это время отключаем, иначе он многократно обходит кучу
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                if isinstance(tree, CompactPhotoTree):
+                    _restore_compact_tree(tree, header, sections)
+                else:
+                    _restore_photo_tree(tree, header, sections)
+            finally:
+                if gc_enabled:
+                    gc.enable()
+                # mmap нельзя закрыть, пока на него есть memoryview
+                for section in sections.values():
+                    section.release()
+                view.release()
+    except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+        logger.warning(f"⚠️ Снимок дерева {path} поврежден: {str(e)}")
+        return None
+    return header
+
+
+def snapshot_watermark(header: Dict) -> Dict:
+    """
+    Отметка таблицы из заголовка снимка в формате Database.get_tree_watermark
+    """
+    watermark = dict(header['watermark'])
+    updated_at = watermark.get('updated_at')
+    watermark['updated_at'] = datetime.fromisoformat(updated_at) if updated_at else None
+    return watermark
@@ -0,0 +1,273 @@
+import time
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import UPSTREAM_REQUEST_SECONDS
+from config import (
+    PIGALLERY_AUTH_TOKEN, UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT,
+    UPSTREAM_MAX_CONCURRENCY, UPSTREAM_QUEUE_TIMEOUT, UPSTREAM_FAILURE_THRESHOLD,
+    UPSTREAM_RESET_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+# Ответ внешнего сервиса: статус, тело и заголовки
+UpstreamResponse = namedtuple('UpstreamResponse', ['status_code', 'content', 'headers'])
+
+
+class UpstreamError(Exception):
+    def __init__(self, message: str, status_code: int = 502, url: str = None):
+        """
+        Ошибка запроса к внешнему сервису
+
+        Args:
+            message (str): Описание ошибки
+            status_code (int): HTTP-статус для ответа клиенту
+            url (str): URL запроса
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.url = url
+
+
+class CircuitOpenError(UpstreamError):
+    def __init__(self, url: str = None, retry_after: float = 0):
+        """
+        Запрос не отправлен: внешний сервис недавно отвечал ошибками
+
+        Args:
+            url (str): URL запроса
+            retry_after (float): Через сколько секунд будет пробный запрос
+        """
+        super().__init__("Внешний сервис временно отключен после серии ошибок", 503, url)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = UPSTREAM_FAILURE_THRESHOLD,
+                 reset_timeout: float = UPSTREAM_RESET_TIMEOUT,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Размыкатель цепи для внешнего сервиса
+
+        После failure_threshold ошибок подряд запросы не отправляются
+        reset_timeout секунд, затем пропускается один пробный запрос:
+        успех замыкает цепь, ошибка снова размыкает ее.
+
+        Args:
+            failure_threshold (int): Сколько ошибок подряд размыкают цепь
+            reset_timeout (float): Сколько секунд цепь остается разомкнутой
+            clock (Callable): Источник времени (для тестов)
+        """
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    @property
+    def retry_after(self) -> float:
+        with self._lock:
+            return max(0.0, self._opened_at + self.reset_timeout - self.clock())
+
+    def allow(self) -> bool:
+        """
+        Можно ли отправить запрос; в полуоткрытом состоянии - только один пробный
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("✅ Внешний сервис снова отвечает, цепь замкнута")
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (self._state == self.CLOSED
+                                                 and self._failures >= self.failure_threshold):
+                if self._state == self.CLOSED:
+                    logger.warning(f"⚠️ Внешний сервис: {self._failures} ошибок подряд, "
+                                   f"цепь разомкнута на {self.reset_timeout:.0f} с")
+                self._state = self.OPEN
+                self._opened_at = self.clock()
+
+
+class UpstreamClient:
+    def __init__(self, name: str, headers: Optional[Dict[str, str]] = None,
+                 connect_timeout: float = UPSTREAM_CONNECT_TIMEOUT,
+                 read_timeout: float = UPSTREAM_READ_TIMEOUT,
+                 max_concurrency: int = UPSTREAM_MAX_CONCURRENCY,
+                 queue_timeout: float = UPSTREAM_QUEUE_TIMEOUT,
+                 breaker: Optional[CircuitBreaker] = None):
+        """
+        HTTP-клиент внешнего сервиса (pigallery2) для потоков Flask
+
+        Соединения переиспользуются через общую requests.Session (keep-alive,
+        пул не меньше max_concurrency). Одновременно выполняется не больше
+        max_concurrency запросов, остальные ждут слот не дольше queue_timeout.
+        Одинаковые запросы, пришедшие, пока первый еще выполняется, ждут его
+        результат, а не уходят в сервис повторно. Серия ошибок размыкает цепь
+        (см. CircuitBreaker), и запросы сразу завершаются CircuitOpenError.
+
+        Args:
+            name (str): Имя сервиса для метрик и логов
+            headers (Optional[Dict[str, str]]): Заголовки всех запросов
+            connect_timeout (float): Таймаут установки соединения (сек)
+            read_timeout (float): Таймаут ожидания данных (сек) на каждое чтение
+                из сокета, а не на весь ответ: сервис, отдающий тело медленно,
+                но без пауз дольше read_timeout, может держать запрос дольше
+            max_concurrency (int): Максимум одновременных запросов
+            queue_timeout (float): Сколько ждать свободный слот (сек)
+            breaker (Optional[CircuitBreaker]): Размыкатель цепи
+        """
+        self.name = name
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+        # Повторы не делаем: медленный сервис не должен держать поток дольше таймаута
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, max_concurrency), max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @property
+    def max_wait(self) -> float:
+        """
+        Сколько ждут результат запроса, присоединившиеся к уже выполняющемуся
+
+        Очередь, соединение и одно ожидание чтения; сам запрос может идти
+        дольше (read_timeout - не общий дедлайн), тогда ждущие получат 504.
+        """
+        return self.queue_timeout + self.connect_timeout + self.read_timeout
+
+    def get(self, url: str) -> UpstreamResponse:
+        """
+        Выполняет GET или присоединяется к такому же выполняющемуся запросу
+
+        Args:
+            url (str): URL запроса
+
+        Returns:
+            UpstreamResponse: Ответ сервиса (в том числе с кодом ошибки)
+
+        Raises:
+            UpstreamError: Если сервис недоступен, не ответил вовремя или перегружен
+        """
+        with self._lock:
+            future = self._inflight.get(url)
+            leader = future is None
+            if leader:
+                future = self._inflight[url] = Future()
+
+        if not leader:
+            started = time.perf_counter()
+            try:
+                return future.result(timeout=self.max_wait)
+            except FutureTimeoutError:
+                raise UpstreamError(f"{self.name}: нет ответа за {self.max_wait:.0f} с", 504, url)
+            finally:
+                UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                                 upstream=self.name, outcome='coalesced')
+
+        try:
+            response = self._fetch(url)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(response)
+            return response
+        finally:
+            with self._lock:
+                del self._inflight[url]
+
+    def _fetch(self, url: str) -> UpstreamResponse:
+        started = time.perf_counter()
+        outcome = 'error'
+        # Слот берем до проверки цепи, чтобы пробный запрос не застрял в очереди
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - started, upstream=self.name, outcome='busy')
+            raise UpstreamError(f"{self.name}: слишком много одновременных запросов", 503, url)
+        try:
+            if not self.breaker.allow():
+                outcome = 'circuit_open'
+                raise CircuitOpenError(url, self.breaker.retry_after)
+            try:
+                response = self.session.get(url, timeout=(self.connect_timeout, self.read_timeout))
+            except requests.Timeout as e:
+                outcome = 'timeout'
+                self.breaker.record_failure()
+                raise UpstreamError(f"{self.name}: таймаут запроса: {str(e)}", 504, url)
+            except requests.RequestException as e:
+                self.breaker.record_failure()
+                raise UpstreamError(f"{self.name}: ошибка запроса: {str(e)}", 502, url)
+            except BaseException:
+                # Любой исход пробного запроса должен быть учтен, иначе цепь
+                # останется полуоткрытой и больше не пропустит ни одного запроса
+                self.breaker.record_failure()
+                raise
+
+            # 4xx - ответ исправного сервиса, цепь размыкают только 5xx
+            if response.status_code >= 500:
+                outcome = 'http_error'
+                self.breaker.record_failure()
+            else:
+                outcome = 'ok'
+                self.breaker.record_success()
+            return UpstreamResponse(response.status_code, response.content, response.headers)
+        finally:
+            self._slots.release()
+            UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - started, upstream=self.name, outcome=outcome)
+
+    def close(self):
+        self.session.close()
+
+
+_pigallery_client: Optional[UpstreamClient] = None
+_client_lock = threading.Lock()
+
+
+def get_pigallery_client() -> UpstreamClient:
+    """
+    Возвращает общий для процесса клиент pigallery2
+    """
+    global _pigallery_client
+    with _client_lock:
+        if _pigallery_client is None:
+            _pigallery_client = UpstreamClient('pigallery2', headers={
+                'Authorization': f'Bearer {PIGALLERY_AUTH_TOKEN}',
+                'User-Agent': 'PhotoAdmin/1.0'
+            })
+        return _pigallery_client